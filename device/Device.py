@@ -1,9 +1,10 @@
 
 import asyncio
+import copy
+import hmac
 import json
 import os
 import pytz
-import queue
 import requests
 import shutil
 import socket
@@ -14,8 +15,8 @@ import time
 import uuid 
 import yaml
 
-from multiprocessing import Manager, Pool
-from flask import jsonify, send_from_directory
+from multiprocessing import Manager
+from flask import jsonify, send_file, send_from_directory
 from flask import request 
 from flask_socketio import SocketIO
 from threading import Lock
@@ -24,13 +25,31 @@ from typing import List, cast
 from zeroconf import ServiceBrowser, ServiceStateChange
 from zeroconf.asyncio import AsyncServiceInfo, AsyncZeroconf
 
+from device.autoscale import Autoscaler
+from device.broadcast import Broadcaster
+from device.catalog import Catalog, entry_key
+from device.config_diff import KNOWN_KEYS, ConfigDiff
 from device.debug_print import debug_print
+from device.extractors import PENDING, ExtractorStats, find_extractor
+from device.live import LiveTails, create_live_entry
+from device.quarantine import Quarantine
+from device.rules import FileRules
+from device.scan import ScanScheduler
+from device.scheduler import DeviceScheduler
+from device.stability import StabilityDetector
+from device.storage import StorageGovernor
+from device.throttle import ResourceGovernor
 from device.SocketIOTQDM import  MultiTargetSocketIOTQDM
 from device.utils import get_source_by_mac_address, pbar_thread, address_in_list
-from device.workers import SendWorkerArg, hash_worker, metadata_worker, reindex_worker, send_worker
+from device.workers import BundleWorkerArg, SendWorkerArg, details_worker, hash_worker, metadata_worker, reindex_worker, send_worker, transfer_worker
 import device.reindexMCAP as reindexMCAP
+import device.wire as wire
 from device.__version__ import __version__
 
+# config values that /get_config does not reveal
+SECRET_KEYS = ("API_KEY_TOKEN",)
+REDACTED = "********"
+
 
 class Device:
     def __init__(self, filename: str, local_dashboard_sio:SocketIO, salt=None) -> None:
@@ -55,17 +74,50 @@ class Device:
         self.m_config["servers"] = self.m_config.get("servers", [])
         self.m_computeMD5 = self.m_config.get("computeMD5", True)
         self.m_chunk_size = self.m_config.get("chunk_size", 8192*1024)
+        self.m_live_quiet_s = float(self.m_config.get("live_quiet_s", 30))
+        self.m_state_dir = self.m_config.get("state_dir", os.path.join(os.path.dirname(os.path.abspath(filename)), "state"))
+        self.m_storage = StorageGovernor(self.m_state_dir, 
+                                         float(self.m_config.get("low_water_pct", 10)), 
+                                         float(self.m_config.get("high_water_pct", 20)), 
+                                         self.m_config.get("purge", False))
+        self.m_quarantine = Quarantine(self.m_state_dir)
+        self.m_quarantine_reported = None
+        self.m_rules = FileRules(self.m_config)
+        self.m_stability = StabilityDetector(self.m_config.get("watch", []), self.m_live_quiet_s, self.m_config.get("detect_writers", True))
         self.m_local_tz = self.m_config.get("local_tz", "America/New_York")
+        self.m_pull_port = int(os.environ.get("CONFIG_PORT") or 8811)
 
         if salt:
             self.m_config["source"] += str(salt)
 
         self.m_signal = {} # server address -> Event(). Signals when to cancel a transfer
+        self.m_live_tails = LiveTails(self._on_tail_done, self.m_stability.is_open_for_write, 
+                                      int(self.m_config.get("live_max_tails", 8)))
         self.m_fs_info = {}
         self.m_send_offsets = {}
         self.m_send_lock = {}
-        self.m_files = None
+        self.m_catalog = Catalog()
+        # the last catalog, so a server gets one as soon as it connects. The scan reconciles it
+        self.m_catalog_file = os.path.join(self.m_state_dir, "catalog.json")
+        loaded = self.m_catalog.load(self.m_catalog_file)
+        if loaded > 0:
+            debug_print(f"Loaded {loaded} files from {self.m_catalog_file}")
+        self.m_catalog_saved = (self.m_catalog.epoch, self.m_catalog.seq)
+        self.m_catalog_save_lock = Lock()
+        self.m_server_catalog = {} # server address -> (epoch, seq) of the last catalog sent
+        self.m_server_encoding = {} # server address -> negotiated catalog encoding
+        self.m_server_capabilities = {} # server address -> list of optional features the server supports ("bundle", "catalog_delta", "live")
+        self.m_broadcast = Broadcaster(int(self.m_config.get("max_pending_mb", 16)) * 1024 * 1024)
+        self.m_throttle = ResourceGovernor(self.m_config.get("throttle"))
+        self.m_scheduler = DeviceScheduler(self.m_config["threads"], self.m_config.get("device_concurrency"))
+        self.m_scheduler.set_limiter(self.m_throttle.limit)
+        self.m_autoscaler = Autoscaler(self.m_config["threads"], self.m_config.get("autoscale"))
+        self.m_scheduler.set_autoscaler(self.m_autoscaler)
         self.m_md5 = {}
+        self.m_details_lock = Lock()
+        self.m_details = {}  # (dirroot, filename) -> entry still waiting for its expensive metadata
+        self.m_details_running = False
+        self.m_extractor_stats = ExtractorStats()
         self.m_updates = {}
         self.m_server = None
 
@@ -95,11 +147,8 @@ class Device:
         # list of connected servers
         self.m_connected_servers = []
 
-        # thread to do scaning.  
-        self.m_scan_thread = None 
-        self.m_reindex_thread = None 
-        self.m_metadata_thread = None 
-        self.m_hash_thread = None 
+        # runs the scans, one at a time
+        self.m_scan = ScanScheduler(self._scan, self.m_local_dashboard_sio.start_background_task, float(self.m_config.get("scan_delay_s", 1)))
         self.m_send_threads = {}
 
     ## Zero Config
@@ -211,6 +260,7 @@ class Device:
         debug_print((data, server_address))
         if server_address in self.m_signal:
             self.m_signal[server_address].set()
+        self.m_live_tails.cancel(server_address)
 
     def _on_keep_alive_ack(self):
         pass
@@ -261,35 +311,15 @@ class Device:
 
     def _include(self, filename: str) -> bool:
         """
-        Check if a file should be included based on its suffix.
-
-        This method checks the file's suffix against the include and exclude suffix lists in the configuration.
-        If an include suffix list is present, the file must match one of the suffixes to be included.
-        If an exclude suffix list is present, the file will be excluded if it matches any of the suffixes.
+        Check if a file should be included, by its name.  See FileRules.include()
 
         Args:
-            filename (str): The name of the file to check.
+            filename (str): The name of the file to check, relative to its watch directory.
 
         Returns:
             bool: True if the file should be included, False otherwise.
         """
-        if filename.startswith("."):
-            return False
-
-        if filename.startswith("_"):
-            return False 
-
-        if "include_suffix" in self.m_config:
-            for suffix in self.m_config["include_suffix"]:
-                if filename.endswith(suffix):
-                    return True
-            return False
-        
-        if "exclude_suffix" in self.m_config:
-            for suffix in self.m_config["exclude_suffix"]:
-                if filename.endswith(suffix):
-                    return False
-            return True
+        return self.m_rules.include(filename)
 
     def _remove_dirpath(self, filename:str):
         """Strips dirpath from a filename
@@ -314,62 +344,205 @@ class Device:
     def _emit_to_all_servers(self, event:str, msg:any):
         """Send a message to all of the connected servers
 
+        The message is queued for each server. 
+
+        Args:
+            event (str): event
+            msg (any): message
+        """
+        self.m_broadcast.emit(event, msg)
+
+    def _emit_to_server(self, server:str, event:str, msg:any):
+        """Send a message to a single connected server
+
         Args:
+            server (str): server address 
             event (str): event
             msg (any): message
         """
-        for sio in self.server_sio.values():
-            if sio and sio.connected:
-                sio.emit(event, msg)
+        self._emit_batch_to_server(server, [(event, msg)])
+
+    def _emit_batch_to_server(self, server:str, messages:list):
+        """Send messages to a single connected server, back to back
+
+        Args:
+            server (str): server address 
+            messages (list): List[Tuple[event, msg]]
+        """
+        if self.m_broadcast.emit_batch(messages, to=[server]) == 0:
+            debug_print(f"Not connected to {server}, dropped {', '.join(sorted(set(event for event, _ in messages)))}")
+
+    def _socket_events(self, event:str) -> list:
+        """The socket_events for a progress bar, for the local dashboard and all servers
+
+        Progress updates to a server that is behind are dropped, so a slow
+        server does not hold up the others.
+
+        Args:
+            event (str): event
+
+        Returns:
+            list: List[Tuple[socket, event, room|None]]
+        """
+        return [(self.m_local_dashboard_sio, event, None), (self.m_broadcast.target(lossy=True), event, None)]
+
+    def _task_timeout(self, stage: str) -> float:
+        """Deadline in seconds for a single task of a stage, 0 for none"""
+        defaults = {"reindex": 600, "metadata": 120, "hash": 0, "details": 600}
+        timeouts = self.m_config.get("task_timeout_s", {}) or {}
+        return float(timeouts.get(stage, defaults.get(stage, 0)))
+
+    def _max_tasks_per_worker(self) -> int:
+        """Tasks a pool worker runs before it is replaced, None for no limit"""
+        return int(self.m_config.get("max_tasks_per_worker", 0)) or None
+
+    def _report_quarantine(self):
+        """Tell the servers and the local dashboard about quarantined files, when the list changes"""
+        files = self.m_quarantine.entries()
+        if files == self.m_quarantine_reported:
+            return
+        self.m_quarantine_reported = files
+
+        msg = {"source": self.m_config["source"], "room": self.m_config["source"], "files": files}
+        self._emit_to_all_servers("device_quarantine", msg)
+        for entry in files:
+            self.m_local_dashboard_sio.emit("status", {"msg": f"Quarantined {entry['fullpath']} ({entry['stage']} {entry['reason']})"})
+
+    def _walk(self, scope: List[str] = None, announce: bool = True) -> list:
+        """Find the files to scan
+
+        Walks the watch directories, or only the parts of them that are in scope.
+
+        Args:
+            scope (List[str], optional): directories and files to look at. None for every watch directory.
+            announce (bool): Show the directories being walked on the servers' status.
+
+        Returns:
+            list: List[Tuple[dirroot, filename, fullpath, size]] of the files that pass the FileRules
+        """
+        rtn = []
+        for dirroot in self.m_config["watch"]:
+            if scope is None:
+                starts = [dirroot]
+            else:
+                starts = [path for path in scope if path == dirroot or path.startswith(os.path.join(dirroot, ""))]
+
+            for start in starts:
+                if announce:
+                    self._emit_to_all_servers("device_status", {"source": self.m_config["source"], "msg": f"Scanning {start} for files", "room": self.m_config["source"]})
+                for root, basename, filename in self.m_rules.walk(dirroot, start):
+                    fullpath = os.path.join(root, basename)
+                    try:
+                        stat = os.stat(fullpath)
+                    except OSError:
+                        continue
+                    if not self.m_rules.keep(stat.st_size, stat.st_mtime):
+                        continue
+                    rtn.append((dirroot, filename, fullpath, stat.st_size))
+
+        if announce:
+            self._emit_to_all_servers("device_status", {"source": self.m_config["source"], "room": self.m_config["source"]})
+        return rtn
+
+    def _scan(self, scope: List[str], generation: int):
+        """Run one scan.  Only called by the ScanScheduler, so only one runs at a time
+
+        * Find the files with _walk()
+        * Files that are still being written get a live entry, and are deferred
+        * Repair MCAP files with _background_reindex()
+        * Generate the cheap metadata with _background_metadata()
+        * Generate hashes with _background_hash()
+        * Update the catalog (only the part in scope, for a scoped scan) and call emitFiles()
+        * Queue the entries that still need their expensive metadata, see _request_details()
+
+        Args:
+            scope (List[str]): directories and files to scan, None for everything
+            generation (int): scan generation
+        """
+        self._emit_scan_status()
+        robot_name = self.m_config.get("robot_name", None)
+
+        files = []
+        live_entries = []
+        for dirroot, filename, fullpath, size in self._walk(scope):
+            if self.m_stability.is_active(fullpath):
+                # metadata and hash would be stale in a few seconds
+                self.m_stability.defer(fullpath)
+                live_entries.append(create_live_entry(fullpath, filename, dirroot, size, robot_name))
+                continue
+            files.append((dirroot, filename, fullpath, size))
+        debug_print(f"Scan {generation} found {len(files)} files, {len(live_entries)} still being written")
+
+        self._background_reindex([fullpath for _, _, fullpath, _ in files])
+        entries = self._background_metadata(files)
+        entries = self._background_hash(entries) + live_entries
+
+        if scope is None:
+            self.m_catalog.replace(entries)
+        else:
+            # files in scope that were not found are gone
+            found = set(entry_key(entry) for entry in entries)
+            prefixes = tuple(os.path.join(path, "") for path in scope)
+            gone = []
+            for entry in self.m_catalog.entries():
+                fullpath = os.path.join(entry["dirroot"], entry["filename"])
+                if (fullpath in scope or fullpath.startswith(prefixes)) and entry_key(entry) not in found:
+                    gone.append(entry_key(entry))
+            self.m_catalog.update(entries)
+            self.m_catalog.remove(gone)
+        self._save_catalog()
+
+        self._report_quarantine()
+        self._emit_scan_status(generation)
+        self.emitFiles()
+        self._request_details([entry for entry in entries if entry.get(PENDING)])
+
+    def _save_catalog(self):
+        """Write the catalog to m_catalog_file, if it changed since the last time
+
+        Live entries are left out, the recordings may be gone or complete by the next start.
+        """
+        with self.m_catalog_save_lock:
+            version = (self.m_catalog.epoch, self.m_catalog.seq)
+            if version == self.m_catalog_saved:
+                return
+            if self.m_catalog.save(self.m_catalog_file, keep=lambda entry: not entry.get("live")):
+                self.m_catalog_saved = version
+
+    def _emit_scan_status(self, completed: int = None):
+        """Tell the servers about the scans ("device_scan_status")
+
+        Args:
+            completed (int, optional): generation of the scan that just completed
+        """
+        msg = self.m_scan.status()
+        if completed is not None:
+            msg["generation"] = completed
+        msg.update({"source": self.m_config["source"], "room": self.m_config["source"]})
+        self._emit_to_all_servers("device_scan_status", msg)
 
-    def _background_reindex(self):
+    def _background_reindex(self, all_files: List[str]):
         """Reindex MCAP files
 
-        * Insure only one instance of reindexing
-        * Find all MCAP files
-        * Test each file to see if it can be opened, saving list of ones that fail
+        * Test each MCAP file to see if it can be opened, saving list of ones that fail
         * Reindex in multiprocessing.Pool via reindex_worker()  
-        * call background_metadata on completion.   
-        """
-        if self.m_reindex_thread is not None:
-            debug_print("already reindexing")
-            return 
-        
-        # placeholder to keep the other threads out
-        self.m_reindex_thread = True 
 
-        all_files = []
+        Args:
+            all_files (List[str]): full paths of the files found by the scan
+        """
         event = "device_status_tqdm"
-        socket_events = [(self.m_local_dashboard_sio, event, None)]
-        for sio in self.server_sio.values():
-            if sio and sio.connected:
-                socket_events.append((sio, event, None))
+        socket_events = self._socket_events(event)
         bad_files = []
         total_size = 0
 
         source = self.m_config["source"]
-        max_threads = self.m_config["threads"]
-        message_queue = queue.Queue()
+        max_threads = self.m_scheduler.pool_size("reindex")
         desc = "reindex"
 
-        self._emit_to_all_servers("device_status", {"source": self.m_config["source"], "msg": "Scanning for files", "room": self.m_config["source"]})
-        for dirroot in self.m_config["watch"]:
-            self._emit_to_all_servers("device_status", {"source": self.m_config["source"], "msg": f"Scanning {dirroot} for files", "room": self.m_config["source"]})
-            for root, _, files in os.walk(dirroot):
-                for basename in files:
-                    if not self._include(basename):
-                        continue                    
-
-                    if basename.endswith(".mcap"):
-                        filename = os.path.join(root, basename)
-                        if os.path.exists(filename) and os.path.getsize(filename) > 0:
-                            all_files.append(filename)
-                            
-        debug_print(f"Scan complete, with {len(all_files)}")
-        self._emit_to_all_servers("device_status", {"source": self.m_config["source"], "room": self.m_config["source"]})        
-
-        with MultiTargetSocketIOTQDM(total=len(all_files), desc="Scanning files", position=0, leave=False, source=self.m_config["source"], socket_events=socket_events) as main_pbar:
-            for fullpath in all_files:
+        mcap_files = [fullpath for fullpath in all_files if fullpath.endswith(".mcap") and os.path.getsize(fullpath) > 0]
+
+        with MultiTargetSocketIOTQDM(total=len(mcap_files), desc="Scanning files", position=0, leave=False, source=self.m_config["source"], socket_events=socket_events) as main_pbar:
+            for fullpath in mcap_files:
                 if not reindexMCAP.test_mcap_file(fullpath):
                     bad_files.append(fullpath)
                     total_size += os.path.getsize(fullpath)
@@ -379,120 +552,173 @@ class Device:
             with Manager() as manager:
                 message_queue = manager.Queue()
                 repaired_files = []
-                pool_queue = [ (message_queue, filename) for filename in bad_files ]
+                pool_queue = [ (filename, (message_queue, filename)) for filename in bad_files ]
                 thread = Thread(target=pbar_thread, args=(message_queue, total_size, source, socket_events, desc, max_threads))    
                 thread.start()
 
                 try:
-                    with Pool(max_threads) as pool:
-                        for name, status in pool.imap_unordered(reindex_worker, pool_queue):
+                    with self.m_throttle.pool(max_threads, self._max_tasks_per_worker()) as pool:
+                        for name, status in self.m_scheduler.run(pool, reindex_worker, pool_queue, stage="reindex", 
+                                                                          timeout_s=self._task_timeout("reindex"), quarantine=self.m_quarantine):
                             repaired_files.append((name, status))
                 finally:
                     message_queue.put({"close": True})
 
-        self.m_reindex_thread = None
-        self._background_metadata()
-
-    def _background_metadata(self):
+    def _background_metadata(self, all_files: list) -> List[dict]:
         """Generate metadata for each file.  
 
-        * Insure only one instance of metadata is running
-        * Scan the watch directory for all files that pass _include()
-        * Genenerate metadata in multiprocessing.Pool via metadata_worker()
-        * Call background_hash on completion. 
-        """
+        Genenerates metadata in multiprocessing.Pool via metadata_worker()
 
-        debug_print("enter")
-        if self.m_metadata_thread is not None:
-            debug_print("already doing metadata scan")
-            return 
-        self.m_metadata_thread = True 
+        Args:
+            all_files (list): List[Tuple[dirroot, filename, fullpath, size]]
 
-        all_files = []
+        Returns:
+            List[dict]: device entries
+        """
+        robot_name = self.m_config.get("robot_name", None)
         event = "device_status_tqdm"
-        socket_events = [(self.m_local_dashboard_sio, event, None)]
-        for sio in self.server_sio.values():
-            if sio and sio.connected:
-                socket_events.append((sio, event, None))
-        total_size = 0
+        socket_events = self._socket_events(event)
+        total_size = sum(size for _, _, _, size in all_files)
+        entries = []
 
         source = self.m_config["source"]
-        max_threads = self.m_config["threads"]
+        max_threads = self.m_scheduler.pool_size("metadata")
         desc = "Get Metadata"
 
-        self._emit_to_all_servers("device_status", {"source": self.m_config["source"], "msg": "Scanning for files", "room": self.m_config["source"]})
-        for dirroot in self.m_config["watch"]:
-            self._emit_to_all_servers("device_status", {"source": self.m_config["source"], "msg": f"Scanning {dirroot} for files", "room": self.m_config["source"]})
-            for root, _, files in os.walk(dirroot):
-                for basename in files:
-                    if not self._include(basename):
-                        continue
-                    
-                    filename = os.path.join(root, basename).replace(dirroot, "")
-                    filename = filename.strip("/")
-                    fullpath = os.path.join(root, basename)
-                    all_files.append((dirroot, filename, fullpath))
-                    total_size += os.path.getsize(fullpath)
-
-        self._emit_to_all_servers("device_status", {"source": self.m_config["source"], "room": self.m_config["source"]})        
-
         if len(all_files) > 0:
             with Manager() as manager:
-                robot_name = self.m_config.get("robot_name", None)
                 message_queue = manager.Queue()
                 updates = manager.dict(self.m_updates)
-                entries = []
+                costs = manager.list()
 
-                pool_queue = [ (message_queue, dirroot, filename, fullpath, robot_name, self.m_local_tz, updates) for (dirroot, filename, fullpath) in all_files ]
+                pool_queue = [ (fullpath, (message_queue, dirroot, filename, fullpath, robot_name, self.m_local_tz, updates, costs)) for (dirroot, filename, fullpath, _) in all_files ]
                 thread = Thread(target=pbar_thread, args=(message_queue, total_size, source, socket_events, desc, max_threads))    
                 thread.start()
 
                 try:
-                    with Pool(max_threads) as pool:
-                        for entry in pool.imap_unordered(metadata_worker, pool_queue):
+                    with self.m_throttle.pool(max_threads, self._max_tasks_per_worker()) as pool:
+                        for entry in self.m_scheduler.run(pool, metadata_worker, pool_queue, stage="metadata", 
+                                                                   timeout_s=self._task_timeout("metadata"), quarantine=self.m_quarantine):
                             if entry:
                                 entries.append(entry)                                
                 finally:
                     message_queue.put({"close": True})
-
-                self.m_files = entries
+                    self.m_extractor_stats.record(list(costs))
         else:
             debug_print("No files")
 
-        self.m_metadata_thread = None
-        self._background_hash()
+        return entries
+
+    def _request_details(self, entries: List[dict]):
+        """Queue entries for the details stage, which fills in their expensive metadata
+
+        The details stage runs after the scan, in its own small pool, so the
+        catalog is sent with the cheap fields first.
+
+        Args:
+            entries (List[dict]): device entries with PENDING set
+        """
+        if len(entries) == 0:
+            return
+        with self.m_details_lock:
+            for entry in entries:
+                self.m_details[entry_key(entry)] = entry
+            if self.m_details_running:
+                return
+            self.m_details_running = True
+        self.m_local_dashboard_sio.start_background_task(self._details_loop)
+
+    def _details_loop(self):
+        while True:
+            with self.m_details_lock:
+                if len(self.m_details) == 0:
+                    self.m_details_running = False
+                    return
+                entries = list(self.m_details.values())
+                self.m_details = {}
+            try:
+                self._background_details(entries)
+            except Exception as e:
+                debug_print(f"Details failed: {e}")
+
+    def _background_details(self, entries: List[dict]):
+        """Fill in the expensive metadata of entries, via details_worker()
+
+        The catalog is updated and sent every few seconds while it runs.
+        The shards of a rosbag2 bag are queued together, so a bag is read as
+        one run.
 
-    def _background_hash(self):
+        Args:
+            entries (List[dict]): device entries with PENDING set
+        """
+        debug_print(f"Details for {len(entries)} files")
+        entries = sorted(entries, key=lambda entry: (entry["dirroot"], entry.get("bag", entry["filename"]), entry["filename"]))
+        max_threads = self.m_scheduler.pool_size("details")
+        pool_queue = [ (os.path.join(entry["dirroot"], entry["filename"]), (entry, self.m_local_tz)) for entry in entries ]
+
+        results = []
+        last_update = time.time()
+        with self.m_throttle.pool(max_threads, self._max_tasks_per_worker()) as pool:
+            for result in self.m_scheduler.run(pool, details_worker, pool_queue, ordered=False, stage="details",
+                                               timeout_s=self._task_timeout("details"), quarantine=self.m_quarantine):
+                if result:
+                    results.append(result)
+                if time.time() - last_update > 5:
+                    self._apply_details(results)
+                    results = []
+                    last_update = time.time()
+        self._apply_details(results)
+
+    def _apply_details(self, results: List[tuple]):
+        """Put the results of details_worker() in the catalog
+
+        A result is dropped if the catalog entry changed in the meantime
+        (e.g. the file was scanned again).  A file whose metadata could not
+        be read is removed, as the metadata stage does.
+
+        Args:
+            results (List[tuple]): [((dirroot, filename), entry or None, costs)]
+        """
+        completed = []
+        gone = []
+        for key, entry, costs in results:
+            self.m_extractor_stats.record(costs)
+            current = self.m_catalog.get(key)
+            if current is None or not current.get(PENDING):
+                continue
+            if entry is None:
+                gone.append(key)
+            elif entry.get("size") == current.get("size"):
+                completed.append(dict(entry, md5=current.get("md5")))
+
+        changed = self.m_catalog.update(completed) + self.m_catalog.remove(gone)
+        if changed > 0:
+            self._save_catalog()
+            self.emitFiles()
+
+    def _background_hash(self, entries: List[dict]) -> List[dict]:
         """Generate the hash for each file
 
-        * Insure that only one instance is running
-        * Scan the watch directory for all files that pass _include()
-        * Genenerate hash in multiprocessing.Pool via hash_worker()
-        * Call emitFiles() on completion. 
+        Genenerates the hash in multiprocessing.Pool via hash_worker()
+
+        Args:
+            entries (List[dict]): device entries from _background_metadata()
+
+        Returns:
+            List[dict]: the entries, with "md5" set
         """
-        if self.m_hash_thread is not None:
-            debug_print("Already doing hash creation")
-            return 
-        
-        if self.m_files is None or len(self.m_files) == 0:
-            debug_print("No files")
-            return 
-            
-        self.m_hash_thread = True 
-        # debug_print(self.m_files[0])
-        entries = self.m_files.copy()
+        if len(entries) == 0:
+            return []
 
         event = "device_status_tqdm"
-        socket_events = [(self.m_local_dashboard_sio, event, None)]
-        for sio in self.server_sio.values():
-            if sio and sio.connected:
-                socket_events.append((sio, event, None))
+        socket_events = self._socket_events(event)
         total_size = 0
 
         source = self.m_config["source"]
-        max_threads = self.m_config["threads"]
-        message_queue = queue.Queue()
+        max_threads = self.m_scheduler.pool_size("hash")
+        direct_io = self.m_config.get("direct_io", False)
         desc = "Get File Hash"
+        hashed = []
 
         with Manager() as manager:
             message_queue = manager.Queue()
@@ -505,36 +731,33 @@ class Device:
                 if os.path.exists(filename):
                     total_size += os.path.getsize(filename)
                 
-            pool_queue = [ (message_queue, entry, self.m_chunk_size) for entry in entries ]
-            entries = []
+            pool_queue = [ (os.path.join(entry["dirroot"], entry["filename"]), (message_queue, entry, self.m_chunk_size, direct_io)) for entry in entries ]
 
             thread = Thread(target=pbar_thread, args=(message_queue, total_size, source, socket_events, desc, max_threads))    
             thread.start()
 
             try:
-                with Pool(max_threads) as pool:
-                    for i, entry in enumerate(pool.imap_unordered(hash_worker, pool_queue)):
+                with self.m_throttle.pool(max_threads, self._max_tasks_per_worker()) as pool:
+                    for i, entry in enumerate(self.m_scheduler.run(pool, hash_worker, pool_queue, stage="hash", 
+                                                                               timeout_s=self._task_timeout("hash"), quarantine=self.m_quarantine)):
                         if entry:
-                            entries.append(entry)
+                            hashed.append(entry)
             finally:
                 message_queue.put({"close": True})
 
-        self.m_files = entries
-        self.m_hash_thread = None
+        return hashed
 
-        self.emitFiles()
+    def _background_scan(self, scope: List[str] = None, join: bool = False) -> int:
+        """Ask the ScanScheduler for a scan, see _scan()
 
-    def _background_scan(self):
-        """Wrapper to run file scan in background
+        Args:
+            scope (List[str], optional): directories and files to scan. None for everything.
+            join (bool): A scan that is already running is good enough.
 
-        * Launches _background_reindex() as async function
-          * Does reindexing
-          * Calls _background_metadata
-          * Calls _background_hash
-          * Calls emitFiles()
+        Returns:
+            int: generation of the scan that will cover this request
         """
-        self.m_local_dashboard_sio.start_background_task(self._background_reindex)
-        pass 
+        return self.m_scan.request(scope, join)
 
     def _background_send_files(self, server:str, filelist:list):
         """Send a filelist to a server
@@ -546,7 +769,10 @@ class Device:
         * offset_b: offset in bytes. 0 if new file, otherwise length of server's partial for this file
         * file_size: Total file size in bytes for this file
 
-        Sends files using multiprocessing.Pool via send_worker()
+        Sends files using multiprocessing.Pool via send_worker().  Small files
+        are sent in bundles via bundle_worker() when the server supports it. 
+        Files that are still being recorded are handed to LiveTails, and
+        are not waited for.
         
         Args:
             server (str): address of connected server
@@ -561,23 +787,40 @@ class Device:
             debug_print(f"No files from {server}")
             return 
 
+        # when the disk is filling up, send the files that free the most space first
+        filelist = self.m_storage.prioritize(filelist, self.m_config["watch"])
+
         url = f"http://{server}/file"
         source = self.m_config["source"]
         api_key_token = self.m_config["API_KEY_TOKEN"]
         split_size_gb = int(self.m_config.get("split_size_gb", 1))
         chunk_size_mb = int(self.m_config.get("chunk_size_mb", 1))
         read_size_b = chunk_size_mb * 1024 * 1024
-        max_threads = self.m_config["threads"]
+        max_threads = self.m_scheduler.pool_size("send")
+        direct_io = self.m_config.get("direct_io", False)
         desc = "File Transfer"
 
         # send message to each connected server. 
         event = "device_status_tqdm"
-        socket_events = [(self.m_local_dashboard_sio, event, None)]
-        for sio in self.server_sio.values():
-            if sio and sio.connected:
-                socket_events.append((sio, event, None))
+        socket_events = self._socket_events(event)
         total_size = 0
 
+        # files that are still being recorded are sent as they grow, by their own tail. Only to servers
+        # that take the partial ranges ("live" in their capabilities), any other would store a truncated file
+        if self.m_config.get("live_upload", False) and "live" in self.m_server_capabilities.get(server, []):
+            recorded = []
+            for idx, (dirroot, relative_path, upload_id, offset_b, file_size) in enumerate(filelist):
+                if not self.m_stability.is_active(os.path.join(dirroot, relative_path)):
+                    recorded.append((dirroot, relative_path, upload_id, offset_b, file_size))
+                    continue
+                name = f"{upload_id}_{idx}_{os.path.basename(relative_path)}" 
+                args = SendWorkerArg(None, dirroot, relative_path, upload_id, 
+                                     offset_b, file_size, None, server, None, 
+                                     split_size_gb, api_key_token, name, url, source, read_size_b,
+                                     True, self.m_live_quiet_s, direct_io)
+                self.m_live_tails.start(args, self._socket_events("device_status_tqdm"), source)
+            filelist = recorded
+
         # compute the total number of bytes to send, for the progress bar. 
         for  _, _, _, offset_b, file_size in filelist:
             total_size += file_size - offset_b
@@ -586,27 +829,60 @@ class Device:
             message_queue = manager.Queue()
             self.m_signal[server] = manager.Event()
             shared_offsets = manager.dict(self.m_send_offsets)
-            pool_queue = []
+            signal = self.m_signal[server]
             files = []
 
-            for idx, (dirroot, relative_path, upload_id, offset_b, file_size) in enumerate(filelist):
+            def make_send_args(idx, dirroot, relative_path, upload_id, offset_b, file_size):
                 name = f"{upload_id}_{idx}_{os.path.basename(relative_path)}" 
-                signal = self.m_signal[server]
-                args = SendWorkerArg(message_queue, dirroot, relative_path, upload_id, 
+                return SendWorkerArg(message_queue, dirroot, relative_path, upload_id, 
                                      offset_b, file_size, signal, server, shared_offsets, 
-                                     split_size_gb, api_key_token, name, url, source, read_size_b)
-                pool_queue.append(args)
+                                     split_size_gb, api_key_token, name, url, source, read_size_b,
+                                     False, self.m_live_quiet_s, direct_io)
+
+            pool_queue = []
+            bundles = self._make_bundles(server, filelist)
+            bundled = set()
+            for idx, bundle in enumerate(bundles):
+                name = f"bundle_{idx}_{uuid.uuid4().hex[:8]}"
+                pool_queue.append((os.path.join(bundle[0][0], bundle[0][1]), 
+                                   BundleWorkerArg(message_queue, bundle, signal, server, api_key_token, name, f"http://{server}/bundle", source,
+                                                   read_size_b, direct_io)))
+                bundled.update(upload_id for _, _, upload_id, _, _ in bundle)
+
+            for idx, (dirroot, relative_path, upload_id, offset_b, file_size) in enumerate(filelist):
+                if upload_id in bundled:
+                    continue
+                pool_queue.append((os.path.join(dirroot, relative_path), 
+                                   make_send_args(idx, dirroot, relative_path, upload_id, offset_b, file_size)))
 
             thread = Thread(target=pbar_thread, args=(message_queue, total_size, source, socket_events, desc, max_threads))    
             thread.start()
 
-            with Pool(max_threads) as pool:
+            with self.m_throttle.pool(max_threads, self._max_tasks_per_worker()) as pool:
                 try:
-                    for result in pool.imap_unordered(send_worker, pool_queue):
+                    retry = []
+                    gone = []
+                    # keep the storage governor's order within each disk
+                    for result in self.m_scheduler.run(pool, transfer_worker, pool_queue, ordered=False, stage="send", key=server):
                         files.append(result)
+                        if isinstance(result[1], list):
+                            # members of a bundle the server did not acknowledge get sent on their own 
+                            retry += result[1]
+                            gone += result[2]
                         if self.m_signal[server].is_set():
-                            pool.terminate()
                             break
+
+                    if len(gone) > 0:
+                        # a scoped scan drops the files that no longer exist from the catalog
+                        self._background_scan([os.path.join(item[0], item[1]) for item in gone])
+
+                    if len(retry) > 0 and not self.m_signal[server].is_set():
+                        debug_print(f"Resending {len(retry)} files that were not acknowledged in a bundle")
+                        retry_queue = [(os.path.join(item[0], item[1]), make_send_args(idx, *item)) for idx, item in enumerate(retry)]
+                        for result in self.m_scheduler.run(pool, send_worker, retry_queue, ordered=False, stage="send", key=server):
+                            files.append(result)
+                            if self.m_signal[server].is_set():
+                                break
                 finally:
                     message_queue.put({"close": True})
 
@@ -615,13 +891,66 @@ class Device:
         # done 
         self.m_send_threads[server] = None 
 
-
-        sio = self.server_sio.get(server)
-        if sio and sio.connected:
-            sio.emit("estimate_runs", {"source": self.m_config["source"]})
+        self._emit_to_server(server, "estimate_runs", {"source": self.m_config["source"]})
 
         pass 
 
+    def _on_tail_done(self, server:str, fullpath:str, finalized:bool):
+        """Called by LiveTails when a tail ends. Rescans the file
+
+        A file that has been closed gets its metadata and hash.  One that was
+        truncated or replaced while it was tailed gets its new size, so the
+        server asks for it again.
+
+        Args:
+            server (str): server address
+            fullpath (str): path to the file
+            finalized (bool): True if the file was closed and the server has all of it
+        """
+        if finalized or os.path.exists(fullpath):
+            self._background_scan([fullpath])
+
+    def _make_bundles(self, server:str, filelist:list) -> list:
+        """Group the small files in a file list into bundles
+
+        Only for servers that accept bundles ("bundle" in their capabilities).
+        A file is small when it is at most bundle_max_file_mb and is being sent
+        from the start.  Each bundle holds up to bundle_size_mb, or bundle_max_files files. 
+
+        Args:
+            server (str): server address
+            filelist (list): List[Tuple[dirroot, relative_path, upload_id, offset_b, file_size]]
+
+        Returns:
+            list: List of bundles. Each bundle is a list of filelist items.
+        """
+        if "bundle" not in self.m_server_capabilities.get(server, []):
+            return []
+
+        max_file_b = float(self.m_config.get("bundle_max_file_mb", 4)) * 1024 * 1024
+        max_bundle_b = float(self.m_config.get("bundle_size_mb", 256)) * 1024 * 1024
+        max_files = int(self.m_config.get("bundle_max_files", 1000))
+
+        small = [item for item in filelist if item[3] == 0 and item[4] <= max_file_b]
+        small = sorted(small, key=lambda item: (item[0], item[1]))
+
+        bundles = []
+        bundle = []
+        bundle_b = 0
+        for item in small:
+            if len(bundle) > 0 and (bundle_b + item[4] > max_bundle_b or len(bundle) >= max_files):
+                bundles.append(bundle)
+                bundle = []
+                bundle_b = 0
+            bundle.append(item)
+            bundle_b += item[4]
+
+        if len(bundle) > 0:
+            bundles.append(bundle)
+
+        # a bundle of one is just a slower upload
+        return [bundle for bundle in bundles if len(bundle) > 1]
+
     def _update_fs_info(self):
         """Update the fs_info (filesystem info) for each watch directory
 
@@ -701,13 +1030,29 @@ class Device:
         self._removeFiles(files)
 
 
+    def _on_device_confirm(self, data:dict):
+        """Record that a server holds verified copies of files
+
+        Only files with a confirmed hash that still matches may be purged 
+        by the storage governor. 
+
+        Args:
+            data (dict): {source: str(), files: List[ Tuple[dirroot, filename, md5 ]]}
+        """
+        source = data.get("source")
+        if source != self.m_config["source"]:
+            return
+        self.m_storage.confirm(data.get("files", []))
+
     def _removeFiles(self, files:list):
-        """Remove the files in the file list
+        """Remove the files in the file list, and from the catalog
 
         Args:
             files (list): List[ Tuple[dirroot, filename, upload_id ]]
         """
         debug_print("Enter")
+        removed = []
+        gone = []
         for item in files:
             dirroot, file, upload_id = item
 
@@ -725,6 +1070,8 @@ class Device:
             if os.path.exists(fullpath):
                 debug_print(f"Removing {fullpath}")
                 os.remove(fullpath)
+            removed.append(fullpath)
+            gone.append((dirroot, file))
 
             md5 = fullpath + ".md5"
             if os.path.exists(md5):
@@ -735,11 +1082,68 @@ class Device:
             if os.path.exists(metadata):
                 debug_print(f"Removing {metadata}")
                 os.remove(metadata)
-        self._background_scan()
+        self.m_storage.forget(removed)
+
+        # nothing else changed, so no need for a scan: drop the files from the catalog and send the tombstones
+        epoch, since = self.m_catalog.epoch, self.m_catalog.seq
+        if self.m_catalog.remove(gone) > 0:
+            self._save_catalog()
+            self.m_local_dashboard_sio.start_background_task(self._send_removals, epoch, since)
+
+    def _send_removals(self, epoch:str, since:int):
+        """Send the files removed from the catalog to every connected server, as a catalog delta
+
+        A server that takes deltas gets everything it has not seen yet.  Any
+        other server gets the changes since "since", without this device
+        remembering what it has seen, so its next catalog is still sent in full.
+
+        Args:
+            epoch (str): catalog epoch before the removal
+            since (int): catalog sequence number before the removal
+        """
+        for server, sio in list(self.server_sio.items()):
+            if not sio or not sio.connected:
+                continue
+            if server in self.m_server_catalog:
+                server_epoch, server_seq = self.m_server_catalog[server]
+                self._send_catalog_changes(server, server_seq, server_epoch)
+            else:
+                self._send_catalog_changes(server, since, epoch, track=False)
+
+
+    def _device_data_header(self) -> dict:
+        """The common part of the "device_data" message
 
+        Returns:
+            dict: {source, project, robot_name, fs_info}
+        """
+        robot_name = self.m_config.get("robot_name", None)
+        project = self.m_config.get("project")
+        if project is not None and len(project) < 1:
+            project = None 
+
+        pull = None
+        if self.m_config.get("allow_pull", False):
+            pull = {"port": self.m_pull_port, "path": "/pull"}
 
-    def send_device_data(self): 
-        """Send the device data to a server, in nice bitesize chunks
+        return {
+            "source": self.m_config["source"],
+            "project": project,
+            "robot_name": robot_name,
+            "fs_info": self.m_fs_info,
+            "pull": pull,
+            "epoch": self.m_catalog.epoch,
+            "seq": self.m_catalog.seq,
+            "catalog_digest": self.m_catalog.digest(),
+            "scan_generation": self.m_scan.generation
+        }
+
+    def send_device_data(self, servers: List[str] = None): 
+        """Send the device data to the servers, in nice bitesize chunks
+
+        Servers that have asked for catalog changes ("device_catalog_request")
+        only get the entries that changed since the last catalog they were sent.
+        All other servers get the full file list. 
 
         Sends two types of messages. A single "device_data", and as many "device_data_block" as needed
 
@@ -749,48 +1153,280 @@ class Device:
           "robot_name": robot name 
           "total": total number of device_data_block to expect
           "fs_info": dict of dev -> (dirroot, %free)
+          "epoch": catalog epoch
+          "seq": catalog sequence number
+          "catalog_digest": root digest of the catalog Merkle tree
+          "pull": {port, path} where the server can pull files from, or None. See pull_file()
+          "encoding": encoding of the blocks. See device.wire
 
         device_data_block
            "source": source name 
            "room": source name
            "total": total number of device_data_block to expect
-           "block": list of entries
+           "block": list of entries, for the "json" encoding
+           "encoding", "payload": the encoded list of entries, for every other encoding 
            "id": block id
+
+        Args:
+            servers (List[str], optional): only send to these servers. Defaults to every connected server.
         """
         debug_print("enter")
 
-        N = 100
-        blocks = [self.m_files[i:i + N] for i in range(0, len(self.m_files), N)]
-
         self._update_fs_info()
 
-        robot_name = self.m_config.get("robot_name", None)
-        project = self.m_config.get("project")
-        if project is not None and len(project) < 1:
-            project = None 
-        source = self.m_config["source"]
+        full_servers = []
+        for server, sio in list(self.server_sio.items()):
+            if not sio or not sio.connected:
+                continue
+            if servers is not None and server not in servers:
+                continue
+            if server in self.m_server_catalog:
+                epoch, seq = self.m_server_catalog[server]
+                self._send_catalog_changes(server, seq, epoch)
+            else:
+                full_servers.append(server)
+
+        files = self.m_catalog.entries()
+        if len(full_servers) == 0 or len(files) == 0:
+            return 
 
-        device_data = {
-            "source": source,
-            "project": project,
-            "robot_name": robot_name,
-            "total": len(blocks),
-            "fs_info": self.m_fs_info
-        }
-        self._emit_to_all_servers("device_data", device_data)
+        # servers that share an encoding share the encoded blocks
+        by_encoding = {}
+        for server in full_servers:
+            by_encoding.setdefault(self.m_server_encoding.get(server, wire.JSON), []).append(server)
+
+        for encoding, servers in by_encoding.items():
+            N = self._catalog_block_size(encoding)
+            blocks = [files[i:i + N] for i in range(0, len(files), N)]
+
+            device_data = self._device_data_header()
+            device_data["total"] = len(blocks)
+            device_data["encoding"] = encoding
+            messages = [("device_data", device_data)]
+
+            blocks_count = len(blocks)
+            for i, block in enumerate(blocks):
+                msg = {
+                    "source": self.m_config["source"],
+                    "room": self.m_config["source"],
+                    "total": blocks_count,
+                    "id": i
+                }
+                if encoding == wire.JSON:
+                    msg["block"] = block
+                else:
+                    msg["encoding"] = encoding
+                    msg["payload"] = wire.encode(block, [], encoding)
+
+                messages.append(("device_data_block", msg))
+
+            # a header and its blocks must not be interleaved with another send 
+            self.m_broadcast.emit_batch(messages, to=servers)
+
+    def _catalog_block_size(self, encoding:str) -> int:
+        """Number of entries to send per catalog block
+
+        Args:
+            encoding (str): negotiated encoding
+
+        Returns:
+            int: entries per block
+        """
+        if encoding == wire.JSON:
+            return 100
+        return 1000
+
+    def _send_catalog_changes(self, server:str, since:int, epoch:str, track:bool = True):
+        """Send the catalog entries that changed after a sequence number to a server
+
+        Sends a single "device_data" followed by as many "device_data_delta" as needed. 
+
+        device_data 
+          "source", "project", "robot_name", "fs_info", "catalog_digest": as for send_device_data()
+          "delta": True
+          "epoch": catalog epoch.  Changes when the device restarts. 
+          "seq": catalog sequence number after applying these changes
+          "since": sequence number these changes start from
+          "full": True if the server should discard entries not in this update
+          "total": total number of device_data_delta to expect
+          "encoding": encoding of the blocks. See device.wire
+
+        device_data_delta
+           "source": source name 
+           "room": source name
+           "epoch", "seq": as above
+           "total": total number of device_data_delta to expect
+           "id": block id
+           "updated": list of added or modified entries 
+           "removed": list of [dirroot, filename] of removed entries 
+           "encoding", "payload": the encoded updated and removed lists, instead of the above, when not "json"
 
-        blocks_count = len(blocks)
-        for i, block in enumerate(blocks):
+        Args:
+            server (str): server address
+            since (int): last sequence number the server has seen
+            epoch (str): epoch of that sequence number
+            track (bool): Remember that the server has seen these changes, so the following 
+                send_device_data() sends it only the changes after them.
+        """
+        changes = self.m_catalog.changes_since(since, epoch)
+        updated = changes["updated"]
+        removed = changes["removed"]
+
+        encoding = self.m_server_encoding.get(server, wire.JSON)
+        N = self._catalog_block_size(encoding)
+        blocks_count = (len(updated) + N - 1) // N + (len(removed) + N - 1) // N
+
+        device_data = self._device_data_header()
+        device_data.update({
+            "delta": True,
+            "epoch": changes["epoch"],
+            "seq": changes["seq"],
+            "since": changes["since"],
+            "full": changes["full"],
+            "total": blocks_count,
+            "encoding": encoding
+        })
+        messages = [("device_data", device_data)]
+
+        blocks = [(updated[i:i + N], []) for i in range(0, len(updated), N)]
+        blocks += [([], removed[i:i + N]) for i in range(0, len(removed), N)]
+        for i, (block_updated, block_removed) in enumerate(blocks):
             msg = {
                 "source": self.m_config["source"],
                 "room": self.m_config["source"],
+                "epoch": changes["epoch"],
+                "seq": changes["seq"],
                 "total": blocks_count,
-                "block": block,
                 "id": i
             }
+            if encoding == wire.JSON:
+                msg["updated"] = block_updated
+                msg["removed"] = block_removed
+            else:
+                msg["encoding"] = encoding
+                msg["payload"] = wire.encode(block_updated, block_removed, encoding)
+            messages.append(("device_data_delta", msg))
+
+        self._emit_batch_to_server(server, messages)
+
+        if track:
+            self.m_server_catalog[server] = (changes["epoch"], changes["seq"])
+
+    def _on_device_catalog_digest(self, data:dict, server:str):
+        """Callback to send digests of the catalog Merkle tree to a server
+
+        The server starts with the root (prefix ""), compares the digests of
+        the children with its own, and asks again only for the children that
+        differ.  Leaf buckets list [dirroot, filename, digest] for each entry, 
+        and the full entries when "entries" is set. 
+
+        Replies with "device_catalog_digest" {source, room, epoch, seq, depth, nodes, invalid}.
+        Prefixes that are not node names are listed in "invalid", a missing
+        or null list of prefixes asks for the root.
+
+        Args:
+            data (dict): {source: str(), prefixes: List[str], entries: bool}
+            server (str): name:port
+        """
+        source = data.get("source")
+        if source != self.m_config["source"]:
+            return
+
+        prefixes = data.get("prefixes")
+        if prefixes is None:
+            prefixes = [""]
+        elif not isinstance(prefixes, list):
+            prefixes = [prefixes]
+        with_entries = data.get("entries", False)
+
+        msg = self.m_catalog.digest_nodes(prefixes, with_entries)
+        msg["source"] = source
+        msg["room"] = source
+        self._emit_to_server(server, "device_catalog_digest", msg)
+
+    def _on_device_catalog_request(self, data:dict, server:str):
+        """Callback to send the catalog changes since a sequence number to a server
+
+        After the first request, the server is sent only changes on every
+        following scan instead of the full file list. 
+
+        Args:
+            data (dict): {source: str(), epoch: str()|None, since: int, encodings: List[str]|None}.  
+            server (str): name:port
+        """
+        source = data.get("source")
+        if source != self.m_config["source"]:
+            return
+
+        if "encodings" in data:
+            self.m_server_encoding[server] = wire.negotiate(data["encodings"])
+
+        since = data.get("since", 0)
+        epoch = data.get("epoch")
+        self._update_fs_info()
+        self.m_local_dashboard_sio.start_background_task(self._send_catalog_changes, server, since, epoch)
+
+    def _on_device_metadata_request(self, data:dict, server:str):
+        """Callback for a server that wants the expensive metadata of some files now
+
+        Args:
+            data (dict): {source: str(), files: List[Tuple[dirroot, filename]]}
+            server (str): name:port
+        """
+        source = data.get("source")
+        if source != self.m_config["source"]:
+            return
+
+        keys = [tuple(key) for key in data.get("files", [])]
+        self.m_local_dashboard_sio.start_background_task(self._send_metadata, keys, server)
+
+    def _send_metadata(self, keys: List[tuple], server: str):
+        """Run details_worker() for the pending files, then send the entries to a server ("device_metadata")
+
+        Formats with a thread safe extractor (a header read) are done right here.  The others
+        (message counts, ffprobe) run in a worker process, under the details deadline and
+        the quarantine.
+
+        Args:
+            keys (List[tuple]): [(dirroot, filename)]
+            server (str): name:port
+        """
+        results = []
+        in_process = []
+        for key in keys:
+            entry = self.m_catalog.get(key)
+            if entry is None or not entry.get(PENDING):
+                continue
+            with self.m_details_lock:
+                self.m_details.pop(key, None)
+            fullpath = os.path.join(entry["dirroot"], entry["filename"])
+            extractor = find_extractor(fullpath)
+            if self.m_quarantine.contains(fullpath):
+                continue
+            if extractor is not None and extractor.thread_safe:
+                results.append(details_worker((entry, self.m_local_tz)))
+            else:
+                in_process.append((fullpath, (entry, self.m_local_tz)))
+
+        if len(in_process) > 0:
+            with self.m_throttle.pool(1) as pool:
+                for result in self.m_scheduler.run(pool, details_worker, in_process, ordered=False,
+                                                   timeout_s=self._task_timeout("details"), quarantine=self.m_quarantine):
+                    if result:
+                        results.append(result)
+        self._apply_details(results)
+
+        entries = [self.m_catalog.get(key) for key in keys]
+        msg = {
+            "source": self.m_config["source"],
+            "room": self.m_config["source"],
+            "entries": [entry for entry in entries if entry is not None]
+        }
+        self._emit_to_server(server, "device_metadata", msg)
 
-            self._emit_to_all_servers("device_data_block", msg)
-            time.sleep(0.01)
+    def get_extractor_stats(self):
+        """The cost of metadata extraction per format and tier, see ExtractorStats"""
+        return jsonify(self.m_extractor_stats.table())
 
     def emitFiles(self):
         '''
@@ -809,32 +1445,73 @@ class Device:
         return send_from_directory("static", "favicon.ico")
 
     def get_config(self):
-        return jsonify(self.m_config)
+        """The config, for the local dashboard. Secrets are replaced by REDACTED"""
+        config = dict(self.m_config)
+        for key in SECRET_KEYS:
+            if config.get(key):
+                config[key] = REDACTED
+        return jsonify(config)
+
+    def pull_file(self, filename:str):
+        """Serve a catalogued file to a server, so the server can pull it
+
+        Read only, and only for files that are in the catalog. Requires the
+        "X-Api-Key" header to match this device's API_KEY_TOKEN. 
+        Supports "Range" requests, so the server can resume, or fetch a file
+        in parallel pieces. 
+
+        GET /pull/<filename>?dirroot=<dirroot>
+
+        Args:
+            filename (str): path of the file relative to dirroot
+
+        Returns:
+            The file, or an error message and status code
+        """
+        if not self.m_config.get("allow_pull", False):
+            return "Pull disabled", 403
+
+        api_key_token = request.headers.get("X-Api-Key", "")
+        if not hmac.compare_digest(api_key_token, str(self.m_config["API_KEY_TOKEN"])):
+            return "Invalid API key", 401
+
+        dirroot = request.args.get("dirroot")
+        entry = self.m_catalog.get((dirroot, filename))
+        if entry is None:
+            return "Not found", 404
+
+        fullpath = os.path.realpath(os.path.join(dirroot, filename))
+        if not fullpath.startswith(os.path.realpath(dirroot) + os.sep) or not os.path.isfile(fullpath):
+            return "Not found", 404
+
+        response = send_file(fullpath, mimetype="application/octet-stream", conditional=True, etag=entry.get("md5") or True, max_age=0)
+        if entry.get("md5"):
+            response.headers["X-Md5"] = entry["md5"]
+        return response
 
     def save_config(self):
-        rescan = False
-        reconnect = False
- 
         config = request.json
+        for key in SECRET_KEYS:
+            # the dashboard posts back the REDACTED value it was given 
+            if config.get(key) == REDACTED:
+                config[key] = self.m_config.get(key)
         with self.session_lock:
+            previous = copy.deepcopy(self.m_config)
             for key in config:
-                if key in self.m_config:
-                    if self.m_config[key] != config[key]:
-                        if key == "watch":
-                            rescan = True
-                        if key == "robot_name":
-                            reconnect = True
-
+                if key in self.m_config or key in KNOWN_KEYS:
                     self.m_config[key] = config[key]
+                else:
+                    debug_print(f"Ignoring unknown config key {key}")
+            diff = ConfigDiff(previous, self.m_config)
                 
-            debug_print("updated config")
+            debug_print(f"updated config: {diff}")
 
             with open(self.m_config_filename, "w") as f:
                 yaml.dump(config, f)
 
         os.chmod(self.m_config_filename, 0o777 )
 
-        if reconnect:
+        if diff.reconnect:
             robot_name = self.m_config["robot_name"]
             
             self.m_config["source"] = get_source_by_mac_address(robot_name)
@@ -861,18 +1538,77 @@ class Device:
         for server_address in to_remove:
            self.stop_server_thread(server_address)
 
-        if rescan:
-            # self._scan()
-            self._background_scan()
-
+        self._apply_config(diff)
 
         return "Saved", 200
 
+    def _apply_config(self, diff: ConfigDiff):
+        """Apply a config change to the running device, without a full scan
+
+        * Stages, limits and timers are reconfigured in place
+        * Files in removed watch directories, or that no longer match the
+          suffixes, are dropped from the catalog
+        * Only new watch directories are scanned.  A new suffix or rule can
+          match files anywhere, so it needs a full scan.
+
+        Args:
+            diff (ConfigDiff): what changed
+        """
+        if diff.changed("computeMD5"):
+            self.m_computeMD5 = self.m_config.get("computeMD5", True)
+        if diff.changed("chunk_size"):
+            self.m_chunk_size = self.m_config.get("chunk_size", 8192*1024)
+        if diff.changed("local_tz"):
+            self.m_local_tz = self.m_config.get("local_tz", "America/New_York")
+        if diff.changed("watch", "live_quiet_s", "detect_writers"):
+            self.m_live_quiet_s = float(self.m_config.get("live_quiet_s", 30))
+            self.m_stability.configure(self.m_config.get("watch", []), self.m_live_quiet_s, self.m_config.get("detect_writers", True))
+        if diff.changed("live_max_tails"):
+            self.m_live_tails.configure(int(self.m_config.get("live_max_tails", 8)))
+        if diff.changed("low_water_pct", "high_water_pct", "purge"):
+            self.m_storage.configure(float(self.m_config.get("low_water_pct", 10)), 
+                                     float(self.m_config.get("high_water_pct", 20)), 
+                                     self.m_config.get("purge", False))
+        if diff.changed("threads", "device_concurrency"):
+            self.m_scheduler.configure(self.m_config["threads"], self.m_config.get("device_concurrency"))
+        if diff.changed("throttle"):
+            self.m_throttle.configure(self.m_config.get("throttle"))
+        if diff.changed("threads", "autoscale"):
+            self.m_autoscaler.configure(self.m_config["threads"], self.m_config.get("autoscale"))
+        if diff.changed("scan_delay_s"):
+            self.m_scan.configure(float(self.m_config.get("scan_delay_s") or 1))
+        if diff.changed("max_pending_mb"):
+            self.m_broadcast.configure(int(self.m_config.get("max_pending_mb", 16)) * 1024 * 1024)
+
+        if diff.changed("include_suffix", "exclude_suffix", "rules"):
+            self.m_rules.configure(self.m_config)
+
+        if diff.changed("watch", "include_suffix", "exclude_suffix", "rules"):
+            unwatched = set(diff.removed("watch"))
+            gone = [entry_key(entry) for entry in self.m_catalog.entries()
+                    if entry["dirroot"] in unwatched or not self._include(entry["filename"])]
+            epoch, since = self.m_catalog.epoch, self.m_catalog.seq
+            if self.m_catalog.remove(gone) > 0:
+                debug_print(f"Dropped {len(gone)} files that are no longer watched")
+                self._save_catalog()
+                self.m_local_dashboard_sio.start_background_task(self._send_removals, epoch, since)
+
+        if diff.added("include_suffix") or diff.removed("exclude_suffix") or diff.changed("rules"):
+            self._background_scan()
+        elif diff.added("watch"):
+            self._background_scan(diff.added("watch"))
+
     def run(self):
         for server_address in self.m_config["servers"]:
             self.start_server_thread(server_address, "config server list")
 
         self.m_local_dashboard_sio.start_background_task(self.update_connections_thread)
+        self.m_local_dashboard_sio.start_background_task(self.stability_watch_thread)
+        self.m_local_dashboard_sio.start_background_task(self.storage_governor_thread)
+        self.m_local_dashboard_sio.start_background_task(self.throttle_thread)
+
+        if float(self.m_config.get("live_poll_s", 0)) > 0:
+            self.m_local_dashboard_sio.start_background_task(self.live_watch_thread)
 
 
 
@@ -902,6 +1638,11 @@ class Device:
             if server_address in self.server_sio:
                 sio = self.server_sio[server_address]
                 del self.server_sio[server_address]
+            self.m_broadcast.remove(server_address)
+            self.m_live_tails.cancel(server_address)
+            self.m_server_catalog.pop(server_address, None)
+            self.m_server_encoding.pop(server_address, None)
+            self.m_server_capabilities.pop(server_address, None)
 
         if sio:
             sio.emit('leave', { 'room': self.m_config["source"], "type": "device" })                               
@@ -943,6 +1684,88 @@ class Device:
             self.update_connections()
             time.sleep(5)
 
+    def stability_watch_thread(self):
+        """Every few seconds, check the files that were deferred because they were being written
+
+        Runs a scan once for each batch of files that have been closed, so 
+        their metadata and hash are computed once, after they are complete.  
+        """
+        while True:
+            time.sleep(max(1, min(self.m_stability.quiet_s, 5)))
+            closed = self.m_stability.poll()
+            if len(closed) > 0:
+                self._background_scan(closed)
+
+    def storage_governor_thread(self):
+        """Every storage_check_s seconds, act on watch directories that are running out of space
+
+        * Tell the servers which files to upload first ("device_storage_pressure")
+        * If purge is enabled, delete files that a server has confirmed holding. 
+        """
+        while True:
+            time.sleep(float(self.m_config.get("storage_check_s", 60)))
+
+            watch = self.m_config["watch"]
+            pressure = self.m_storage.pressure(watch)
+            if len(pressure) == 0:
+                continue
+
+            entries = self.m_catalog.entries()
+            self._update_fs_info()
+            msg = {
+                "source": self.m_config["source"],
+                "room": self.m_config["source"],
+                "fs_info": self.m_fs_info,
+                "priority": self.m_storage.priority_entries(entries, watch)
+            }
+            self._emit_to_all_servers("device_storage_pressure", msg)
+
+            purge = self.m_storage.purge_candidates(entries, watch)
+            if len(purge) > 0:
+                debug_print(f"Low on space, removing {len(purge)} files that the server has verified")
+                purge = set(purge)
+                files = [(entry["dirroot"], entry["filename"], None) for entry in entries if os.path.join(entry["dirroot"], entry["filename"]) in purge]
+                self._removeFiles(files)
+
+    def throttle_thread(self):
+        """Every throttle interval_s seconds, check the load of the robot
+
+        * Slows down or pauses the stages, see ResourceGovernor
+        * Shows the load and throttle state on the local dashboard ("throttle_status")
+        """
+        while True:
+            time.sleep(self.m_throttle.interval_s)
+            try:
+                status = self.m_throttle.check()
+            except Exception as e:
+                debug_print(f"Failed to check load: {e}")
+                continue
+            status["stages"] = self.m_autoscaler.status()
+            self.m_local_dashboard_sio.emit("throttle_status", status)
+
+    def live_watch_thread(self):
+        """Every live_poll_s seconds, add recordings that are still growing to the catalog
+
+        Lets the servers see, and ask for, the current run while it is still
+        being recorded, without waiting for a full scan. 
+        """
+        while True:
+            time.sleep(float(self.m_config.get("live_poll_s", 0)) or 5)
+            if float(self.m_config.get("live_poll_s", 0)) <= 0:
+                continue
+
+            robot_name = self.m_config.get("robot_name", None)
+            live_entries = []
+            for dirroot, filename, fullpath, size in self._walk(announce=False):
+                if not self.m_stability.is_active(fullpath):
+                    continue
+                self.m_stability.defer(fullpath)
+                live_entries.append(create_live_entry(fullpath, filename, dirroot, size, robot_name))
+
+            if self.m_catalog.update(live_entries) > 0:
+                self._save_catalog()
+                self.emitFiles()
+
     def update_connections(self):
         """Check each connection and send an update on "server_connections"
 
@@ -1056,7 +1879,7 @@ class Device:
         def connect():
             time.sleep(0.5)
             debug_print(f"---- connected {server_address}")
-            sio.emit('join', { 'room': self.m_config["source"], "type": "device", "session_token": session_id })                               
+            sio.emit('join', { 'room': self.m_config["source"], "type": "device", "session_token": session_id, "encodings": wire.supported_encodings() })                               
 
         @sio.event
         def disconnect():
@@ -1068,6 +1891,10 @@ class Device:
             
             with self.session_lock:
                 self.server_sio[server_address] = None 
+                self.m_broadcast.remove(server_address)
+                self.m_server_catalog.pop(server_address, None)
+                self.m_server_encoding.pop(server_address, None)
+                self.m_server_capabilities.pop(server_address, None)
 
                 if server_address in self.server_to_source:
                     source = self.server_to_source[server_address]
@@ -1091,12 +1918,26 @@ class Device:
             debug_print(data)
 
             self.server_sio[server_address] = sio
+            self.m_broadcast.add(server_address, sio)
             self.source_to_server[source] = server_address
             self.server_to_source[server_address] = source
+            if isinstance(data, dict) and "encodings" in data:
+                self.m_server_encoding[server_address] = wire.negotiate(data["encodings"])
+            if isinstance(data, dict):
+                self.m_server_capabilities[server_address] = data.get("capabilities", [])
             
             # source = self.server_to_source.get(server_address)
             self.m_local_dashboard_sio.emit("server_connect",  {"name": server_address, "connected": True, "source": source})
-            self._background_scan()
+            # every server gets the catalog we have now (possibly loaded at startup) right away, and the
+            # scan then reconciles it.  A server that takes catalog deltas gets it as a delta, and then
+            # only what the scan changes.  Any other server gets the full blocks, and the full list again
+            # after the scan
+            if len(self.m_catalog) > 0:
+                if "catalog_delta" in self.m_server_capabilities.get(server_address, []):
+                    self.m_local_dashboard_sio.start_background_task(self._send_catalog_changes, server_address, 0, None)
+                else:
+                    self.m_local_dashboard_sio.start_background_task(self.send_device_data, [server_address])
+            self._background_scan(join=True)
             pass 
 
         # @sio.event
@@ -1123,6 +1964,22 @@ class Device:
         def device_remove(data):
             self.on_device_remove(data)
 
+        @sio.event
+        def device_confirm(data):
+            self._on_device_confirm(data)
+
+        @sio.event
+        def device_catalog_request(data):
+            self._on_device_catalog_request(data, server_address)
+
+        @sio.event
+        def device_catalog_digest(data):
+            self._on_device_catalog_digest(data, server_address)
+
+        @sio.event
+        def device_metadata_request(data):
+            self._on_device_metadata_request(data, server_address)
+
         api_key_token = self.m_config["API_KEY_TOKEN"]
         headers = {"X-Api-Key": api_key_token }
 
@@ -1150,6 +2007,8 @@ class Device:
                     return False 
 
                 debug_print("Connecting....")
+                # the server may ask for the catalog as soon as it sees the connection 
+                self.m_broadcast.add(server_address, sio)
                 sio.connect(f"http://{server}:{port}/socket.io", headers=headers, transports=['websocket'])
                 debug_print(f"Connected to {server_address}")
 
@@ -1161,6 +2020,7 @@ class Device:
 
         except socketio.exceptions.ConnectionError as e:
             debug_print(f"Failed to connect to {server_address} because {e} {e.args}")
+            self.m_broadcast.remove(server_address)
             sio.disconnect()
             return True
 
@@ -26,6 +26,8 @@ def create_app(config_file, salt):
     app.route("/restartConnections", methods=["GET"])(device.on_restart_connections)
     app.route("/emitFiles", methods=["GET"])(device.emitFiles)
     app.route("/scan", methods=["GET"])(device.on_scan)
+    app.route("/extractor_stats", methods=["GET"])(device.get_extractor_stats)
+    app.route("/pull/<path:filename>", methods=["GET", "HEAD"])(device.pull_file)
 
     sockethost.on("connect")(device.on_local_dashboard_connect)
     sockethost.on("disconnect")(device.on_local_dashboard_disconnect)
@@ -0,0 +1,278 @@
+# Pick the number of workers for each scan and upload stage
+
+import itertools
+import os
+import psutil
+import threading
+import time
+
+from device.debug_print import debug_print
+
+# what limits each stage, and how its throughput is measured
+STAGES = {
+    "reindex": {"resource": "cpu", "unit": "bytes"},
+    "metadata": {"resource": "cpu", "unit": "tasks"},
+    "hash": {"resource": "disk", "unit": "bytes"},
+    "send": {"resource": "network", "unit": "bytes"},
+    "details": {"resource": "cpu", "unit": "tasks"},
+}
+
+
+class _Stage:
+    """The bounds and target of a stage, for one key (e.g. the server of a send run)"""
+
+    def __init__(self, name: str, low: int, high: int, target: int) -> None:
+        self.name = name
+        self.low = low
+        self.high = high
+        self.target = max(low, min(high, target))
+        self.step = 1
+
+
+class _Run:
+    """The throughput counters of one run of a stage"""
+
+    def __init__(self, stage: _Stage) -> None:
+        self.stage = stage
+        self.units = 0
+        self.running = 0
+        self.peak = 0
+        self.start = time.time()
+        self.last_rate = None
+        # baselines of the saturation samples, see Autoscaler._saturated()
+        self.disk_busy = None
+        self.disk_time = None
+        self.cpu_times = None
+
+
+class Autoscaler:
+    """
+    Scales the concurrency of each stage between configured bounds, by
+    climbing towards the best measured throughput.
+
+    Every interval_s seconds, the throughput of a running stage (bytes or
+    tasks per second) is compared to the previous interval:
+
+    * better: keep moving the same way (one more, or one less worker)
+    * worse: turn around
+    * about the same: try one more worker
+
+    A stage does not grow while the resource it is bound by is saturated
+    (all cpus busy, or a disk busy over 90% of the time), or while it has no
+    queued work for another worker, or when it did not even reach its current
+    target (e.g. held back by a per disk limit).
+
+    Each run of a stage (see begin()) has its own counters, so runs that
+    overlap, like the sends to two servers, do not reset each other.  The
+    target is kept per stage and key (e.g. the server) for the next run.
+    """
+
+    def __init__(self, threads: int, config: dict = None) -> None:
+        """
+        Initializes the autoscaler.
+
+        Args:
+            threads (int): the "threads" config, the starting point of every stage
+            config (dict, optional): the "autoscale" section of the config
+        """
+        self.m_lock = threading.Lock()
+        self.m_bounds = {}   # stage -> (low, high)
+        self.m_stages = {}   # (stage, key) -> _Stage
+        self.m_runs = {}     # run id -> _Run
+        self.m_run_ids = itertools.count()
+        self.configure(threads, config)
+
+    def configure(self, threads: int, config: dict = None):
+        """Set the bounds of each stage
+
+        Args:
+            threads (int): the "threads" config
+            config (dict, optional): {enabled, interval_s, stage: [low, high]}
+        """
+        config = config or {}
+        cpus = os.cpu_count() or 1
+        defaults = {
+            "reindex": [1, max(threads, cpus)],
+            "metadata": [1, max(threads, cpus)],
+            "hash": [1, threads],
+            "send": [1, threads * 2],
+            "details": [1, max(1, threads // 2)],
+        }
+
+        with self.m_lock:
+            self.m_enabled = config.get("enabled", True)
+            self.m_interval_s = float(config.get("interval_s", 5))
+            self.m_threads = threads
+            for name, bounds in defaults.items():
+                low, high = config.get(name, bounds)
+                low = max(1, int(low))
+                high = max(low, int(high))
+                self.m_bounds[name] = (low, high)
+            for state in self.m_stages.values():
+                state.low, state.high = self.m_bounds[state.name]
+                state.target = max(state.low, min(state.high, state.target))
+
+    def pool_size(self, stage: str, threads: int) -> int:
+        """Number of workers to start a stage's pool with
+
+        Args:
+            stage (str): stage name
+            threads (int): size to use when not autoscaling
+
+        Returns:
+            int: the stage's upper bound
+        """
+        if not self.m_enabled or stage not in self.m_bounds:
+            return threads
+        return self.m_bounds[stage][1]
+
+    def begin(self, stage: str, key: str = None) -> int:
+        """A stage is starting a run
+
+        Args:
+            stage (str): stage name
+            key (str, optional): what the run is for, e.g. the server of a send. Runs with different keys learn their own target.
+
+        Returns:
+            int: run id, for started(), record(), target() and end(). None for a stage that is not autoscaled.
+        """
+        with self.m_lock:
+            if stage not in self.m_bounds:
+                return None
+            state = self.m_stages.get((stage, key))
+            if state is None:
+                low, high = self.m_bounds[stage]
+                state = _Stage(stage, low, high, self.m_threads)
+                self.m_stages[(stage, key)] = state
+            run = next(self.m_run_ids)
+            self.m_runs[run] = _Run(state)
+            return run
+
+    def end(self, run: int):
+        """A run is over"""
+        with self.m_lock:
+            self.m_runs.pop(run, None)
+
+    def unit(self, stage: str) -> str:
+        """"bytes" or "tasks", how throughput is measured for a stage"""
+        return STAGES.get(stage, {}).get("unit", "tasks")
+
+    def started(self, run: int):
+        """A task of a run started"""
+        with self.m_lock:
+            if run in self.m_runs:
+                state = self.m_runs[run]
+                state.running += 1
+                state.peak = max(state.peak, state.running)
+
+    def record(self, run: int, units: int):
+        """A task of a run completed
+
+        Args:
+            run (int): run id, see begin()
+            units (int): bytes or 1, see unit()
+        """
+        with self.m_lock:
+            if run in self.m_runs:
+                state = self.m_runs[run]
+                state.units += units
+                state.running = max(0, state.running - 1)
+
+    def _disk_busy(self, run: _Run) -> float:
+        """Highest busy percentage of any disk since the last call for this run"""
+        try:
+            counters = psutil.disk_io_counters(perdisk=True)
+        except (OSError, RuntimeError):
+            return 0.0
+        now = time.time()
+        busy = {disk: getattr(counter, "busy_time", 0) for disk, counter in counters.items()}
+        previous, previous_time = run.disk_busy, run.disk_time
+        run.disk_busy, run.disk_time = busy, now
+        if previous is None or now <= previous_time:
+            return 0.0
+        elapsed_ms = (now - previous_time) * 1000
+        return max([(busy[disk] - previous.get(disk, busy[disk])) * 100 / elapsed_ms for disk in busy] or [0.0])
+
+    def _cpu_busy(self, run: _Run) -> float:
+        """Percentage of cpu time that was not idle since the last call for this run
+
+        Keeps its own counters, psutil.cpu_percent(interval=None) is shared with the throttle.
+        """
+        times = psutil.cpu_times()
+        previous, run.cpu_times = run.cpu_times, times
+        if previous is None:
+            return 0.0
+        total = sum(times) - sum(previous)
+        idle = (times.idle + getattr(times, "iowait", 0)) - (previous.idle + getattr(previous, "iowait", 0))
+        if total <= 0:
+            return 0.0
+        return 100 * (1 - idle / total)
+
+    def _saturated(self, run: _Run) -> bool:
+        resource = STAGES[run.stage.name]["resource"]
+        if resource == "cpu":
+            return self._cpu_busy(run) > 90
+        if resource == "disk":
+            return self._disk_busy(run) > 90
+        return False
+
+    def target(self, run: int, queued: int, threads: int) -> int:
+        """The number of tasks a run should be running now
+
+        Args:
+            run (int): run id, see begin()
+            queued (int): tasks waiting to run
+            threads (int): the target when not autoscaling
+
+        Returns:
+            int: target concurrency
+        """
+        if not self.m_enabled:
+            return threads
+
+        with self.m_lock:
+            if run not in self.m_runs:
+                return threads
+            counters = self.m_runs[run]
+            state = counters.stage
+            elapsed = time.time() - counters.start
+            if elapsed < self.m_interval_s:
+                return state.target
+
+            rate = counters.units / elapsed
+            reached = counters.peak >= state.target
+            counters.units = 0
+            counters.peak = counters.running
+            counters.start = time.time()
+
+            if counters.last_rate is None or rate > counters.last_rate * 1.05:
+                step = state.step
+            elif rate < counters.last_rate * 0.95:
+                step = -state.step
+            else:
+                step = 1
+            counters.last_rate = rate
+
+            # sample every interval, so the next sample covers one interval 
+            saturated = self._saturated(counters)
+            if step > 0 and (queued == 0 or saturated or not reached):
+                step = 0
+
+            target = max(state.low, min(state.high, state.target + step))
+            if target != state.target:
+                debug_print(f"{state.name}: {state.target} -> {target} workers ({rate:.1f} {self.unit(state.name)}/s)")
+            state.step = step if step != 0 else state.step
+            state.target = target
+            return target
+
+    def status(self) -> dict:
+        """Current target and bounds of each stage, as "stage" or "stage key" for keyed runs"""
+        with self.m_lock:
+            rtn = {}
+            for name, (low, high) in self.m_bounds.items():
+                if not any(stage == name for stage, _ in self.m_stages):
+                    rtn[name] = {"target": max(low, min(high, self.m_threads)), "low": low, "high": high}
+            for (name, key), state in sorted(self.m_stages.items(), key=lambda item: (item[0][0], str(item[0][1]))):
+                label = name if key is None else f"{name} {key}"
+                rtn[label] = {"target": state.target, "low": state.low, "high": state.high}
+            return rtn
@@ -0,0 +1,286 @@
+# Fan out socketio messages to all connected servers
+
+import socketio
+import threading
+import time
+
+from collections import deque
+from typing import Dict, List, Tuple
+
+from device.debug_print import debug_print
+
+
+def _size(msg: any) -> int:
+    """Roughly how many bytes a message takes on the wire"""
+    if isinstance(msg, (bytes, bytearray, memoryview, str)):
+        return len(msg)
+    if isinstance(msg, dict):
+        return sum(len(str(key)) + _size(value) for key, value in msg.items())
+    if isinstance(msg, (list, tuple)):
+        return sum(_size(value) for value in msg) + len(msg)
+    return 8
+
+
+class _Channel:
+    """
+    The send queue for a single server.
+
+    A thread per channel emits the queued messages, one batch at a time, so
+    the messages of a batch reach the server back to back.  Each message
+    asks for an ack, and once the server is seen to answer acks, the thread
+    waits while more than max_inflight messages are unanswered.  A slow
+    server only backs up its own channel.
+
+    When more than max_pending_b bytes are waiting, lossy messages (progress
+    updates) are dropped instead of queued, and a newer lossy message with the
+    same key replaces the one that is still waiting.  Other messages are always
+    queued.
+    """
+
+    def __init__(self, name: str, sio: socketio.Client, max_pending_b: int, max_inflight: int,
+                 ack_timeout_s: float = 10) -> None:
+        self.m_name = name
+        self.m_sio = sio
+        self.m_max_pending_b = max_pending_b
+        self.m_max_inflight = max_inflight
+        self.m_ack_timeout_s = ack_timeout_s
+
+        self.m_cond = threading.Condition()
+        self.m_queue = deque()  # [messages, size, key]
+        self.m_lossy = {}       # key -> queue item waiting to be sent
+        self.m_pending_b = 0
+        self.m_dropped = 0
+        self.m_inflight = 0
+        self.m_acks = False     # the server answers acks
+        self.m_running = True
+
+        self.m_thread = threading.Thread(target=self._run, daemon=True)
+        self.m_thread.start()
+
+    @property
+    def sio(self) -> socketio.Client:
+        return self.m_sio
+
+    def put(self, messages: List[Tuple[str, any]], size: int, lossy: bool = False, key: any = None) -> bool:
+        """Queue a batch of messages
+
+        Args:
+            messages (List[Tuple[str, any]]): (event, msg), sent in order with nothing in between
+            size (int): approximate size of the batch in bytes
+            lossy (bool): May be dropped when this server is behind.
+            key (any): For lossy messages, replaces a waiting message with the same key.
+
+        Returns:
+            bool: True if queued, False if dropped
+        """
+        with self.m_cond:
+            if not self.m_running:
+                return False
+
+            if lossy and key is not None and key in self.m_lossy:
+                item = self.m_lossy[key]
+                self.m_pending_b += size - item[1]
+                item[0] = messages
+                item[1] = size
+                return True
+
+            if lossy and self.m_pending_b + size > self.m_max_pending_b:
+                self.m_dropped += 1
+                return False
+
+            item = [messages, size, key if lossy else None]
+            self.m_queue.append(item)
+            if item[2] is not None:
+                self.m_lossy[key] = item
+            self.m_pending_b += size
+            self.m_cond.notify_all()
+        return True
+
+    def _acked(self, *args):
+        with self.m_cond:
+            self.m_acks = True
+            self.m_inflight = max(0, self.m_inflight - 1)
+            self.m_cond.notify_all()
+
+    def _wait_for_room(self):
+        """Wait while the server has too many messages it has not acked"""
+        with self.m_cond:
+            deadline = time.time() + self.m_ack_timeout_s
+            while self.m_running and self.m_acks and self.m_inflight >= self.m_max_inflight:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    # the acks were lost, e.g. across a reconnect
+                    self.m_inflight = 0
+                    break
+                self.m_cond.wait(remaining)
+
+    def _run(self):
+        while True:
+            with self.m_cond:
+                while self.m_running and len(self.m_queue) == 0:
+                    self.m_cond.wait()
+                if not self.m_running:
+                    return
+                messages, size, key = self.m_queue.popleft()
+                if key is not None:
+                    self.m_lossy.pop(key, None)
+                self.m_pending_b -= size
+
+            # the channel is added before the socket finishes connecting
+            while self.m_running and not self.m_sio.connected:
+                time.sleep(0.1)
+
+            for event, msg in messages:
+                self._wait_for_room()
+                if not self.m_running:
+                    return
+                try:
+                    with self.m_cond:
+                        self.m_inflight += 1
+                    self.m_sio.emit(event, msg, callback=self._acked)
+                except Exception as e:
+                    with self.m_cond:
+                        self.m_inflight = max(0, self.m_inflight - 1)
+                    debug_print(f"Failed to send {event} to {self.m_name}: {e}")
+                    break
+
+    def pending(self) -> int:
+        with self.m_cond:
+            return self.m_pending_b
+
+    def close(self):
+        with self.m_cond:
+            self.m_running = False
+            self.m_queue.clear()
+            self.m_lossy.clear()
+            self.m_pending_b = 0
+            self.m_cond.notify_all()
+
+
+class _Target:
+    """Looks enough like a socketio.Client to be used in socket_events, with None as the room"""
+
+    def __init__(self, broadcaster: "Broadcaster", lossy: bool) -> None:
+        self.m_broadcaster = broadcaster
+        self.m_lossy = lossy
+
+    def emit(self, event: str, msg: any):
+        key = None
+        if self.m_lossy and isinstance(msg, dict):
+            key = (event, msg.get("position"))
+        self.m_broadcaster.emit(event, msg, lossy=self.m_lossy, key=key)
+
+
+class Broadcaster:
+    """
+    Sends messages to many servers.
+
+    Each server gets its own _Channel, so a slow link does not hold up the others.
+    """
+
+    def __init__(self, max_pending_b: int = 16 * 1024 * 1024, max_inflight: int = 16) -> None:
+        """
+        Initializes a broadcaster with no servers.
+
+        Args:
+            max_pending_b (int): Per server, bytes that may wait before lossy messages are dropped.
+            max_inflight (int): Per server, messages the server has not acked before waiting.
+        """
+        self.m_lock = threading.Lock()
+        self.m_channels: Dict[str, _Channel] = {}
+        self.m_max_pending_b = max_pending_b
+        self.m_max_inflight = max_inflight
+
+    def configure(self, max_pending_b: int):
+        """Change the per server backlog, for the channels that are open and the ones to come"""
+        with self.m_lock:
+            self.m_max_pending_b = max_pending_b
+            for channel in self.m_channels.values():
+                with channel.m_cond:
+                    channel.m_max_pending_b = max_pending_b
+
+    def add(self, name: str, sio: socketio.Client):
+        """Add (or replace) the socket for a server
+
+        Args:
+            name (str): server address
+            sio (socketio.Client): socket.  Messages wait in the channel until it is connected.
+        """
+        with self.m_lock:
+            channel = self.m_channels.get(name)
+            if channel and channel.sio is sio:
+                return
+            if channel:
+                channel.close()
+            self.m_channels[name] = _Channel(name, sio, self.m_max_pending_b, self.m_max_inflight)
+
+    def remove(self, name: str):
+        """Stop sending to a server, discarding anything still queued for it
+
+        Args:
+            name (str): server address
+        """
+        with self.m_lock:
+            channel = self.m_channels.pop(name, None)
+        if channel:
+            channel.close()
+
+    def emit(self, event: str, msg: any, to: List[str] = None, lossy: bool = False, key: any = None) -> int:
+        """Queue a message for a set of servers
+
+        Args:
+            event (str): event
+            msg (any): message
+            to (List[str], optional): server addresses. Defaults to all servers.
+            lossy (bool): May be dropped for servers that are behind.
+            key (any): See _Channel.put()
+
+        Returns:
+            int: number of servers the message was queued for
+        """
+        return self.emit_batch([(event, msg)], to, lossy, key)
+
+    def emit_batch(self, messages: List[Tuple[str, any]], to: List[str] = None, lossy: bool = False, key: any = None) -> int:
+        """Queue messages that each server must get back to back, e.g. a header and its blocks
+
+        Args:
+            messages (List[Tuple[str, any]]): (event, msg)
+            to (List[str], optional): server addresses. Defaults to all servers.
+            lossy (bool): May be dropped for servers that are behind.
+            key (any): See _Channel.put()
+
+        Returns:
+            int: number of servers the messages were queued for
+        """
+        with self.m_lock:
+            if to is None:
+                channels = list(self.m_channels.values())
+            else:
+                channels = [self.m_channels[name] for name in to if name in self.m_channels]
+
+        size = sum(len(event) + _size(msg) for event, msg in messages)
+        count = 0
+        for channel in channels:
+            count += channel.put(messages, size, lossy, key)
+        return count
+
+    def has(self, name: str) -> bool:
+        """Is there a channel for a server?"""
+        with self.m_lock:
+            return name in self.m_channels
+
+    def target(self, lossy: bool = True) -> _Target:
+        """An object to put in socket_events, that sends to all servers
+
+        Args:
+            lossy (bool): progress updates may be dropped for servers that are behind
+
+        Returns:
+            _Target: has emit(event, msg)
+        """
+        return _Target(self, lossy)
+
+    def pending(self) -> Dict[str, int]:
+        """Bytes waiting to be sent, per server"""
+        with self.m_lock:
+            return {name: channel.pending() for name, channel in self.m_channels.items()}
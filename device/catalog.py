@@ -0,0 +1,290 @@
+# Versioned catalog of the files on this device
+
+import json
+import os
+import threading
+import uuid
+
+from collections import OrderedDict
+from typing import Callable, Iterable, List, Tuple
+
+from device.debug_print import debug_print
+from device.merkle import MerkleTree
+from device.utils import write_json_atomic
+
+
+def entry_key(entry: dict) -> Tuple[str, str]:
+    """The catalog key for an entry
+
+    Args:
+        entry (dict): A device entry with "dirroot" and "filename"
+
+    Returns:
+        Tuple[str, str]: (dirroot, filename)
+    """
+    return (entry["dirroot"], entry["filename"])
+
+
+class Catalog:
+    """
+    The set of file entries known to this device, versioned by a monotonically
+    increasing change sequence number.
+
+    Every added, modified or removed entry is stamped with the sequence number
+    of the change, so a server that has seen the catalog up to sequence N can
+    ask for only the changes made after N.  Removals are remembered as
+    tombstones, up to a limit.  When a request is older than the oldest
+    tombstone still held, or comes from a different epoch (i.e. a previous run
+    of the device), the full catalog is returned instead.
+
+    The catalog also keeps a Merkle tree of its entries, so a server can verify
+    its copy by comparing the root digest and descending only into subtrees
+    whose digests differ.
+
+    The entries can be saved to, and loaded from, a snapshot file, so the
+    device has a catalog to send as soon as it starts.  A loaded snapshot is a
+    new epoch, as for any restart.
+    """
+
+    def __init__(self, max_tombstones: int = 100000, merkle_depth: int = 3) -> None:
+        """
+        Initializes an empty catalog with a fresh epoch.
+
+        Args:
+            max_tombstones (int): Maximum number of removals to remember.
+            merkle_depth (int): Depth of the Merkle tree. 16**depth buckets.
+        """
+        self.m_lock = threading.RLock()
+        self.m_epoch = uuid.uuid4().hex
+        self.m_seq = 0
+        self.m_floor = 0
+        self.m_max_tombstones = max_tombstones
+
+        self.m_entries = {}     # key -> entry
+        self.m_entry_seq = {}   # key -> seq of last add/modify
+        self.m_tombstones = OrderedDict()  # key -> seq of removal, oldest first
+        self.m_tree = MerkleTree(merkle_depth)
+
+    @property
+    def epoch(self) -> str:
+        return self.m_epoch
+
+    @property
+    def seq(self) -> int:
+        with self.m_lock:
+            return self.m_seq
+
+    def __len__(self) -> int:
+        with self.m_lock:
+            return len(self.m_entries)
+
+    def entries(self) -> List[dict]:
+        """A copy of all the entries in the catalog
+
+        Returns:
+            List[dict]: entries
+        """
+        with self.m_lock:
+            return list(self.m_entries.values())
+
+    def get(self, key: Tuple[str, str]) -> dict:
+        with self.m_lock:
+            return self.m_entries.get(key)
+
+    def _upsert(self, entry: dict) -> bool:
+        key = entry_key(entry)
+        if self.m_entries.get(key) == entry:
+            return False
+
+        self.m_seq += 1
+        self.m_entries[key] = entry
+        self.m_entry_seq[key] = self.m_seq
+        self.m_tombstones.pop(key, None)
+        self.m_tree.set(key, entry)
+        return True
+
+    def _remove(self, key: Tuple[str, str]) -> bool:
+        if key not in self.m_entries:
+            return False
+
+        self.m_seq += 1
+        del self.m_entries[key]
+        del self.m_entry_seq[key]
+        self.m_tombstones[key] = self.m_seq
+        self.m_tombstones.move_to_end(key)
+        self.m_tree.discard(key)
+        return True
+
+    def _prune_tombstones(self):
+        """Forget the oldest removals once there are too many of them.
+
+        Raises the floor so that requests older than the forgotten removals
+        get the full catalog.
+        """
+        while len(self.m_tombstones) > self.m_max_tombstones:
+            _, seq = self.m_tombstones.popitem(last=False)
+            self.m_floor = max(self.m_floor, seq)
+
+    def update(self, entries: Iterable[dict]) -> int:
+        """Add or modify entries, leaving every other entry in place
+
+        Args:
+            entries (Iterable[dict]): device entries
+
+        Returns:
+            int: number of entries that changed
+        """
+        changed = 0
+        with self.m_lock:
+            for entry in entries:
+                if entry and "filename" in entry:
+                    changed += self._upsert(entry)
+        return changed
+
+    def remove(self, keys: Iterable[Tuple[str, str]]) -> int:
+        """Remove entries
+
+        Args:
+            keys (Iterable[Tuple[str, str]]): (dirroot, filename) of each entry to remove
+
+        Returns:
+            int: number of entries that were removed
+        """
+        changed = 0
+        with self.m_lock:
+            for key in keys:
+                changed += self._remove(tuple(key))
+            self._prune_tombstones()
+        return changed
+
+    def replace(self, entries: Iterable[dict]) -> int:
+        """Make the catalog hold exactly these entries
+
+        Entries that are new or different are stamped as changed, and entries
+        that are no longer present are removed.
+
+        Args:
+            entries (Iterable[dict]): The complete list of device entries
+
+        Returns:
+            int: number of entries that changed
+        """
+        with self.m_lock:
+            entries = [entry for entry in entries if entry and "filename" in entry]
+            keep = set(entry_key(entry) for entry in entries)
+            stale = [key for key in self.m_entries if key not in keep]
+
+            changed = self.update(entries)
+            changed += self.remove(stale)
+        return changed
+
+    def save(self, filename: str, keep: Callable[[dict], bool] = None) -> bool:
+        """Write a snapshot of the entries
+
+        Args:
+            filename (str): snapshot file, written atomically
+            keep (Callable[[dict], bool], optional): only write the entries this returns True for
+
+        Returns:
+            bool: True if written
+        """
+        with self.m_lock:
+            snapshot = {"entries": [entry for entry in self.m_entries.values() if keep is None or keep(entry)]}
+        try:
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            write_json_atomic(filename, snapshot)
+        except (OSError, TypeError, ValueError) as e:
+            debug_print(f"Failed to write {filename}: {e}")
+            return False
+        return True
+
+    def load(self, filename: str) -> int:
+        """Add the entries of a snapshot written by save()
+
+        Args:
+            filename (str): snapshot file
+
+        Returns:
+            int: number of entries loaded
+        """
+        if not os.path.exists(filename):
+            return 0
+        try:
+            with open(filename, "r") as fid:
+                snapshot = json.load(fid)
+        except (OSError, json.decoder.JSONDecodeError) as e:
+            debug_print(f"Failed to read {filename}: {e}")
+            return 0
+        return self.update(snapshot.get("entries", []))
+
+    def changes_since(self, since: int, epoch: str = None) -> dict:
+        """Get the changes made after a sequence number
+
+        Args:
+            since (int): The last sequence number the caller has seen.
+            epoch (str, optional): The epoch that sequence number belongs to.
+
+        Returns:
+            dict: {epoch, seq, since, full, updated: List[entry], removed: List[[dirroot, filename]]}.
+            When full is True, updated is the whole catalog and the caller should
+            discard anything it holds that is not in it.
+        """
+        with self.m_lock:
+            full = epoch != self.m_epoch or since is None or since < self.m_floor or since > self.m_seq
+
+            if full:
+                updated = list(self.m_entries.values())
+                removed = []
+                since = 0
+            else:
+                updated = [self.m_entries[key] for key, seq in self.m_entry_seq.items() if seq > since]
+                removed = [list(key) for key, seq in self.m_tombstones.items() if seq > since]
+
+            return {
+                "epoch": self.m_epoch,
+                "seq": self.m_seq,
+                "since": since,
+                "full": full,
+                "updated": updated,
+                "removed": removed
+            }
+
+    def digest(self) -> str:
+        """The root digest of the catalog
+
+        Returns:
+            str: hex digest
+        """
+        with self.m_lock:
+            return self.m_tree.digest()
+
+    def digest_nodes(self, prefixes: List[str], with_entries: bool = False) -> dict:
+        """Describe Merkle tree nodes
+
+        Args:
+            prefixes (List[str]): Node names. "" is the root.
+            with_entries (bool): For leaf buckets, also include the full entries.
+
+        Returns:
+            dict: {epoch, seq, depth, nodes: List[node], invalid: List[prefix]}.  See MerkleTree.node()
+            "invalid" lists the prefixes that are not node names.
+        """
+        with self.m_lock:
+            nodes = []
+            invalid = []
+            for prefix in prefixes:
+                node = self.m_tree.node(prefix)
+                if node is None:
+                    invalid.append(prefix)
+                    continue
+                if with_entries and "entries" in node:
+                    node["updated"] = [self.m_entries[(dirroot, filename)] for dirroot, filename, _ in node["entries"]]
+                nodes.append(node)
+
+            return {
+                "epoch": self.m_epoch,
+                "seq": self.m_seq,
+                "depth": self.m_tree.depth,
+                "nodes": nodes,
+                "invalid": invalid
+            }
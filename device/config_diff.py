@@ -0,0 +1,82 @@
+# What changed between two versions of the config
+
+import json
+
+from typing import Iterable, List
+
+# changing these needs new connections to the servers
+RECONNECT_KEYS = ("robot_name", "API_KEY_TOKEN")
+
+# every top level key the device reads, see config/config.yaml.  Most are
+# optional, so save_config() must accept them even when the config file
+# that was loaded does not have them yet.
+KNOWN_KEYS = (
+    "project", "robot_name", "API_KEY_TOKEN", "watch", "local_tz", "servers", "zero_conf",
+    "threads", "include_suffix", "exclude_suffix", "rules", "wait_s",
+    "computeMD5", "chunk_size", "chunk_size_mb", "split_size_gb", "direct_io", "max_pending_mb",
+    "allow_pull", "bundle_max_file_mb", "bundle_size_mb", "bundle_max_files",
+    "live_quiet_s", "live_upload", "live_max_tails", "live_poll_s", "detect_writers",
+    "state_dir", "low_water_pct", "high_water_pct", "purge", "storage_check_s",
+    "device_concurrency", "throttle", "autoscale", "task_timeout_s", "max_tasks_per_worker", "scan_delay_s",
+)
+
+
+class ConfigDiff:
+    """
+    The keys that differ between an old and a new config, so a save only
+    applies what changed: new watch directories are scanned on their own,
+    removed ones are dropped from the catalog, pools and limits are
+    reconfigured in place, and the servers are only reconnected for
+    RECONNECT_KEYS.
+    """
+
+    def __init__(self, old: dict, new: dict) -> None:
+        """
+        Compares two configs.
+
+        Args:
+            old (dict): config before the change
+            new (dict): config after the change
+        """
+        self.m_old = old
+        self.m_new = new
+        self.m_changed = set(key for key in set(old) | set(new) if old.get(key) != new.get(key))
+
+    def __repr__(self) -> str:
+        return json.dumps(sorted(self.m_changed))
+
+    def __bool__(self) -> bool:
+        return len(self.m_changed) > 0
+
+    def changed(self, *keys: Iterable[str]) -> bool:
+        """Did any of these keys change?"""
+        return any(key in self.m_changed for key in keys)
+
+    def added(self, key: str) -> List[str]:
+        """Items of a list that are in the new config only
+
+        Args:
+            key (str): a list valued key, e.g. "watch"
+
+        Returns:
+            List[str]: the new items, in order
+        """
+        old = self.m_old.get(key) or []
+        return [item for item in (self.m_new.get(key) or []) if item not in old]
+
+    def removed(self, key: str) -> List[str]:
+        """Items of a list that are in the old config only
+
+        Args:
+            key (str): a list valued key, e.g. "watch"
+
+        Returns:
+            List[str]: the removed items, in order
+        """
+        new = self.m_new.get(key) or []
+        return [item for item in (self.m_old.get(key) or []) if item not in new]
+
+    @property
+    def reconnect(self) -> bool:
+        """Do the servers need new connections?"""
+        return self.changed(*RECONNECT_KEYS)
@@ -0,0 +1,112 @@
+# Run a pool task with a time limit
+
+import os
+import psutil
+import signal
+import time
+
+from typing import Callable, Tuple
+
+from device.debug_print import debug_print
+
+
+class TaskTimeout(BaseException):
+    """Raised in a worker when its task runs past the deadline
+
+    A BaseException, so the "except Exception" blocks in the workers do not swallow it.
+    """
+
+
+def _on_alarm(signum, frame):
+    raise TaskTimeout()
+
+
+def _kill_children(process: psutil.Process):
+    """Kill the processes a task started (e.g. ffprobe), so they do not outlive it"""
+    try:
+        children = process.children(recursive=True)
+    except psutil.Error:
+        return
+    for child in children:
+        try:
+            child.kill()
+        except psutil.Error:
+            continue
+    psutil.wait_procs(children, timeout=5)
+
+
+def run_with_deadline(args: Tuple[Callable, any, float, str]) -> Tuple[bool, any]:
+    """Pool task wrapper: run func(args) for at most timeout_s seconds
+
+    * After timeout_s seconds (SIGALRM), TaskTimeout is raised in the task.
+      Blocking system calls are interrupted too.  Any process the task
+      started is killed.
+    * A task stuck in native code never sees the exception. After
+      2 * timeout_s seconds of cpu time, SIGVTALRM (default action) ends the
+      worker, and the pool starts a new one.
+    * A task that is stuck without using cpu (e.g. in an uninterruptible
+      read) is killed by the parent, through kill_task().
+
+    Args:
+        args (Tuple[Callable, any, float, str]): func, args for func, timeout_s, and the
+            file to write the worker's pid to while the task runs (None for none)
+
+    Returns:
+        Tuple[bool, any]: (True, result), or (False, reason) when the deadline passed
+    """
+    func, func_args, timeout_s, pid_file = args
+
+    if pid_file:
+        with open(pid_file, "w") as fid:
+            fid.write(str(os.getpid()))
+
+    start = time.time()
+    previous = signal.signal(signal.SIGALRM, _on_alarm)
+    signal.setitimer(signal.ITIMER_REAL, timeout_s)
+    signal.signal(signal.SIGVTALRM, signal.SIG_DFL)
+    signal.setitimer(signal.ITIMER_VIRTUAL, timeout_s * 2)
+    try:
+        return True, func(func_args)
+    except TaskTimeout:
+        _kill_children(psutil.Process())
+        return False, f"timed out after {time.time() - start:.0f} seconds"
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.setitimer(signal.ITIMER_VIRTUAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+        if pid_file:
+            try:
+                os.remove(pid_file)
+            except OSError:
+                pass
+
+
+def kill_task(pid_file: str) -> bool:
+    """Kill the pool worker that is running a task, and everything it started
+
+    The pool notices the dead worker and starts a new one, so the worker's
+    slot is not lost to a task that never returns.
+
+    Args:
+        pid_file (str): the pid file given to run_with_deadline()
+
+    Returns:
+        bool: True if a worker was killed
+    """
+    try:
+        with open(pid_file, "r") as fid:
+            pid = int(fid.read().strip())
+        worker = psutil.Process(pid)
+        if worker.ppid() != os.getpid():
+            # the task is over, and the pid was reused 
+            return False
+    except (OSError, ValueError, psutil.Error):
+        return False
+
+    _kill_children(worker)
+    try:
+        worker.kill()
+    except psutil.Error:
+        return False
+    debug_print(f"Killed worker {pid}")
+    return True
@@ -0,0 +1,430 @@
+# Metadata extractors for each kind of file, in a cheap and an expensive tier
+
+import importlib.metadata
+import os
+import struct
+import threading
+import time
+
+from typing import Callable, Iterable, List, Optional, Tuple
+
+from datetime import datetime, timedelta, timezone
+from mcap.reader import make_reader
+import mcap.exceptions
+import pytz
+
+from device.debug_print import debug_print
+from device.imagemeta import ImageFormatError, jpeg_datetime, png_datetime
+from device.mp4 import Mp4FormatError, read_movie
+from device.rosbag1 import getMetaDataROS1
+from device.rosbag2 import getMetaDataBag2, getMetaDataDB3, shard_metadata
+from device.utils import (getDateFromFilename, _getMetaDataJPEG, _getMetaDataMCAP, _getMetaDataMP4,
+                          _getMetaDataPNG, _getMetaDataText, _getMetadataROS)
+
+# the flag on a device entry whose expensive fields are not filled in yet
+PENDING = "metadata_pending"
+
+# fields an extractor may return for the device's own scheduling. They are not stored or sent
+LOCAL_FIELDS = ("bag_counted",)
+
+
+class Extractor:
+    """
+    Extracts the metadata of one kind of file, in two tiers.
+
+    * cheap(filename, local_tz): fields that cost a stat or a small read,
+      e.g. the times in an MCAP summary.  Runs during the scan.
+    * expensive(filename, local_tz): everything, e.g. counting the messages
+      of every topic, or ffprobe.  Runs later, in the "details" stage, or
+      right away when a server asks for it ("device_metadata_request").
+
+    Either returns a dict of fields, or None for a file that can not be read
+    (the file is left out of the catalog).  A tier that raises found no
+    fields ({}): a bug in an extractor does not drop files, and after a
+    cheap tier that raised, the expensive tier still runs.  The expensive
+    tier is only run when the cheap tier did not already find all of the
+    fields.
+
+    A file is matched by its suffix, or else by magic bytes at the start of
+    the file.  An extractor that is thread_safe may run in a thread of the
+    device (e.g. for a server's request), without a deadline.  Only mark
+    extractors whose tiers are short and bounded (a header read).  The
+    others only run in a worker process, under the task deadline and the
+    quarantine.
+    """
+
+    def __init__(self, name: str, suffixes: List[str], cheap: Callable[[str, str], Optional[dict]],
+                 expensive: Callable[[str, str], Optional[dict]] = None, fields: Tuple[str, ...] = (),
+                 magic: List[Tuple[int, bytes]] = None, thread_safe: bool = False) -> None:
+        """
+        Initializes an extractor.
+
+        Args:
+            name (str): name of the format
+            suffixes (List[str]): file name suffixes, lower case
+            cheap (Callable[[str, str], Optional[dict]]): cheap tier
+            expensive (Callable[[str, str], Optional[dict]], optional): expensive tier
+            fields (Tuple[str, ...]): fields the expensive tier provides
+            magic (List[Tuple[int, bytes]], optional): (offset, bytes) that identify the format
+            thread_safe (bool): short and bounded, safe to run in a thread instead of a worker process
+        """
+        self.name = name
+        self.suffixes = tuple(suffixes)
+        self.cheap = cheap
+        self.expensive = expensive
+        self.fields = fields
+        self.magic = magic or []
+        self.thread_safe = thread_safe
+
+    def pending(self, metadata: dict) -> bool:
+        """Does the expensive tier still have to run, after the cheap tier found metadata?
+
+        A shard of a rosbag2 bag whose metadata.yaml has the message counts
+        ("bag_counted") does not need its own "topics".
+        """
+        fields = self.fields
+        if metadata.get("bag_counted"):
+            fields = tuple(field for field in fields if field != "topics")
+        return self.expensive is not None and not all(field in metadata for field in fields)
+
+
+def _image_header(read_time: Callable[[str], Optional[str]]) -> Callable[[str, str], dict]:
+    """The time of an image: its file name, else its header (read_time), else its modification time
+
+    A header read_time can not parse is left to the expensive tier, if any.
+    """
+    def extract(filename: str, local_tz: str) -> dict:
+        formatted_date = getDateFromFilename(filename)
+        if formatted_date is None:
+            try:
+                formatted_date = read_time(filename)
+            except (OSError, struct.error, ImageFormatError) as e:
+                debug_print(f"Failed to read the header of {filename}: {e}")
+                return {}
+        if formatted_date is None:
+            return _getMetaDataText(filename)
+        return {"start_time": formatted_date, "end_time": formatted_date}
+    return extract
+
+
+def _ros1_index(filename: str, local_tz: str) -> dict:
+    """The times and counts from the index of a ROS1 bag. An unreadable index is left to AnyReader, the expensive tier"""
+    return getMetaDataROS1(filename, local_tz) or {}
+
+
+def _mcap_summary(filename: str, local_tz: str) -> Optional[dict]:
+    """The times, and the message counts if the writer kept them, from the summary of an MCAP file
+
+    A shard of a rosbag2 bag whose metadata.yaml has its times and the counts
+    is not opened at all.
+    """
+    # a shard of a rosbag2 bag
+    rtn = shard_metadata(filename, local_tz)
+    if rtn.get("bag_counted") and "start_time" in rtn:
+        return rtn
+
+    with open(filename, "rb") as f:
+        try:
+            reader = make_reader(f)
+            summary = reader.get_summary()
+        except mcap.exceptions.EndOfFile:
+            return None
+        except Exception as e:
+            debug_print(f"Failed to read {filename} because {e}")
+            return None
+
+    if summary is None or summary.statistics is None or summary.statistics.message_end_time == 0:
+        # no summary, e.g. still being written or not reindexed. Leave it to the expensive tier
+        return rtn
+
+    statistics = summary.statistics
+    rtn.update({
+        "start_time": datetime.fromtimestamp(statistics.message_start_time // 1e9, tz=timezone.utc).astimezone(pytz.timezone(local_tz)).strftime("%Y-%m-%d %H:%M:%S"),
+        "end_time": datetime.fromtimestamp(statistics.message_end_time // 1e9, tz=timezone.utc).astimezone(pytz.timezone(local_tz)).strftime("%Y-%m-%d %H:%M:%S"),
+    })
+    if statistics.channel_message_counts:
+        topics = {}
+        for channel_id, count in statistics.channel_message_counts.items():
+            channel = summary.channels.get(channel_id)
+            if channel is not None:
+                topics[channel.topic] = topics.get(channel.topic, 0) + count
+        rtn["topics"] = topics
+    return rtn
+
+
+def _mp4_boxes(filename: str, local_tz: str) -> dict:
+    """The times of a movie from its moov box, as _getMetaDataMP4() gets them from ffprobe
+
+    A file the box reader can not handle is left to ffprobe, the expensive tier.
+    """
+    try:
+        creation_time, duration = read_movie(filename)
+        if creation_time is None:
+            # no creation time: the file name, or the modification time
+            return _getMetaDataText(filename)
+
+        formatted_date = getDateFromFilename(filename)
+        if formatted_date:
+            creation_time = datetime.fromisoformat(formatted_date)
+        end_time = creation_time + timedelta(seconds=duration)
+    except (OSError, struct.error, Mp4FormatError, ValueError, OverflowError) as e:
+        # ValueError, OverflowError: a date or duration out of range
+        debug_print(f"Leaving {filename} to ffprobe: {e}")
+        return {}
+
+    return {
+        "start_time": creation_time.strftime("%Y-%m-%d %H:%M:%S"),
+        "end_time": end_time.strftime("%Y-%m-%d %H:%M:%S")
+    }
+
+
+def _bag2_metadata(filename: str, local_tz: str) -> dict:
+    """The run of a rosbag2 bag, or any other metadata.yaml as a text file"""
+    return getMetaDataBag2(filename, local_tz) or _getMetaDataText(filename)
+
+
+def _read_bytes() -> int:
+    """Bytes read by this thread so far, from /proc/thread-self/io. 0 where that is not available"""
+    try:
+        with open("/proc/thread-self/io", "r") as fid:
+            for line in fid:
+                if line.startswith("rchar:"):
+                    return int(line.split()[1])
+    except (OSError, ValueError):
+        pass
+    return 0
+
+
+# reading /proc/thread-self/io counts as reading too
+_READ_BYTES_OVERHEAD = -(_read_bytes() - _read_bytes())
+
+
+class ExtractorStats:
+    """
+    The cost of metadata extraction, per format and tier: files, seconds,
+    bytes read and failures.  The workers report each file with
+    cheap_metadata(..., costs) and expensive_metadata(..., costs), and the
+    device adds the reports up here.
+    """
+
+    def __init__(self) -> None:
+        self.m_lock = threading.Lock()
+        self.m_stats = {}  # (name, tier) -> {files, seconds, bytes_read, failures}
+
+    def record(self, costs: Iterable[Tuple[str, str, float, int, bool]]):
+        """Add up reports
+
+        Args:
+            costs (Iterable[Tuple[str, str, float, int, bool]]): (name, tier, seconds, bytes_read, failed)
+        """
+        with self.m_lock:
+            for name, tier, seconds, bytes_read, failed in costs:
+                stats = self.m_stats.setdefault((name, tier), {"files": 0, "seconds": 0.0, "bytes_read": 0, "failures": 0})
+                stats["files"] += 1
+                stats["seconds"] += seconds
+                stats["bytes_read"] += bytes_read
+                stats["failures"] += int(failed)
+
+    def table(self) -> List[dict]:
+        """One row per format and tier, the most time consuming first"""
+        with self.m_lock:
+            rows = [dict(stats, name=name, tier=tier) for (name, tier), stats in self.m_stats.items()]
+        return sorted(rows, key=lambda row: row["seconds"], reverse=True)
+
+
+class ExtractorRegistry:
+    """
+    The extractors, by suffix and by magic bytes.  The longest matching
+    suffix wins, e.g. "/metadata.yaml" over ".yaml".
+
+    More extractors can be installed as plugins: a package that declares
+    an entry point in the "storage_tools_device.extractors" group, pointing
+    to an Extractor, a list of them, or a function that returns either.
+    Plugins are loaded on first use, and a plugin's suffix takes precedence
+    over a built in one.
+    """
+
+    ENTRY_POINT_GROUP = "storage_tools_device.extractors"
+
+    def __init__(self, extractors: List[Extractor]) -> None:
+        """
+        Initializes the registry.
+
+        Args:
+            extractors (List[Extractor]): the built in extractors
+        """
+        self.m_lock = threading.Lock()
+        self.m_extractors = []
+        self.m_by_suffix = {}
+        self.m_suffixes = []  # longest first
+        self.m_plugins_loaded = False
+        for extractor in extractors:
+            self.register(extractor)
+
+    def register(self, extractor: Extractor):
+        """Add an extractor, replacing any other for the same suffixes"""
+        with self.m_lock:
+            self.m_extractors.append(extractor)
+            for suffix in extractor.suffixes:
+                self.m_by_suffix[suffix.lower()] = extractor
+            self.m_suffixes = sorted(self.m_by_suffix, key=len, reverse=True)
+
+    def load_plugins(self):
+        """Register the extractors of the installed plugins, once"""
+        with self.m_lock:
+            if self.m_plugins_loaded:
+                return
+            self.m_plugins_loaded = True
+
+        for entry_point in importlib.metadata.entry_points(group=self.ENTRY_POINT_GROUP):
+            try:
+                plugin = entry_point.load()
+                if callable(plugin) and not isinstance(plugin, Extractor):
+                    plugin = plugin()
+                for extractor in (plugin if isinstance(plugin, (list, tuple)) else [plugin]):
+                    if not isinstance(extractor, Extractor):
+                        debug_print(f"Ignoring extractor plugin {entry_point.name}: not an Extractor")
+                        continue
+                    self.register(extractor)
+                    debug_print(f"Loaded extractor {extractor.name} from {entry_point.value}")
+            except Exception as e:
+                debug_print(f"Failed to load extractor plugin {entry_point.name}: {e}")
+
+    def find(self, filename: str) -> Optional[Extractor]:
+        """The extractor for a file, by its suffix, or else by its magic bytes
+
+        Args:
+            filename (str): path to the file
+
+        Returns:
+            Optional[Extractor]: None for a file without one
+        """
+        self.load_plugins()
+        lower = filename.lower()
+        for suffix in self.m_suffixes:
+            if lower.endswith(suffix):
+                return self.m_by_suffix[suffix]
+
+        with_magic = [extractor for extractor in self.m_extractors if extractor.magic]
+        if not with_magic:
+            return None
+        length = max(offset + len(magic) for extractor in with_magic for offset, magic in extractor.magic)
+        try:
+            with open(filename, "rb") as fid:
+                head = fid.read(length)
+        except OSError:
+            return None
+        for extractor in with_magic:
+            for offset, magic in extractor.magic:
+                if head[offset:offset + len(magic)] == magic:
+                    return extractor
+        return None
+
+    def names(self) -> List[str]:
+        """Names of the registered extractors"""
+        with self.m_lock:
+            return [extractor.name for extractor in self.m_extractors]
+
+
+REGISTRY = ExtractorRegistry([
+    Extractor("mcap", [".mcap"], _mcap_summary, _getMetaDataMCAP, ("start_time", "end_time", "topics"),
+              magic=[(0, b"\x89MCAP")]),
+    Extractor("ros1", [".bag"], _ros1_index, _getMetadataROS, ("start_time", "end_time", "topics"),
+              magic=[(0, b"#ROSBAG V2.0")]),
+    Extractor("jpeg", [".jpg", ".jpeg"], _image_header(jpeg_datetime), lambda filename, local_tz: _getMetaDataJPEG(filename), ("start_time", "end_time"),
+              magic=[(0, b"\xff\xd8\xff")], thread_safe=True),
+    Extractor("mp4", [".mp4", ".mov"], _mp4_boxes, lambda filename, local_tz: _getMetaDataMP4(filename), ("start_time", "end_time"),
+              magic=[(4, b"ftyp")]),
+    Extractor("png", [".png"], _image_header(png_datetime), lambda filename, local_tz: _getMetaDataPNG(filename), ("start_time", "end_time"),
+              magic=[(0, b"\x89PNG\r\n\x1a\n")], thread_safe=True),
+    Extractor("text", [".txt", ".ass", ".yaml"], lambda filename, local_tz: _getMetaDataText(filename), thread_safe=True),
+    Extractor("rosbag2", ["/metadata.yaml"], _bag2_metadata, thread_safe=True),
+    Extractor("db3", [".db3"], shard_metadata, getMetaDataDB3, ("start_time", "end_time", "topics"),
+              magic=[(0, b"SQLite format 3\x00")]),
+])
+
+
+def find_extractor(filename: str) -> Optional[Extractor]:
+    """The extractor for a file, see ExtractorRegistry.find()"""
+    return REGISTRY.find(filename)
+
+
+def _run(extractor: Extractor, tier: str, func: Callable, filename: str, local_tz: str, costs: Optional[list]) -> Optional[dict]:
+    """Run one tier of an extractor, and report its cost
+
+    Returns:
+        Optional[dict]: what the tier returned, {} if it raised
+    """
+    start = time.time()
+    start_bytes = _read_bytes()
+    failed = False
+    try:
+        metadata = func(filename, local_tz)
+        failed = metadata is None
+    except Exception as e:
+        debug_print(f"{extractor.name} {tier} failed on {filename}: {e}")
+        metadata = {}
+        failed = True
+    if costs is not None:
+        bytes_read = max(0, _read_bytes() - start_bytes - _READ_BYTES_OVERHEAD)
+        costs.append((extractor.name, tier, time.time() - start, bytes_read, failed))
+    return metadata
+
+
+def cheap_metadata(filename: str, local_tz: str, costs: list = None) -> Tuple[Optional[dict], bool]:
+    """Run the cheap tier
+
+    Args:
+        filename (str): path to the file
+        local_tz (str): time zone of the robot
+        costs (list, optional): (name, tier, seconds, bytes_read, failed) is appended, see ExtractorStats
+
+    Returns:
+        Tuple[Optional[dict], bool]: (metadata or None, True if the expensive tier still has to run)
+    """
+    extractor = find_extractor(filename)
+    if extractor is None:
+        return {}, False
+    metadata = _run(extractor, "cheap", extractor.cheap, filename, local_tz, costs)
+    if metadata is None:
+        return None, False
+    return metadata, extractor.pending(metadata)
+
+
+def expensive_metadata(filename: str, local_tz: str, costs: list = None) -> Optional[dict]:
+    """Run the expensive tier
+
+    Args:
+        filename (str): path to the file
+        local_tz (str): time zone of the robot
+        costs (list, optional): (name, tier, seconds, bytes_read, failed) is appended, see ExtractorStats
+
+    Returns:
+        Optional[dict]: metadata, or None if the file can not be read
+    """
+    extractor = find_extractor(filename)
+    if extractor is None or extractor.expensive is None:
+        return {}
+    if not os.path.exists(filename):
+        return None
+    return _run(extractor, "expensive", extractor.expensive, filename, local_tz, costs)
+
+
+def metadata(filename: str, local_tz: str) -> Optional[dict]:
+    """Run both tiers
+
+    Args:
+        filename (str): path to the file
+        local_tz (str): time zone of the robot
+
+    Returns:
+        Optional[dict]: metadata, or None if the file can not be read
+    """
+    rtn, pending = cheap_metadata(filename, local_tz)
+    if rtn is None or not pending:
+        return rtn
+    expensive = expensive_metadata(filename, local_tz)
+    if expensive is None:
+        return None
+    rtn.update(expensive)
+    return rtn
@@ -0,0 +1,161 @@
+# Stream large files without filling the page cache
+
+import mmap
+import os
+
+from typing import Iterator
+
+from device.debug_print import debug_print
+
+# O_DIRECT needs the buffer, offsets and lengths aligned to the logical block size.
+# The page size is a multiple of every block size in use.
+ALIGN = mmap.PAGESIZE
+
+_has_fadvise = hasattr(os, "posix_fadvise")
+
+
+class StreamReader:
+    """
+    Reads a file front to back through one preallocated buffer.
+
+    * readinto() (os.preadv) fills the same buffer for each chunk, so no
+      bytes object is allocated per chunk.
+    * The kernel is told the file is read sequentially, and the next few
+      chunks are requested ahead of the cursor (WILLNEED).
+    * Pages behind the cursor are dropped from the page cache (DONTNEED), so
+      uploading terabytes does not evict the working set of everything else
+      running on the robot.
+    * With direct set, the file is opened with O_DIRECT and skips the page
+      cache entirely. Falls back to buffered reads where O_DIRECT is not
+      supported.
+
+    The chunks are memoryviews into the buffer, and are only valid until the
+    next chunk is read.  Use as a context manager.
+    """
+
+    def __init__(self, fullpath: str, chunk_size: int, offset: int = 0, direct: bool = False, readahead_chunks: int = 2) -> None:
+        """
+        Opens the file.
+
+        Args:
+            fullpath (str): path to the file
+            chunk_size (int): bytes per read
+            offset (int): where to start reading
+            direct (bool): Try to bypass the page cache with O_DIRECT.
+            readahead_chunks (int): chunks to request ahead of the cursor
+        """
+        self.m_fullpath = fullpath
+        self.m_pos = offset
+        self.m_dropped = offset
+        self.m_chunk_size = max(ALIGN, (chunk_size + ALIGN - 1) // ALIGN * ALIGN)
+        self.m_readahead_b = self.m_chunk_size * readahead_chunks
+        self.m_direct = False
+        self.m_fd = None
+
+        if direct and hasattr(os, "O_DIRECT"):
+            try:
+                self.m_fd = os.open(fullpath, os.O_RDONLY | os.O_DIRECT)
+                self.m_direct = True
+            except OSError as e:
+                # e.g. tmpfs, some fuse filesystems
+                debug_print(f"O_DIRECT not available for {fullpath}: {e}")
+
+        if self.m_fd is None:
+            self.m_fd = os.open(fullpath, os.O_RDONLY)
+
+        # an anonymous mmap is page aligned, as O_DIRECT requires
+        self.m_mmap = mmap.mmap(-1, self.m_chunk_size)
+        self.m_buffer = memoryview(self.m_mmap)
+
+        self._advise(0, 0, "POSIX_FADV_SEQUENTIAL")
+        self._advise(self.m_pos, self.m_readahead_b, "POSIX_FADV_WILLNEED")
+
+    def __enter__(self) -> "StreamReader":
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @property
+    def pos(self) -> int:
+        return self.m_pos
+
+    def _advise(self, offset: int, length: int, advice: str):
+        if not _has_fadvise or self.m_direct:
+            return
+        try:
+            os.posix_fadvise(self.m_fd, offset, length, getattr(os, advice))
+        except OSError:
+            pass
+
+    def read(self, size: int = None) -> memoryview:
+        """Read the next chunk
+
+        Args:
+            size (int, optional): most bytes to read. Defaults to, and is limited to, the chunk size.
+
+        Returns:
+            memoryview: the bytes read, empty at the end of the file. Valid until the next read.
+        """
+        if size is None or size > self.m_chunk_size:
+            size = self.m_chunk_size
+        if size <= 0:
+            return self.m_buffer[:0]
+
+        if self.m_direct:
+            if self.m_pos % ALIGN != 0:
+                # only happens after a short read, at the (growing) end of the file
+                self._reopen_buffered()
+            else:
+                # O_DIRECT reads whole blocks, keep what was asked for
+                aligned = (size + ALIGN - 1) // ALIGN * ALIGN
+                count = os.preadv(self.m_fd, [self.m_buffer[:aligned]], self.m_pos)
+                count = min(count, size)
+                self.m_pos += count
+                return self.m_buffer[:count]
+
+        count = os.preadv(self.m_fd, [self.m_buffer[:size]], self.m_pos)
+        self.m_pos += count
+
+        # read ahead of the cursor, and drop what is behind it
+        if count > 0:
+            self._advise(self.m_pos, self.m_readahead_b, "POSIX_FADV_WILLNEED")
+            if self.m_pos - self.m_dropped >= self.m_readahead_b:
+                self._advise(self.m_dropped, self.m_pos - self.m_dropped, "POSIX_FADV_DONTNEED")
+                self.m_dropped = self.m_pos
+        return self.m_buffer[:count]
+
+    def chunks(self, end: int = None) -> Iterator[memoryview]:
+        """Read chunks until the end of the file, or until end
+
+        Args:
+            end (int, optional): stop at this offset
+
+        Yields:
+            memoryview: each chunk. Valid until the next one is read.
+        """
+        while end is None or self.m_pos < end:
+            size = self.m_chunk_size if end is None else end - self.m_pos
+            chunk = self.read(size)
+            if len(chunk) == 0:
+                break
+            yield chunk
+
+    def _reopen_buffered(self):
+        os.close(self.m_fd)
+        self.m_fd = os.open(self.m_fullpath, os.O_RDONLY)
+        self.m_direct = False
+        self.m_dropped = self.m_pos
+
+    def close(self):
+        if self.m_fd is None:
+            return
+        self._advise(self.m_dropped, 0, "POSIX_FADV_DONTNEED")
+        os.close(self.m_fd)
+        self.m_fd = None
+        try:
+            self.m_buffer.release()
+            self.m_mmap.close()
+        except BufferError:
+            # a caller still holds the last chunk, the buffer is freed with it
+            pass
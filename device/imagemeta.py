@@ -0,0 +1,198 @@
+# Read the time an image was taken from its header, without reading the pixels
+
+import re
+import struct
+import zlib
+
+from typing import Optional
+
+# no EXIF block or PNG text is anywhere near this large
+MAX_HEADER_B = 256 * 1024
+
+TAG_EXIF_IFD = 0x8769
+TAG_DATETIME = 0x0132
+TAG_DATETIME_ORIGINAL = 0x9003
+
+# PNG text keywords that hold the time the image was created
+PNG_TIME_KEYWORDS = ("Creation Time", "date:create", "DateTimeOriginal")
+
+
+class ImageFormatError(ValueError):
+    """Not a JPEG or PNG, or a header this reader can not handle"""
+
+
+def format_time(value: str) -> Optional[str]:
+    """An EXIF ("YYYY:MM:DD HH:MM:SS") or ISO 8601 time, as "YYYY-MM-DD HH:MM:SS", None if it is not one"""
+    match = re.search(r"(\d{4})[:-](\d{2})[:-](\d{2})[T ](\d{2}):(\d{2}):(\d{2})", value)
+    if match is None:
+        return None
+    year, month, day, hh, mm, ss = match.groups()
+    if year == "0000":
+        return None
+    return f"{year}-{month}-{day} {hh}:{mm}:{ss}"
+
+
+def exif_datetime(tiff: bytes) -> Optional[str]:
+    """DateTimeOriginal from the Exif IFD of a TIFF structured EXIF block, or else DateTime from IFD0
+
+    Only follows the two IFDs it needs, so thumbnails and maker notes are never parsed.
+
+    Args:
+        tiff (bytes): EXIF block, starting at the byte order mark
+
+    Returns:
+        Optional[str]: "YYYY-MM-DD HH:MM:SS", None if there is no time
+    """
+    if tiff[:2] == b"II":
+        order = "<"
+    elif tiff[:2] == b"MM":
+        order = ">"
+    else:
+        raise ImageFormatError("bad EXIF byte order")
+
+    def entries(offset):
+        if offset + 2 > len(tiff):
+            raise ImageFormatError("IFD past the end of the EXIF block")
+        (count,) = struct.unpack_from(order + "H", tiff, offset)
+        for i in range(count):
+            pos = offset + 2 + i * 12
+            if pos + 12 > len(tiff):
+                raise ImageFormatError("truncated IFD")
+            yield struct.unpack_from(order + "HHII", tiff, pos)
+
+    def ascii_value(count, value_offset):
+        if count > 4:
+            raw = tiff[value_offset:value_offset + count]
+        else:
+            raw = struct.pack(order + "I", value_offset)[:count]
+        return raw.split(b"\0")[0].decode("ascii", "replace")
+
+    (ifd0,) = struct.unpack_from(order + "I", tiff, 4)
+    modified = None
+    exif_ifd = None
+    for tag, kind, count, value_offset in entries(ifd0):
+        if tag == TAG_EXIF_IFD:
+            exif_ifd = value_offset
+        elif tag == TAG_DATETIME and kind == 2:
+            modified = format_time(ascii_value(count, value_offset))
+
+    if exif_ifd is not None:
+        for tag, kind, count, value_offset in entries(exif_ifd):
+            if tag == TAG_DATETIME_ORIGINAL and kind == 2:
+                original = format_time(ascii_value(count, value_offset))
+                if original:
+                    return original
+    return modified
+
+
+def jpeg_datetime(filename: str) -> Optional[str]:
+    """The time a JPEG was taken, from its EXIF (APP1) segment
+
+    Reads the segments before the image data, and stops at the first EXIF
+    segment or at the start of scan.
+
+    Args:
+        filename (str): path to the JPEG
+
+    Raises:
+        ImageFormatError: not a JPEG, or a damaged header
+
+    Returns:
+        Optional[str]: "YYYY-MM-DD HH:MM:SS", None if the file has no EXIF time
+    """
+    with open(filename, "rb") as fid:
+        if fid.read(2) != b"\xff\xd8":
+            raise ImageFormatError("not a JPEG")
+        read = 2
+        while read < MAX_HEADER_B:
+            marker = fid.read(2)
+            if len(marker) < 2 or marker[0] != 0xFF:
+                raise ImageFormatError("bad JPEG marker")
+            if marker[1] == 0xFF:
+                # fill byte
+                fid.seek(-1, 1)
+                read += 1
+                continue
+            if marker[1] in (0xD9, 0xDA):
+                # end of image, or start of scan: the pixels follow
+                return None
+            if 0xD0 <= marker[1] <= 0xD7 or marker[1] == 0x01:
+                read += 2
+                continue
+
+            (length,) = struct.unpack(">H", fid.read(2))
+            if length < 2:
+                raise ImageFormatError("bad JPEG segment length")
+            read += 2 + length
+            if marker[1] == 0xE1:
+                segment = fid.read(length - 2)
+                if segment[:6] == b"Exif\0\0":
+                    return exif_datetime(segment[6:])
+            else:
+                fid.seek(length - 2, 1)
+    return None
+
+
+def png_datetime(filename: str) -> Optional[str]:
+    """The time a PNG was created, from its eXIf, tEXt, zTXt, iTXt or tIME chunks
+
+    Reads the chunks before the image data (IDAT) only.  In order of
+    preference: the EXIF time, a creation time text, the tIME chunk (the
+    time of the last change, UTC).
+
+    Args:
+        filename (str): path to the PNG
+
+    Raises:
+        ImageFormatError: not a PNG, or a damaged header
+
+    Returns:
+        Optional[str]: "YYYY-MM-DD HH:MM:SS", None if the file has no time
+    """
+    text_time = None
+    change_time = None
+    with open(filename, "rb") as fid:
+        if fid.read(8) != b"\x89PNG\r\n\x1a\n":
+            raise ImageFormatError("not a PNG")
+        read = 8
+        while read < MAX_HEADER_B:
+            header = fid.read(8)
+            if len(header) < 8:
+                break
+            length, kind = struct.unpack(">I4s", header)
+            read += 12 + length
+            if kind in (b"IDAT", b"IEND"):
+                break
+            if kind not in (b"eXIf", b"tEXt", b"zTXt", b"iTXt", b"tIME") or length > MAX_HEADER_B:
+                fid.seek(length + 4, 1)
+                continue
+
+            data = fid.read(length)
+            fid.seek(4, 1)
+            if len(data) < length:
+                raise ImageFormatError("truncated PNG chunk")
+
+            if kind == b"eXIf":
+                exif = exif_datetime(data)
+                if exif:
+                    return exif
+            elif kind == b"tIME" and length == 7:
+                year, month, day, hh, mm, ss = struct.unpack(">HBBBBB", data)
+                change_time = f"{year:04d}-{month:02d}-{day:02d} {hh:02d}:{mm:02d}:{ss:02d}"
+            elif text_time is None:
+                keyword, _, value = data.partition(b"\0")
+                if keyword.decode("latin-1") not in PNG_TIME_KEYWORDS:
+                    continue
+                try:
+                    if kind == b"zTXt":
+                        value = zlib.decompress(value[1:])
+                    elif kind == b"iTXt":
+                        compressed = value[0]
+                        # compression flag and method, language tag, translated keyword, text
+                        value = value[2:].split(b"\0", 2)[-1]
+                        if compressed:
+                            value = zlib.decompress(value)
+                except (zlib.error, IndexError):
+                    continue
+                text_time = format_time(value.decode("utf-8", "replace"))
+    return text_time or change_time
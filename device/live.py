@@ -0,0 +1,138 @@
+# Support for files that are still being recorded
+
+import os
+import queue
+import threading
+
+from datetime import datetime
+from typing import Callable, List, Tuple
+
+from device.debug_print import debug_print
+from device.utils import getDateFromFilename, pbar_thread
+from device.workers import SendWorkerArg, tail_worker
+
+
+def create_live_entry(fullpath: str, filename: str, dirroot: str, size: int, robot_name: str) -> dict:
+    """Create a device entry for a file that is still being recorded
+
+    Only has the fields that are cheap to get. The metadata and hash are filled
+    in by the first scan after the file is closed.
+
+    Args:
+        fullpath (str): path to the file
+        filename (str): path relative to dirroot
+        dirroot (str): watch directory
+        size (int): current size in bytes
+        robot_name (str): robot name
+
+    Returns:
+        dict: device entry, with "live" set to True
+    """
+    formatted_date = getDateFromFilename(fullpath)
+    if formatted_date is None:
+        creation_date = datetime.fromtimestamp(os.path.getmtime(fullpath))
+        formatted_date = creation_date.strftime("%Y-%m-%d %H:%M:%S")
+
+    return {
+        "dirroot": dirroot,
+        "filename": filename,
+        "size": size,
+        "start_time": formatted_date,
+        "end_time": formatted_date,
+        "site": "default",
+        "robot_name": robot_name,
+        "md5": None,
+        "live": True
+    }
+
+
+class LiveTails:
+    """
+    Runs tail_worker() for the files that are still being recorded, each in
+    a thread of the device process.
+
+    A tail mostly waits for the recorder, for as long as the recording
+    lasts.  So it does not take a worker of the send pool, nor a slot of
+    the per-device limits of the DeviceScheduler, and send_files() does not
+    wait for it.  Each (server, file) has at most one tail, and there are
+    at most max_tails tails, a budget of their own.
+    """
+
+    def __init__(self, on_done: Callable[[str, str, bool], None], is_open_for_write: Callable[[str], bool] = None,
+                 max_tails: int = 8) -> None:
+        """
+        Initializes the executor.
+
+        Args:
+            on_done (Callable[[str, str, bool], None]): called with (server, fullpath, finalized) when a tail ends
+            is_open_for_write (Callable[[str], bool], optional): see tail_worker()
+            max_tails (int): most tails to run at once
+        """
+        self.m_lock = threading.Lock()
+        self.m_tails = {}  # (server, fullpath) -> Event that stops the tail
+        self.m_on_done = on_done
+        self.m_is_open_for_write = is_open_for_write
+        self.m_max_tails = max(1, int(max_tails))
+
+    def configure(self, max_tails: int):
+        """Change the budget. Tails that are running are not stopped"""
+        with self.m_lock:
+            self.m_max_tails = max(1, int(max_tails))
+
+    def start(self, args: SendWorkerArg, socket_events: List[Tuple[any, str, str]], source: str) -> bool:
+        """Start tailing a file for a server
+
+        Args:
+            args (SendWorkerArg): The file to send. Its signal and message_queue are replaced.
+            socket_events (List[Tuple[any, str, str]]): where to show the progress, see pbar_thread()
+            source (str): source name
+
+        Returns:
+            bool: False if the file is already being tailed for this server, or
+            max_tails are running.  The server asks for the file again later.
+        """
+        key = (args.server, os.path.join(args.dirroot, args.relative_path))
+        with self.m_lock:
+            if key in self.m_tails:
+                return False
+            if len(self.m_tails) >= self.m_max_tails:
+                debug_print(f"{len(self.m_tails)} tails are running, not tailing {key[1]} for {key[0]}")
+                return False
+            args.signal = threading.Event()
+            self.m_tails[key] = args.signal
+
+        args.message_queue = queue.Queue()
+        threading.Thread(target=self._run, args=(key, args, socket_events, source), daemon=True).start()
+        return True
+
+    def _run(self, key: Tuple[str, str], args: SendWorkerArg, socket_events: list, source: str):
+        pbar = threading.Thread(target=pbar_thread, args=(args.message_queue, args.file_size - args.offset_b, source,
+                                                          socket_events, "Live transfer", 1))
+        pbar.start()
+
+        finalized = False
+        try:
+            _, finalized = tail_worker(args, self.m_is_open_for_write)
+        except Exception as e:
+            debug_print(f"Tail of {key[1]} failed: {e}")
+        finally:
+            args.message_queue.put({"close": True})
+            with self.m_lock:
+                self.m_tails.pop(key, None)
+        self.m_on_done(key[0], key[1], finalized)
+
+    def cancel(self, server: str = None):
+        """Stop the tails of a server, or all of them
+
+        Args:
+            server (str, optional): server address. Defaults to every server.
+        """
+        with self.m_lock:
+            for (tail_server, _), signal in self.m_tails.items():
+                if server is None or tail_server == server:
+                    signal.set()
+
+    def running(self) -> List[Tuple[str, str]]:
+        """The (server, fullpath) of the tails that are running"""
+        with self.m_lock:
+            return sorted(self.m_tails)
@@ -0,0 +1,159 @@
+# Merkle tree over the catalog entries
+
+import hashlib
+import json
+
+from typing import Tuple
+
+
+HEX_DIGITS = "0123456789abcdef"
+EMPTY_DIGEST = hashlib.sha1(b"").hexdigest()
+
+
+def entry_digest(entry: dict) -> str:
+    """The digest of a single catalog entry
+
+    sha1 of the entry as compact json with sorted keys, so a server can compute
+    the same digest from the entries it was sent.
+
+    Args:
+        entry (dict): A device entry
+
+    Returns:
+        str: hex digest
+    """
+    data = json.dumps(entry, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha1(data.encode("utf-8")).hexdigest()
+
+
+def key_hash(key: Tuple[str, str]) -> str:
+    """The hash that places a catalog key in a bucket
+
+    Args:
+        key (Tuple[str, str]): (dirroot, filename)
+
+    Returns:
+        str: hex digest. The first `depth` digits are the bucket.
+    """
+    return hashlib.sha1("\0".join(key).encode("utf-8")).hexdigest()
+
+
+class MerkleTree:
+    """
+    A fixed depth, 16-way Merkle tree over catalog entries.
+
+    Entries are bucketed by the hex prefix of the hash of their key. A node is
+    named by its prefix: "" is the root, and a prefix of `depth` digits is a leaf
+    bucket holding entries.
+
+    * A leaf digest is sha1 over the sorted "key_hash:entry_digest" lines of its entries.
+    * An internal digest is sha1 over the digests of its 16 children, in order.
+    * Empty subtrees have the digest sha1("").
+
+    Digests are recomputed lazily, only for nodes on the path of a change.
+    """
+
+    def __init__(self, depth: int = 3) -> None:
+        """
+        Initializes an empty tree.
+
+        Args:
+            depth (int): Number of levels below the root.  16**depth leaf buckets.
+        """
+        self.m_depth = depth
+        self.m_buckets = {}  # leaf prefix -> {key_hash: (key, digest)}
+        self.m_digests = {}  # prefix -> digest
+        self.m_dirty = set()  # prefixes that need their digest recomputed
+
+    @property
+    def depth(self) -> int:
+        return self.m_depth
+
+    def _mark_dirty(self, leaf: str):
+        for i in range(self.m_depth + 1):
+            self.m_dirty.add(leaf[:i])
+
+    def set(self, key: Tuple[str, str], entry: dict):
+        """Add or replace an entry
+
+        Args:
+            key (Tuple[str, str]): (dirroot, filename)
+            entry (dict): The device entry
+        """
+        h = key_hash(key)
+        leaf = h[:self.m_depth]
+        self.m_buckets.setdefault(leaf, {})[h] = (key, entry_digest(entry))
+        self._mark_dirty(leaf)
+
+    def discard(self, key: Tuple[str, str]):
+        """Remove an entry, if present
+
+        Args:
+            key (Tuple[str, str]): (dirroot, filename)
+        """
+        h = key_hash(key)
+        leaf = h[:self.m_depth]
+        bucket = self.m_buckets.get(leaf)
+        if not bucket or h not in bucket:
+            return
+
+        del bucket[h]
+        if len(bucket) == 0:
+            del self.m_buckets[leaf]
+        self._mark_dirty(leaf)
+
+    def digest(self, prefix: str = "") -> str:
+        """The digest of a node
+
+        Args:
+            prefix (str): Node name. "" for the root.
+
+        Returns:
+            str: hex digest
+        """
+        if prefix not in self.m_dirty and prefix in self.m_digests:
+            return self.m_digests[prefix]
+
+        if len(prefix) == self.m_depth:
+            bucket = self.m_buckets.get(prefix)
+            if bucket:
+                lines = sorted(f"{h}:{digest}" for h, (_, digest) in bucket.items())
+                digest = hashlib.sha1("\n".join(lines).encode("utf-8")).hexdigest()
+            else:
+                digest = EMPTY_DIGEST
+        else:
+            children = [self.digest(prefix + c) for c in HEX_DIGITS]
+            if all(child == EMPTY_DIGEST for child in children):
+                digest = EMPTY_DIGEST
+            else:
+                digest = hashlib.sha1("".join(children).encode("utf-8")).hexdigest()
+
+        self.m_dirty.discard(prefix)
+        self.m_digests[prefix] = digest
+        return digest
+
+    def node(self, prefix: str = "") -> dict:
+        """Describe a node, so a caller can decide which children to descend into
+
+        Args:
+            prefix (str): Node name. "" or None for the root.
+
+        Returns:
+            dict: {prefix, digest, children: {digit: digest}} for an internal node,
+            or {prefix, digest, entries: List[[dirroot, filename, digest]]} for a leaf bucket.
+            Returns None if the prefix is not a valid node name.
+        """
+        if prefix is None:
+            prefix = ""
+        if not isinstance(prefix, str):
+            return None
+        if len(prefix) > self.m_depth or any(c not in HEX_DIGITS for c in prefix):
+            return None
+
+        rtn = {"prefix": prefix, "digest": self.digest(prefix)}
+        if len(prefix) == self.m_depth:
+            bucket = self.m_buckets.get(prefix, {})
+            rtn["entries"] = [[key[0], key[1], digest] for (key, digest) in bucket.values()]
+        else:
+            rtn["children"] = {c: self.digest(prefix + c) for c in HEX_DIGITS}
+        return rtn
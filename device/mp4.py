@@ -0,0 +1,178 @@
+# Read the creation time and duration of an MP4/MOV file from its boxes, without ffprobe
+
+import os
+import re
+import struct
+
+from datetime import datetime, timedelta, timezone
+from typing import Iterator, Optional, Tuple
+
+# times in mvhd and mdhd count seconds from 1904-01-01 UTC
+EPOCH_1904 = datetime(1904, 1, 1, tzinfo=timezone.utc)
+
+# moov is usually a few hundred KB. Anything much larger is left to ffprobe
+MAX_MOOV_B = 64 * 1024 * 1024
+
+
+class Mp4FormatError(ValueError):
+    """Not an MP4/MOV file, or one this reader can not handle"""
+
+
+def _boxes(buffer: memoryview) -> Iterator[Tuple[bytes, memoryview]]:
+    """The boxes in a buffer: (type, payload)"""
+    pos = 0
+    while pos + 8 <= len(buffer):
+        size, kind = struct.unpack_from(">I4s", buffer, pos)
+        header = 8
+        if size == 1:
+            if pos + 16 > len(buffer):
+                raise Mp4FormatError("truncated box")
+            (size,) = struct.unpack_from(">Q", buffer, pos + 8)
+            header = 16
+        elif size == 0:
+            size = len(buffer) - pos
+        if size < header or pos + size > len(buffer):
+            raise Mp4FormatError(f"bad size for box {kind!r}")
+        yield kind, buffer[pos + header:pos + size]
+        pos += size
+
+
+def _child(buffer: memoryview, *path: bytes) -> Optional[memoryview]:
+    """The payload of the first box at path, e.g. _child(moov, b"trak", b"mdia", b"mdhd")"""
+    for kind in path:
+        for child_kind, payload in _boxes(buffer):
+            if child_kind == kind:
+                buffer = payload
+                break
+        else:
+            return None
+    return buffer
+
+
+def _read_moov(filename: str) -> memoryview:
+    """Find the moov box by walking the top level box headers, and read only it"""
+    with open(filename, "rb") as fid:
+        file_size = os.fstat(fid.fileno()).st_size
+        pos = 0
+        first = True
+        while pos + 8 <= file_size:
+            fid.seek(pos)
+            header = fid.read(16)
+            if len(header) < 8:
+                break
+            size, kind = struct.unpack_from(">I4s", header)
+            header_size = 8
+            if size == 1:
+                if len(header) < 16:
+                    break
+                (size,) = struct.unpack_from(">Q", header, 8)
+                header_size = 16
+            elif size == 0:
+                size = file_size - pos
+            if first and kind not in (b"ftyp", b"moov", b"mdat", b"free", b"skip", b"wide", b"pnot"):
+                raise Mp4FormatError("not an MP4/MOV file")
+            first = False
+            if size < header_size:
+                raise Mp4FormatError(f"bad size for box {kind!r}")
+
+            if kind == b"moov":
+                if size - header_size > MAX_MOOV_B:
+                    raise Mp4FormatError("moov is too large")
+                fid.seek(pos + header_size)
+                payload = fid.read(size - header_size)
+                if len(payload) < size - header_size:
+                    raise Mp4FormatError("truncated moov, the file may still be recorded")
+                return memoryview(payload)
+            pos += size
+    raise Mp4FormatError("no moov box, the file may still be recorded")
+
+
+def _time_and_duration(payload: memoryview) -> Tuple[int, int, int]:
+    """(creation time, timescale, duration) of an mvhd or mdhd payload"""
+    if len(payload) < 4:
+        raise Mp4FormatError("truncated header box")
+    version = payload[0]
+    if version == 1:
+        if len(payload) < 32:
+            raise Mp4FormatError("truncated header box")
+        creation, _, timescale, duration = struct.unpack_from(">QQIQ", payload, 4)
+    else:
+        if len(payload) < 20:
+            raise Mp4FormatError("truncated header box")
+        creation, _, timescale, duration = struct.unpack_from(">IIII", payload, 4)
+    return creation, timescale, duration
+
+
+def _date_tag(moov: memoryview) -> Optional[datetime]:
+    """The ©day tag of udta (QuickTime) or udta/meta/ilst (iTunes style), if any"""
+    udta = _child(moov, b"udta")
+    if udta is None:
+        return None
+
+    value = None
+    day = _child(udta, b"\xa9day")
+    if day is not None and len(day) > 4:
+        # QuickTime text: 2 byte length, 2 byte language, text
+        (length,) = struct.unpack_from(">H", day, 0)
+        value = bytes(day[4:4 + length])
+    else:
+        meta = _child(udta, b"meta")
+        if meta is not None and len(meta) > 4:
+            data = _child(meta[4:], b"ilst", b"\xa9day", b"data")
+            if data is not None and len(data) > 8:
+                value = bytes(data[8:])
+    if not value:
+        return None
+
+    match = re.match(r"(\d{4})-(\d{2})-(\d{2})[T ](\d{2}):(\d{2}):(\d{2})", value.decode("utf-8", "replace"))
+    if match is None:
+        return None
+    try:
+        return datetime(*[int(x) for x in match.groups()], tzinfo=timezone.utc)
+    except ValueError:
+        # e.g. "0000-00-00 00:00:00", as some cameras write when the clock is not set
+        return None
+
+
+def read_movie(filename: str) -> Tuple[Optional[datetime], float]:
+    """The creation time and duration of a movie
+
+    Reads the box headers up to moov (skipping mdat with a seek), and then
+    only the moov box.  The creation time is the one of the first track, as
+    ffprobe reports it for the first stream, or else the movie's, or else a
+    ©day tag.  A time that is not a valid date counts as no time.
+
+    Args:
+        filename (str): path to the MP4/MOV file
+
+    Raises:
+        Mp4FormatError: not a complete MP4/MOV file, or no duration in it (e.g. fragmented)
+
+    Returns:
+        Tuple[Optional[datetime], float]: creation time in UTC (None if the file has none), duration in seconds
+    """
+    moov = _read_moov(filename)
+
+    mvhd = _child(moov, b"mvhd")
+    if mvhd is None:
+        raise Mp4FormatError("no mvhd box")
+    movie_creation, timescale, duration = _time_and_duration(mvhd)
+    if timescale == 0 or duration in (0, 0xFFFFFFFF, 0xFFFFFFFFFFFFFFFF):
+        raise Mp4FormatError("no duration in mvhd")
+
+    creation = 0
+    mdhd = _child(moov, b"trak", b"mdia", b"mdhd")
+    if mdhd is not None:
+        creation, _, _ = _time_and_duration(mdhd)
+    creation = creation or movie_creation
+
+    creation_time = None
+    if creation > 0:
+        try:
+            creation_time = EPOCH_1904 + timedelta(seconds=creation)
+        except OverflowError:
+            # garbage in the header, past year 9999
+            creation_time = None
+    if creation_time is None:
+        creation_time = _date_tag(moov)
+    return creation_time, duration / timescale
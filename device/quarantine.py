@@ -0,0 +1,102 @@
+# Remember the files that hang or crash the workers
+
+import json
+import os
+import threading
+import time
+
+from typing import List
+
+from device.debug_print import debug_print
+from device.utils import write_json_atomic
+
+
+class Quarantine:
+    """
+    Files that ran past a stage's deadline, or took their worker down.
+
+    A quarantined file is skipped by the scans until its size or
+    modification time changes.  Kept in {state_dir}/quarantine.json, so it
+    survives a restart.
+    """
+
+    def __init__(self, state_dir: str) -> None:
+        """
+        Initializes the quarantine, loading the saved list.
+
+        Args:
+            state_dir (str): Directory to keep quarantine.json in
+        """
+        self.m_lock = threading.Lock()
+        self.m_filename = os.path.join(state_dir, "quarantine.json")
+        self.m_files = {}  # fullpath -> {size, mtime, stage, reason, time}
+
+        if os.path.exists(self.m_filename):
+            try:
+                self.m_files = json.load(open(self.m_filename, "r"))
+            except (OSError, json.decoder.JSONDecodeError) as e:
+                debug_print(f"Failed to read {self.m_filename}: {e}")
+
+    def _save(self):
+        try:
+            os.makedirs(os.path.dirname(self.m_filename), exist_ok=True)
+            write_json_atomic(self.m_filename, self.m_files)
+        except OSError as e:
+            debug_print(f"Failed to write {self.m_filename}: {e}")
+
+    def add(self, fullpath: str, stage: str, reason: str):
+        """Quarantine a file
+
+        Args:
+            fullpath (str): path to the file
+            stage (str): stage it failed in
+            reason (str): what happened
+        """
+        try:
+            stat = os.stat(fullpath)
+        except OSError:
+            return
+
+        debug_print(f"Quarantine {fullpath}: {stage} {reason}")
+        with self.m_lock:
+            self.m_files[fullpath] = {
+                "size": stat.st_size,
+                "mtime": stat.st_mtime,
+                "stage": stage,
+                "reason": reason,
+                "time": time.time()
+            }
+            self._save()
+
+    def contains(self, fullpath: str) -> bool:
+        """Should this file be skipped?
+
+        Args:
+            fullpath (str): path to the file
+
+        Returns:
+            bool: True if it is quarantined and has not changed since.
+        """
+        with self.m_lock:
+            entry = self.m_files.get(fullpath)
+        if entry is None:
+            return False
+
+        try:
+            stat = os.stat(fullpath)
+        except OSError:
+            stat = None
+
+        if stat and stat.st_size == entry["size"] and stat.st_mtime == entry["mtime"]:
+            return True
+
+        # changed or removed, give it another chance
+        with self.m_lock:
+            self.m_files.pop(fullpath, None)
+            self._save()
+        return False
+
+    def entries(self) -> List[dict]:
+        """The quarantined files, for reporting"""
+        with self.m_lock:
+            return [dict(entry, fullpath=fullpath) for fullpath, entry in sorted(self.m_files.items())]
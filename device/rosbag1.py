@@ -0,0 +1,159 @@
+# Read the times and message counts of a ROS1 bag from its index, without rosbags
+
+import os
+import struct
+
+from datetime import datetime, timezone
+from typing import Dict, Optional, Tuple
+
+import pytz
+
+MAGIC = b"#ROSBAG V2.0\n"
+
+OP_BAG_HEADER = 0x03
+OP_CONNECTION = 0x07
+OP_CHUNK_INFO = 0x06
+
+
+class BagFormatError(ValueError):
+    """The bag is not a complete, indexed ROS1 v2.0 bag"""
+
+
+def _parse_header(buffer: memoryview) -> Dict[str, bytes]:
+    """Split a record header into its name=value fields"""
+    fields = {}
+    pos = 0
+    while pos + 4 <= len(buffer):
+        (length,) = struct.unpack_from("<I", buffer, pos)
+        pos += 4
+        if pos + length > len(buffer):
+            raise BagFormatError("truncated header field")
+        field = bytes(buffer[pos:pos + length])
+        pos += length
+        name, sep, value = field.partition(b"=")
+        if not sep:
+            raise BagFormatError("header field without '='")
+        fields[name.decode("ascii", "replace")] = value
+    return fields
+
+
+def _read_record(buffer: memoryview, pos: int) -> Tuple[Dict[str, bytes], memoryview, int]:
+    """Read the record at pos
+
+    Returns:
+        Tuple[Dict[str, bytes], memoryview, int]: header fields, data, position of the next record
+    """
+    if pos + 4 > len(buffer):
+        raise BagFormatError("truncated record")
+    (header_len,) = struct.unpack_from("<I", buffer, pos)
+    pos += 4
+    header = _parse_header(buffer[pos:pos + header_len])
+    pos += header_len
+    if pos + 4 > len(buffer):
+        raise BagFormatError("truncated record")
+    (data_len,) = struct.unpack_from("<I", buffer, pos)
+    pos += 4
+    if pos + data_len > len(buffer):
+        raise BagFormatError("truncated record data")
+    return header, buffer[pos:pos + data_len], pos + data_len
+
+
+def _op(header: Dict[str, bytes]) -> int:
+    op = header.get("op")
+    if op is None or len(op) != 1:
+        raise BagFormatError("record without op")
+    return op[0]
+
+
+def _time_ns(value: bytes) -> int:
+    secs, nsecs = struct.unpack("<II", value)
+    return secs * 1_000_000_000 + nsecs
+
+
+def read_index(filename: str) -> Tuple[int, int, Dict[str, int]]:
+    """Read the bag header, the connection records and the chunk info records
+
+    Only reads the first record and the index at the end of the bag, never
+    the chunks with the messages.
+
+    Args:
+        filename (str): path to the bag
+
+    Raises:
+        BagFormatError: not a ROS1 v2.0 bag, or it has no index (still being recorded, or needs a reindex)
+
+    Returns:
+        Tuple[int, int, Dict[str, int]]: start time (ns), end time (ns), message count per topic
+    """
+    with open(filename, "rb") as fid:
+        if fid.read(len(MAGIC)) != MAGIC:
+            raise BagFormatError("not a ROS1 v2.0 bag")
+
+        # the bag header record is padded to 4096 bytes
+        header, _, _ = _read_record(memoryview(fid.read(8192)), 0)
+        if _op(header) != OP_BAG_HEADER:
+            raise BagFormatError("no bag header")
+        (index_pos,) = struct.unpack("<Q", header["index_pos"])
+        (conn_count,) = struct.unpack("<I", header["conn_count"])
+        (chunk_count,) = struct.unpack("<I", header["chunk_count"])
+        if index_pos == 0 or index_pos >= os.fstat(fid.fileno()).st_size:
+            raise BagFormatError("bag is not indexed")
+
+        fid.seek(index_pos)
+        index = memoryview(fid.read())
+
+    topics_by_conn = {}
+    pos = 0
+    for _ in range(conn_count):
+        header, _, pos = _read_record(index, pos)
+        if _op(header) != OP_CONNECTION:
+            raise BagFormatError("expected a connection record")
+        (conn,) = struct.unpack("<I", header["conn"])
+        topics_by_conn[conn] = header["topic"].decode("utf-8", "replace")
+
+    start_ns = None
+    end_ns = None
+    counts = {}
+    for _ in range(chunk_count):
+        header, data, pos = _read_record(index, pos)
+        if _op(header) != OP_CHUNK_INFO:
+            raise BagFormatError("expected a chunk info record")
+        chunk_start = _time_ns(header["start_time"])
+        chunk_end = _time_ns(header["end_time"])
+        start_ns = chunk_start if start_ns is None else min(start_ns, chunk_start)
+        end_ns = chunk_end if end_ns is None else max(end_ns, chunk_end)
+        for conn, count in struct.iter_unpack("<II", data[:len(data) - len(data) % 8]):
+            counts[conn] = counts.get(conn, 0) + count
+
+    if start_ns is None:
+        raise BagFormatError("bag has no chunks")
+
+    topics = {}
+    for conn, topic in topics_by_conn.items():
+        topics[topic] = topics.get(topic, 0) + counts.get(conn, 0)
+    return start_ns, end_ns, {topic: topics[topic] for topic in sorted(topics)}
+
+
+def getMetaDataROS1(filename: str, local_tz: str) -> Optional[dict]:
+    """
+    Extracts metadata from the index of a ROS1 bag: message count by topic,
+    start and end timestamps in the specified local timezone.
+
+    Args:
+        filename (str): Path to the ROS1 bag.
+        local_tz (str): Timezone to which the timestamps should be converted.
+
+    Returns:
+        dict: A dictionary with 'start_time' and 'end_time' in the local timezone,
+        and 'topics' with message counts per topic. Returns `None` if the index can not be read.
+    """
+    try:
+        start_ns, end_ns, topics = read_index(filename)
+    except (OSError, KeyError, struct.error, BagFormatError):
+        return None
+
+    return {
+        "start_time": datetime.fromtimestamp(start_ns // 1e9, tz=timezone.utc).astimezone(pytz.timezone(local_tz)).strftime("%Y-%m-%d %H:%M:%S"),
+        "end_time": datetime.fromtimestamp(end_ns // 1e9, tz=timezone.utc).astimezone(pytz.timezone(local_tz)).strftime("%Y-%m-%d %H:%M:%S"),
+        "topics": topics
+    }
@@ -0,0 +1,179 @@
+# Metadata of ROS 2 bags: a directory with metadata.yaml and .db3 or .mcap shards
+
+import functools
+import os
+import sqlite3
+
+from datetime import datetime, timezone
+from typing import Optional
+
+import pytz
+import yaml
+
+from device.debug_print import debug_print
+
+METADATA_FILE = "metadata.yaml"
+
+
+def _local_time(ns: int, local_tz: str) -> str:
+    return datetime.fromtimestamp(ns // 1e9, tz=timezone.utc).astimezone(pytz.timezone(local_tz)).strftime("%Y-%m-%d %H:%M:%S")
+
+
+@functools.lru_cache(maxsize=64)
+def _load_info(filename: str, mtime: float) -> Optional[dict]:
+    """The rosbag2_bagfile_information of a metadata.yaml, cached while the file does not change"""
+    try:
+        with open(filename, "r") as fid:
+            info = yaml.load(fid, Loader=getattr(yaml, "CSafeLoader", yaml.SafeLoader))
+    except (OSError, yaml.YAMLError) as e:
+        debug_print(f"Failed to read {filename}: {e}")
+        return None
+    if not isinstance(info, dict):
+        return None
+    return info.get("rosbag2_bagfile_information")
+
+
+def bag_info(bag_dir: str) -> Optional[dict]:
+    """The rosbag2 metadata of a bag directory
+
+    Args:
+        bag_dir (str): directory that may hold a rosbag2 bag
+
+    Returns:
+        Optional[dict]: the rosbag2_bagfile_information, None if it is not a bag directory
+    """
+    filename = os.path.join(bag_dir, METADATA_FILE)
+    try:
+        mtime = os.path.getmtime(filename)
+    except OSError:
+        return None
+    return _load_info(filename, mtime)
+
+
+def _ns(value: dict, key: str) -> int:
+    return int((value or {}).get(key, 0) or 0)
+
+
+def getMetaDataBag2(filename: str, local_tz: str) -> Optional[dict]:
+    """The run level metadata of a rosbag2 bag, from its metadata.yaml
+
+    Args:
+        filename (str): path to the metadata.yaml
+        local_tz (str): Timezone to which the timestamps should be converted.
+
+    Returns:
+        Optional[dict]: 'start_time', 'end_time', 'topics' with message counts, and
+        'bag_shards', the shard file names.  None if it is not a rosbag2 metadata.yaml
+    """
+    info = bag_info(os.path.dirname(filename))
+    if info is None:
+        return None
+
+    start_ns = _ns(info.get("starting_time"), "nanoseconds_since_epoch")
+    duration_ns = _ns(info.get("duration"), "nanoseconds")
+    topics = {}
+    for topic in info.get("topics_with_message_count") or []:
+        name = (topic.get("topic_metadata") or {}).get("name")
+        if name is not None:
+            topics[name] = topics.get(name, 0) + int(topic.get("message_count", 0))
+
+    return {
+        "start_time": _local_time(start_ns, local_tz),
+        "end_time": _local_time(start_ns + duration_ns, local_tz),
+        "topics": {topic: topics[topic] for topic in sorted(topics)},
+        "bag_shards": [os.path.basename(path) for path in info.get("relative_file_paths") or []],
+    }
+
+
+def shard_metadata(filename: str, local_tz: str) -> dict:
+    """What the metadata.yaml of its bag says about one shard, without opening the shard
+
+    Every shard of a bag gets "bag" (the path of the bag directory), so the
+    shards can be treated as one run.  The times come from the "files" list
+    of newer bags, older ones do not have it.  When the metadata.yaml has
+    the message counts, the shard gets "bag_counted": its counts are in the
+    run entry of the bag, and are not counted again per shard.  That flag
+    is only for the device, see LOCAL_FIELDS in device.extractors.
+
+    Args:
+        filename (str): path to a .db3 or .mcap file
+        local_tz (str): Timezone to which the timestamps should be converted.
+
+    Returns:
+        dict: the fields found, empty if the file is not in a rosbag2 bag
+    """
+    bag_dir = os.path.dirname(filename)
+    info = bag_info(bag_dir)
+    if info is None:
+        return {}
+
+    basename = os.path.basename(filename)
+    shards = [os.path.basename(path) for path in info.get("relative_file_paths") or []]
+    if basename not in shards:
+        return {}
+
+    rtn = {"bag": bag_dir}
+    if info.get("topics_with_message_count"):
+        rtn["bag_counted"] = True
+    for shard in info.get("files") or []:
+        if os.path.basename(shard.get("path", "")) != basename:
+            continue
+        start_ns = _ns(shard.get("starting_time"), "nanoseconds_since_epoch")
+        duration_ns = _ns(shard.get("duration"), "nanoseconds")
+        if start_ns > 0:
+            rtn["start_time"] = _local_time(start_ns, local_tz)
+            rtn["end_time"] = _local_time(start_ns + duration_ns, local_tz)
+    return rtn
+
+
+def getMetaDataDB3(filename: str, local_tz: str) -> Optional[dict]:
+    """
+    Extracts metadata from a rosbag2 SQLite shard, including message count by
+    topic, start and end timestamps in the specified local timezone.
+
+    The times come from the timestamp index of the messages table.  The
+    counts need a pass over the table, so this is the expensive tier.  They
+    are skipped when the metadata.yaml of the bag has them ("bag_counted").
+
+    Args:
+        filename (str): Path to the .db3 file.
+        local_tz (str): Timezone to which the timestamps should be converted.
+
+    Returns:
+        dict: A dictionary with 'start_time' and 'end_time' in the local timezone,
+        and 'topics' with message counts per topic. Returns `None` if file reading fails.
+    """
+    rtn = shard_metadata(filename, local_tz)
+
+    try:
+        connection = sqlite3.connect(f"file:{filename}?mode=ro", uri=True)
+    except sqlite3.Error as e:
+        debug_print(f"Failed to open {filename}: {e}")
+        return None
+
+    counts = None
+    try:
+        start_ns, end_ns = connection.execute("SELECT MIN(timestamp), MAX(timestamp) FROM messages").fetchone()
+        if not rtn.get("bag_counted"):
+            names = dict(connection.execute("SELECT id, name FROM topics").fetchall())
+            counts = connection.execute("SELECT topic_id, COUNT(*) FROM messages GROUP BY topic_id").fetchall()
+    except sqlite3.Error as e:
+        debug_print(f"Failed to read {filename}: {e}")
+        return None
+    finally:
+        connection.close()
+
+    if start_ns is None:
+        return None
+
+    rtn.update({
+        "start_time": _local_time(start_ns, local_tz),
+        "end_time": _local_time(end_ns, local_tz),
+    })
+    if counts is not None:
+        topics = {}
+        for topic_id, count in counts:
+            name = names.get(topic_id, str(topic_id))
+            topics[name] = topics.get(name, 0) + count
+        rtn["topics"] = {topic: topics[topic] for topic in sorted(topics)}
+    return rtn
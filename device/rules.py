@@ -0,0 +1,253 @@
+# Decide which files a scan picks up, and which directories it can skip
+
+import fnmatch
+import os
+import re
+import time
+
+from typing import Iterator, List, Optional, Tuple
+
+from device.debug_print import debug_print
+
+IGNORE_FILE = ".storageignore"
+
+
+def _compile_globs(patterns: List[str]) -> Tuple[Optional[re.Pattern], Optional[re.Pattern]]:
+    """Compile globs into one regex for base names, and one for relative paths
+
+    A glob with a "/" is matched against the path relative to the watch (or
+    .storageignore) directory, any other glob against the base name.
+    """
+    names = [fnmatch.translate(pattern) for pattern in patterns if "/" not in pattern.strip("/")]
+    paths = [fnmatch.translate(pattern.strip("/")) for pattern in patterns if "/" in pattern.strip("/")]
+    return (re.compile("|".join(names)) if names else None,
+            re.compile("|".join(paths)) if paths else None)
+
+
+def _compile_regexes(patterns: List[str]) -> Optional[re.Pattern]:
+    if not patterns:
+        return None
+    return re.compile("|".join(f"(?:{pattern})" for pattern in patterns))
+
+
+class _Globs:
+    """A set of compiled globs, see _compile_globs()"""
+
+    def __init__(self, patterns: List[str]) -> None:
+        self.m_names, self.m_paths = _compile_globs(patterns)
+
+    def __bool__(self) -> bool:
+        return self.m_names is not None or self.m_paths is not None
+
+    def match(self, relpath: str) -> bool:
+        if self.m_names is not None and self.m_names.match(os.path.basename(relpath)):
+            return True
+        return self.m_paths is not None and self.m_paths.match(relpath) is not None
+
+
+def _read_ignore(dirname: str) -> Tuple[Optional[_Globs], Optional[_Globs]]:
+    """Read the .storageignore of a directory
+
+    One glob per line, "#" starts a comment.  A glob that ends with "/" only
+    matches directories.
+
+    Returns:
+        Tuple[Optional[_Globs], Optional[_Globs]]: (globs for files and directories, globs for directories only)
+    """
+    filename = os.path.join(dirname, IGNORE_FILE)
+    try:
+        with open(filename, "r") as fid:
+            lines = [line.strip() for line in fid]
+    except OSError as e:
+        debug_print(f"Failed to read {filename}: {e}")
+        return None, None
+
+    lines = [line for line in lines if line and not line.startswith("#")]
+    files = [line for line in lines if not line.endswith("/")]
+    dirs = [line.rstrip("/") for line in lines if line.endswith("/")]
+    return _Globs(files) or None, _Globs(dirs) or None
+
+
+class FileRules:
+    """
+    The include and exclude rules of the scans, compiled once per config.
+
+    * include_suffix: a file must end with one of these (if set)
+    * exclude_suffix: a file must not end with any of these.  Ignored when
+      include_suffix is set, as it always has been.
+    * rules: {include_glob, exclude_glob, include_regex, exclude_regex,
+      exclude_dirs, min_size_b, max_size_b, max_age_days}.  Globs without a
+      "/" match the base name, the others (and the regexes) match the path
+      relative to the watch directory.
+    * A .storageignore file in any watched directory excludes the files and
+      directories below it that match its globs.
+
+    File names starting with "." or "_" are never included.  walk() does not
+    descend into excluded directories at all.
+    """
+
+    def __init__(self, config: dict) -> None:
+        """
+        Initializes the rules.
+
+        Args:
+            config (dict): the device config
+        """
+        self.configure(config)
+
+    def configure(self, config: dict):
+        """Compile the rules of a config
+
+        Args:
+            config (dict): the device config
+        """
+        rules = config.get("rules") or {}
+        if "include_suffix" in config:
+            self.m_include_suffix = tuple(str(suffix) for suffix in config["include_suffix"] or [])
+        else:
+            self.m_include_suffix = None
+        self.m_exclude_suffix = tuple(str(suffix) for suffix in config.get("exclude_suffix") or [])
+        self.m_include_glob = _Globs(rules.get("include_glob") or [])
+        self.m_exclude_glob = _Globs(rules.get("exclude_glob") or [])
+        self.m_include_regex = _compile_regexes(rules.get("include_regex"))
+        self.m_exclude_regex = _compile_regexes(rules.get("exclude_regex"))
+        self.m_exclude_dirs = _Globs(rules.get("exclude_dirs") or [])
+        self.m_min_size_b = int(rules.get("min_size_b") or 0)
+        self.m_max_size_b = int(rules.get("max_size_b") or 0)
+        self.m_max_age_s = float(rules.get("max_age_days") or 0) * 24 * 3600
+
+    def include(self, relpath: str) -> bool:
+        """Does a file pass the name rules?
+
+        Args:
+            relpath (str): path of the file relative to its watch directory
+
+        Returns:
+            bool: True if the file should be included
+        """
+        basename = os.path.basename(relpath)
+        if basename.startswith(".") or basename.startswith("_"):
+            return False
+        # as before the rules: exclude_suffix only applies when there is no include_suffix 
+        if self.m_include_suffix is not None:
+            if not basename.endswith(self.m_include_suffix):
+                return False
+        elif self.m_exclude_suffix and basename.endswith(self.m_exclude_suffix):
+            return False
+        if self.m_include_glob and not self.m_include_glob.match(relpath):
+            return False
+        if self.m_exclude_glob and self.m_exclude_glob.match(relpath):
+            return False
+        if self.m_include_regex is not None and self.m_include_regex.search(relpath) is None:
+            return False
+        if self.m_exclude_regex is not None and self.m_exclude_regex.search(relpath) is not None:
+            return False
+        return True
+
+    def keep(self, size: int, mtime: float) -> bool:
+        """Does a file pass the size and age rules?
+
+        Args:
+            size (int): size in bytes
+            mtime (float): modification time
+
+        Returns:
+            bool: True if the file should be included
+        """
+        if size < self.m_min_size_b:
+            return False
+        if self.m_max_size_b > 0 and size > self.m_max_size_b:
+            return False
+        if self.m_max_age_s > 0 and time.time() - mtime > self.m_max_age_s:
+            return False
+        return True
+
+    def prune(self, reldir: str) -> bool:
+        """Should the walk skip this directory?
+
+        Args:
+            reldir (str): path of the directory relative to its watch directory
+
+        Returns:
+            bool: True if nothing below it can be included
+        """
+        return bool(self.m_exclude_dirs) and self.m_exclude_dirs.match(reldir)
+
+    def _ignores_above(self, dirroot: str, start: str) -> Optional[list]:
+        """The .storageignore globs that apply to start, from the directories between dirroot and start
+
+        Returns:
+            Optional[list]: [(directory, file globs, directory globs)], or None if start is excluded
+        """
+        ignores = []
+        parent = dirroot
+        parts = os.path.relpath(start, dirroot).split(os.sep)
+        for i, part in enumerate(parts):
+            if part in (".", ""):
+                break
+            if os.path.exists(os.path.join(parent, IGNORE_FILE)):
+                ignores.append((parent,) + _read_ignore(parent))
+            child = os.path.join(parent, part)
+            is_dir = i < len(parts) - 1 or os.path.isdir(child)
+            if self._ignored(ignores, child, is_dir):
+                return None
+            if is_dir and self.prune(os.path.relpath(child, dirroot)):
+                return None
+            parent = child
+        return ignores
+
+    @staticmethod
+    def _ignored(ignores: list, path: str, is_dir: bool) -> bool:
+        for dirname, files, dirs in ignores:
+            relpath = os.path.relpath(path, dirname)
+            if files is not None and files.match(relpath):
+                return True
+            if is_dir and dirs is not None and dirs.match(relpath):
+                return True
+        return False
+
+    def walk(self, dirroot: str, start: str) -> Iterator[Tuple[str, str, str]]:
+        """Find the files under start that pass the name rules
+
+        Like os.walk(), but skips the excluded directories (exclude_dirs and
+        .storageignore) without reading them.
+
+        Args:
+            dirroot (str): the watch directory
+            start (str): a directory or file in dirroot
+
+        Yields:
+            Iterator[Tuple[str, str, str]]: (root, basename, path relative to dirroot)
+        """
+        ignores = self._ignores_above(dirroot, start)
+        if ignores is None:
+            return
+
+        if os.path.isfile(start):
+            relpath = os.path.relpath(start, dirroot)
+            if self.include(relpath):
+                yield os.path.dirname(start), os.path.basename(start), relpath
+            return
+
+        # directory -> the .storageignore globs that apply below it
+        inherited = {start: ignores}
+        for root, dirnames, files in os.walk(start):
+            ignores = inherited.pop(root, [])
+            if IGNORE_FILE in files:
+                ignores = ignores + [(root,) + _read_ignore(root)]
+
+            kept = []
+            for dirname in dirnames:
+                path = os.path.join(root, dirname)
+                if self.prune(os.path.relpath(path, dirroot)) or self._ignored(ignores, path, True):
+                    continue
+                kept.append(dirname)
+                inherited[path] = ignores
+            dirnames[:] = kept
+
+            for basename in files:
+                path = os.path.join(root, basename)
+                relpath = os.path.relpath(path, dirroot)
+                if not self.include(relpath) or self._ignored(ignores, path, False):
+                    continue
+                yield root, basename, relpath
@@ -0,0 +1,128 @@
+# Coalesce scan requests into as few scans as possible
+
+import os
+import threading
+import time
+
+from typing import Callable, List, Optional
+
+from device.debug_print import debug_print
+
+
+def _covers(scope: Optional[set], paths: Optional[List[str]]) -> bool:
+    """Does a scan of scope also scan paths? A scope of None is everything"""
+    if scope is None:
+        return True
+    if paths is None:
+        return False
+    prefixes = tuple(os.path.join(path, "") for path in scope)
+    return all(path in scope or path.startswith(prefixes) for path in paths)
+
+
+class ScanScheduler:
+    """
+    Runs the scans of the device, one at a time.
+
+    * Requests that arrive while no scan is running are gathered for delay_s
+      seconds and run as one scan.
+    * A request that arrives during a scan is guaranteed a follow-up scan,
+      and every request that arrives before the follow-up starts shares it.
+    * A request with join set is satisfied by a scan that is already running
+      (if it covers the request), e.g. a server that just wants a catalog.
+    * A scan has a scope: None for every watch directory, or a set of
+      directories and files.  Scopes of merged requests are merged.
+
+    Each scan has a generation number, counting up from 1.  request() returns
+    the generation of the scan that will cover it, and generation is the last
+    completed one.
+    """
+
+    def __init__(self, scan: Callable[[Optional[List[str]], int], None], start_task: Callable, delay_s: float = 1.0) -> None:
+        """
+        Initializes the scheduler. No scan runs until one is requested.
+
+        Args:
+            scan (Callable[[Optional[List[str]], int], None]): runs a scan, given its scope and generation
+            start_task (Callable): starts a function in the background
+            delay_s (float): How long to gather requests before starting a scan.
+        """
+        self.m_scan = scan
+        self.m_start_task = start_task
+        self.m_delay_s = delay_s
+
+        self.m_lock = threading.Lock()
+        self.m_running = False        # the scan loop is active
+        self.m_running_scope = None   # scope of the scan in progress, when m_started > m_completed
+        self.m_pending = False
+        self.m_pending_scope = set()  # None is a full scan
+        self.m_started = 0
+        self.m_completed = 0
+
+    def configure(self, delay_s: float):
+        """Set how long to gather requests before starting a scan"""
+        self.m_delay_s = delay_s
+
+    @property
+    def generation(self) -> int:
+        """The generation of the last completed scan, 0 if none"""
+        return self.m_completed
+
+    def request(self, scope: List[str] = None, join: bool = False) -> int:
+        """Ask for a scan
+
+        Args:
+            scope (List[str], optional): directories and files to scan. None for everything.
+            join (bool): A scan that is already running is good enough.
+
+        Returns:
+            int: the generation of the scan that will cover this request
+        """
+        with self.m_lock:
+            scanning = self.m_started > self.m_completed
+            if join and scanning and _covers(self.m_running_scope, scope):
+                return self.m_started
+
+            if scope is None or self.m_pending_scope is None:
+                self.m_pending_scope = None
+            else:
+                self.m_pending_scope.update(scope)
+            self.m_pending = True
+
+            generation = self.m_started + 1
+            if not self.m_running:
+                self.m_running = True
+                self.m_start_task(self._loop)
+            return generation
+
+    def _loop(self):
+        time.sleep(self.m_delay_s)
+        while True:
+            with self.m_lock:
+                if not self.m_pending:
+                    self.m_running = False
+                    return
+                scope = self.m_pending_scope
+                self.m_pending = False
+                self.m_pending_scope = set()
+                self.m_started += 1
+                self.m_running_scope = scope
+                generation = self.m_started
+
+            debug_print(f"Scan {generation} {'all' if scope is None else sorted(scope)}")
+            try:
+                self.m_scan(None if scope is None else sorted(scope), generation)
+            except Exception as e:
+                debug_print(f"Scan {generation} failed: {e}")
+
+            with self.m_lock:
+                self.m_completed = generation
+                self.m_running_scope = None
+
+    def status(self) -> dict:
+        """For the servers: {generation, scanning, pending}"""
+        with self.m_lock:
+            return {
+                "generation": self.m_completed,
+                "scanning": self.m_started if self.m_started > self.m_completed else None,
+                "pending": self.m_pending
+            }
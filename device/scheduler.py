@@ -0,0 +1,325 @@
+# Schedule pool work per block device
+
+import itertools
+import os
+import queue
+import shutil
+import tempfile
+import time
+
+from collections import deque
+from multiprocessing.pool import Pool
+from typing import Callable, Dict, Iterator, List, Tuple
+
+from device.autoscale import Autoscaler
+from device.deadline import kill_task, run_with_deadline
+from device.debug_print import debug_print
+from device.quarantine import Quarantine
+
+
+def _sys_block_dir(dev: int) -> str:
+    """The /sys/block directory of the disk that holds a device number, or None"""
+    path = f"/sys/dev/block/{os.major(dev)}:{os.minor(dev)}"
+    if not os.path.exists(path):
+        return None
+    path = os.path.realpath(path)
+    # partitions do not have a queue directory, their parent disk does
+    if not os.path.exists(os.path.join(path, "queue")):
+        path = os.path.dirname(path)
+    return path
+
+
+def default_device_limit(dev: int) -> int:
+    """How many workers should read from a device at once
+
+    Spinning disks and SD/eMMC cards do best with one sequential reader.
+    Everything else (SSD, NVMe, network filesystems) is not limited.
+
+    Args:
+        dev (int): st_dev of a file
+
+    Returns:
+        int: concurrency limit, 0 for no limit
+    """
+    path = _sys_block_dir(dev)
+    if path is None:
+        return 0
+
+    if os.path.basename(path).startswith("mmcblk"):
+        return 1
+
+    try:
+        with open(os.path.join(path, "queue", "rotational"), "r") as fid:
+            if fid.read().strip() == "1":
+                return 1
+    except OSError:
+        pass
+    return 0
+
+
+class DeviceScheduler:
+    """
+    Runs tasks on a multiprocessing Pool, partitioned by the block device
+    (st_dev) of the file each task reads.
+
+    * Each device has its own queue and its own concurrency limit, so a slow
+      SD card gets one reader while an NVMe next to it gets several.
+    * Each queue is ordered by path, so files in the same directory are read
+      one after the other.
+    * The pool size is the overall limit.
+
+    Limits come from the "device_concurrency" config, a map of
+    {path: limit}, with an optional "default". Devices that are not
+    configured get default_device_limit().  When an Autoscaler is set, the
+    overall limit of each stage moves between the stage's bounds.
+
+    Only for tasks that finish.  A task that waits on something else for a
+    long time (like the tail of a recording) would hold its device's only
+    slot for that long; those run in LiveTails instead.
+    """
+
+    def __init__(self, max_threads: int, device_concurrency: dict = None) -> None:
+        """
+        Initializes the scheduler.
+
+        Args:
+            max_threads (int): size of the pool
+            device_concurrency (dict, optional): {path|"default": limit}
+        """
+        self.m_dev_cache = {}
+        self.m_limiter = None
+        self.m_autoscaler = None
+        self.configure(max_threads, device_concurrency)
+
+    def configure(self, max_threads: int, device_concurrency: dict = None):
+        """Set the limits. Takes effect for the next run()
+
+        Args:
+            max_threads (int): size of the pool
+            device_concurrency (dict, optional): {path|"default": limit}, 0 for no limit
+        """
+        limits = {}
+        default = None
+        for path, limit in (device_concurrency or {}).items():
+            if path == "default":
+                default = max(0, int(limit))
+                continue
+            try:
+                limits[os.stat(path).st_dev] = max(0, int(limit))
+            except OSError as e:
+                debug_print(f"Ignoring device_concurrency for {path}: {e}")
+
+        self.m_max_threads = max(1, int(max_threads))
+        self.m_limits = limits
+        self.m_default = default
+
+    def set_limiter(self, limiter: Callable[[int], int]):
+        """Set a function that caps the number of running tasks
+
+        Args:
+            limiter (Callable[[int], int]): called with the pool size, returns the
+                number of tasks that may run now. 0 holds back new tasks.
+        """
+        self.m_limiter = limiter
+
+    def set_autoscaler(self, autoscaler: Autoscaler):
+        """Let an Autoscaler choose the concurrency of each stage"""
+        self.m_autoscaler = autoscaler
+
+    def pool_size(self, stage: str = None) -> int:
+        """Number of workers to start the pool of a stage with"""
+        if self.m_autoscaler is None or stage is None:
+            return self.m_max_threads
+        return self.m_autoscaler.pool_size(stage, self.m_max_threads)
+
+    def _max_running(self, stage: str = None, run: int = None, queued: int = 0) -> int:
+        max_running = self.pool_size(stage)
+        if self.m_autoscaler is not None and run is not None:
+            max_running = min(max_running, self.m_autoscaler.target(run, queued, self.m_max_threads))
+        if self.m_limiter is not None:
+            max_running = min(max_running, self.m_limiter(max_running))
+        return max_running
+
+    def device_of(self, fullpath: str) -> int:
+        """The st_dev of a file, cached per directory
+
+        Args:
+            fullpath (str): path to a file
+
+        Returns:
+            int: st_dev, or -1 if it can not be found
+        """
+        dirname = os.path.dirname(fullpath)
+        dev = self.m_dev_cache.get(dirname)
+        if dev is None:
+            try:
+                dev = os.stat(dirname).st_dev
+            except OSError:
+                return -1
+            self.m_dev_cache[dirname] = dev
+        return dev
+
+    def limit(self, dev: int) -> int:
+        """The concurrency limit of a device, 0 for no limit"""
+        if dev not in self.m_limits:
+            if self.m_default is not None:
+                self.m_limits[dev] = self.m_default
+            elif dev < 0:
+                self.m_limits[dev] = 0
+            else:
+                self.m_limits[dev] = default_device_limit(dev)
+        return self.m_limits[dev]
+
+    def run(self, pool: Pool, func: Callable, tasks: List[Tuple[str, any]], ordered: bool = True, stage: str = None,
+            timeout_s: float = 0, quarantine: Quarantine = None, key: str = None) -> Iterator[any]:
+        """Run func over tasks, yielding results as they complete
+
+        Works like pool.imap_unordered(func, args), but respects the per device limits.
+
+        With a timeout, each task runs under run_with_deadline(). A task that
+        times out, or whose worker never answers (killed, or stuck for
+        3 * timeout_s + 30 seconds), is given up on and its file quarantined.
+        A stuck worker is killed, and the pool replaces it.  Quarantined
+        files are skipped.
+
+        Args:
+            pool (Pool): The pool to run on
+            func (Callable): The worker function
+            tasks (List[Tuple[str, any]]): (fullpath the task reads, args for func)
+            ordered (bool): Run each device's tasks in path order. Otherwise in the given order.
+            stage (str, optional): Stage name ("metadata", "hash", ...), to autoscale its concurrency.
+                The pool must have pool_size(stage) workers.
+            timeout_s (float): Per task deadline in seconds. 0 for none.
+            quarantine (Quarantine, optional): Where to put, and look for, files that time out.
+            key (str, optional): What the run is for, e.g. the server of a send. Runs of a stage
+                with different keys are autoscaled separately.
+
+        Yields:
+            any: the results of func, in completion order
+        """
+        pending: Dict[int, deque] = {}
+        if ordered:
+            tasks = sorted(tasks, key=lambda task: task[0])
+        for fullpath, args in tasks:
+            if quarantine and quarantine.contains(fullpath):
+                debug_print(f"Skipping quarantined {fullpath}")
+                continue
+            pending.setdefault(self.device_of(fullpath), deque()).append((fullpath, args))
+
+        autoscaler = self.m_autoscaler if stage is not None else None
+        run = None
+        weigh_bytes = False
+        if autoscaler:
+            run = autoscaler.begin(stage, key)
+            weigh_bytes = autoscaler.unit(stage) == "bytes"
+
+        results = queue.Queue()
+        running = {dev: 0 for dev in pending}
+        started = {}  # task id -> [dev, fullpath, args, units, start time]
+        task_ids = itertools.count()
+        hard_timeout_s = timeout_s * 3 + 30
+        # where each task writes the pid of its worker, so a stuck worker can be killed 
+        pid_dir = tempfile.mkdtemp(prefix="tasks_") if timeout_s > 0 else None
+
+        def weight(fullpath: str) -> int:
+            if not weigh_bytes:
+                return 1
+            try:
+                return os.path.getsize(fullpath)
+            except OSError:
+                return 0
+
+        def submit():
+            max_running = self._max_running(stage, run, sum(len(items) for items in pending.values()))
+            # round robin over the devices, so one device does not starve the others
+            submitted = True
+            while submitted and len(started) < max_running:
+                submitted = False
+                for dev, items in pending.items():
+                    if len(items) == 0 or running[dev] >= (self.limit(dev) or max_running):
+                        continue
+                    if len(started) >= max_running:
+                        break
+                    fullpath, args = items.popleft()
+                    units = 0
+                    if autoscaler:
+                        units = weight(fullpath)
+                        autoscaler.started(run)
+                    running[dev] += 1
+                    submitted = True
+
+                    task_id = next(task_ids)
+                    started[task_id] = [dev, fullpath, args, units, time.time()]
+                    if timeout_s > 0:
+                        target, target_args = run_with_deadline, (func, args, timeout_s, os.path.join(pid_dir, str(task_id)))
+                    else:
+                        target, target_args = func, args
+                    pool.apply_async(target, (target_args,),
+                                     callback=lambda result, task_id=task_id: results.put((task_id, True, result)),
+                                     error_callback=lambda error, task_id=task_id: results.put((task_id, False, error)))
+
+        def finish(task_id: int, units: int):
+            dev = started.pop(task_id)[0]
+            running[dev] -= 1
+            if autoscaler:
+                autoscaler.record(run, units)
+
+        def timed_out(task_id: int, reason: str):
+            fullpath = started[task_id][1]
+            finish(task_id, 0)
+            if quarantine:
+                quarantine.add(fullpath, stage, reason)
+
+        last_check = time.time()
+
+        def check_stuck():
+            # also while other tasks keep answering, or a stuck worker is never replaced 
+            nonlocal last_check
+            now = time.time()
+            if timeout_s <= 0 or now - last_check < 1:
+                return
+            last_check = now
+            for task_id, (_, _, _, _, start) in list(started.items()):
+                if now - start > hard_timeout_s:
+                    debug_print(f"Giving up on a task after {now - start:.0f} seconds")
+                    kill_task(os.path.join(pid_dir, str(task_id)))
+                    timed_out(task_id, "worker did not answer")
+
+        try:
+            submit()
+            while len(started) > 0 or any(len(items) > 0 for items in pending.values()):
+                try:
+                    task_id, ok, result = results.get(timeout=1)
+                except queue.Empty:
+                    check_stuck()
+                    # the limiter may have let more tasks run 
+                    submit()
+                    continue
+
+                check_stuck()
+
+                if task_id not in started:
+                    # answered after it was given up on
+                    continue
+
+                if not ok:
+                    finish(task_id, 0)
+                    submit()
+                    debug_print(f"Worker failed: {result}")
+                    continue
+
+                if timeout_s > 0:
+                    ok, result = result
+                    if not ok:
+                        timed_out(task_id, result)
+                        submit()
+                        continue
+
+                finish(task_id, started[task_id][3])
+                submit()
+                yield result
+        finally:
+            if autoscaler:
+                autoscaler.end(run)
+            if pid_dir:
+                shutil.rmtree(pid_dir, ignore_errors=True)
@@ -0,0 +1,177 @@
+# Detect files that are still being written
+
+import os
+import threading
+import time
+
+from typing import List, Set
+
+from device.debug_print import debug_print
+
+
+def open_for_write(prefixes: List[str]) -> Set[str]:
+    """Find the files under a set of directories that some process has open for writing
+
+    Scans /proc/*/fd. Only sees the processes in this pid namespace, so in a
+    container the recorder is only seen when the container shares the host's
+    pid namespace.
+
+    Args:
+        prefixes (List[str]): directories to look in
+
+    Returns:
+        Set[str]: real paths of the files that are open for writing
+    """
+    prefixes = tuple(os.path.join(os.path.realpath(prefix), "") for prefix in prefixes)
+    write_flags = os.O_WRONLY | os.O_RDWR
+    paths = set()
+
+    try:
+        pids = [pid for pid in os.listdir("/proc") if pid.isdigit()]
+    except OSError:
+        return paths
+
+    for pid in pids:
+        fd_dir = f"/proc/{pid}/fd"
+        try:
+            fds = os.listdir(fd_dir)
+        except OSError:
+            continue
+
+        for fd in fds:
+            try:
+                target = os.readlink(f"{fd_dir}/{fd}")
+                if not target.startswith(prefixes):
+                    continue
+                with open(f"/proc/{pid}/fdinfo/{fd}", "r") as fid:
+                    for line in fid:
+                        if line.startswith("flags:"):
+                            if int(line.split()[1], 8) & write_flags:
+                                paths.add(target)
+                            break
+            except (OSError, ValueError):
+                continue
+    return paths
+
+
+class StabilityDetector:
+    """
+    Decides whether a file is still being written, and remembers the files
+    that were deferred because of it.
+
+    A file is active when it was modified in the last quiet_s seconds, or when
+    a process has it open for writing.  Deferred files are polled, and each is
+    reported exactly once by poll() after it has become stable.
+    """
+
+    def __init__(self, watch: List[str], quiet_s: float = 30, detect_writers: bool = True, cache_s: float = 2) -> None:
+        """
+        Initializes the detector.
+
+        Args:
+            watch (List[str]): watch directories
+            quiet_s (float): How long a file must be unmodified to be stable.
+            detect_writers (bool): Also check /proc for processes writing the file.
+            cache_s (float): How long to reuse a /proc scan.
+        """
+        self.m_lock = threading.Lock()
+        self.m_watch = list(watch)
+        self.m_quiet_s = quiet_s
+        self.m_detect_writers = detect_writers and os.path.isdir("/proc")
+        self.m_cache_s = cache_s
+
+        self.m_writers = set()
+        self.m_writers_time = 0
+        self.m_deferred = {}  # fullpath -> time deferred
+
+    @property
+    def quiet_s(self) -> float:
+        return self.m_quiet_s
+
+    def configure(self, watch: List[str], quiet_s: float, detect_writers: bool = True):
+        with self.m_lock:
+            self.m_watch = list(watch)
+            self.m_quiet_s = quiet_s
+            self.m_detect_writers = detect_writers and os.path.isdir("/proc")
+            self.m_writers = set()
+            self.m_writers_time = 0
+
+    def _open_for_write(self) -> Set[str]:
+        with self.m_lock:
+            if not self.m_detect_writers:
+                return set()
+            if time.time() - self.m_writers_time > self.m_cache_s:
+                self.m_writers = open_for_write(self.m_watch)
+                self.m_writers_time = time.time()
+            return self.m_writers
+
+    def is_active(self, fullpath: str, mtime: float = None) -> bool:
+        """Is a file still being written?
+
+        Args:
+            fullpath (str): path to the file
+            mtime (float, optional): modification time, if already known
+
+        Returns:
+            bool: True if it was modified recently or is open for writing.
+        """
+        if mtime is None:
+            try:
+                mtime = os.path.getmtime(fullpath)
+            except OSError:
+                return False
+
+        if time.time() - mtime < self.m_quiet_s:
+            return True
+
+        return self.is_open_for_write(fullpath)
+
+    def is_open_for_write(self, fullpath: str) -> bool:
+        """Does a process have a file open for writing?
+
+        Reuses the /proc scan for cache_s seconds, so it is cheap to poll.
+
+        Args:
+            fullpath (str): path to the file
+
+        Returns:
+            bool: False when detect_writers is off
+        """
+        writers = self._open_for_write()
+        return len(writers) > 0 and os.path.realpath(fullpath) in writers
+
+    def defer(self, fullpath: str):
+        """Remember a file that was skipped because it is active
+
+        Args:
+            fullpath (str): path to the file
+        """
+        with self.m_lock:
+            self.m_deferred.setdefault(fullpath, time.time())
+
+    def deferred(self) -> List[str]:
+        with self.m_lock:
+            return sorted(self.m_deferred)
+
+    def poll(self) -> List[str]:
+        """Check the deferred files
+
+        Returns:
+            List[str]: deferred files that are now stable, or have been removed. Each is returned only once.
+        """
+        with self.m_lock:
+            candidates = list(self.m_deferred)
+
+        closed = []
+        for fullpath in candidates:
+            if os.path.exists(fullpath) and self.is_active(fullpath):
+                continue
+            closed.append(fullpath)
+
+        with self.m_lock:
+            for fullpath in closed:
+                self.m_deferred.pop(fullpath, None)
+
+        if len(closed) > 0:
+            debug_print(f"{len(closed)} deferred files are now closed")
+        return closed
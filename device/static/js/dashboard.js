@@ -197,6 +197,10 @@ $(document).ready(function () {
         updateProgress(msg, 'device-status-tqdm');
       });
 
+    socket.on("throttle_status", function(msg) {
+        updateThrottle(msg);
+    })
+
     socket.on("ping", function(msg) {
         console.log(msg);
     })
@@ -265,6 +269,40 @@ function updateConnections() {
     // })
 }
 
+function updateThrottle(msg) {
+    const div = document.getElementById("throttle-status")
+    if( div == null ) {
+        return;
+    }
+
+    const labels = {cpu_pct: "CPU", mem_pct: "Memory", iowait_pct: "IO Wait", temp_c: "Temp"};
+    let parts = [];
+    $.each(labels, (key, label) => {
+        let value = msg[key];
+        if( value === null || value === undefined ) {
+            return;
+        }
+        let unit = key == "temp_c" ? "C" : "%";
+        let text = label + ": " + value.toFixed(0) + unit + " / " + msg.targets[key] + unit;
+        if( msg.reasons.includes(key)) {
+            text = "<b>" + text + "</b>";
+        }
+        parts.push(text);
+    })
+
+    let state = msg.state.charAt(0).toUpperCase() + msg.state.slice(1);
+    div.className = "throttle_" + msg.state;
+    div.innerHTML = "<i class='bi bi-speedometer2'></i> " + state + " (" + msg.workers + " workers) &nbsp; " + parts.join(" &nbsp; ");
+
+    if( msg.stages ) {
+        let stages = [];
+        $.each(msg.stages, (name, stage) => {
+            stages.push(name + ": " + stage.target + " [" + stage.low + "-" + stage.high + "]");
+        })
+        div.innerHTML += "<br>Workers per stage &nbsp; " + stages.join(" &nbsp; ");
+    }
+}
+
 function debugSocket() {
     fetch("debug")
 }
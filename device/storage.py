@@ -0,0 +1,237 @@
+# Act on low disk space: upload the right files first, and free verified ones
+
+import json
+import os
+import shutil
+import threading
+
+from typing import Dict, List, Tuple
+
+from device.debug_print import debug_print
+from device.utils import write_json_atomic
+
+
+class StorageGovernor:
+    """
+    Watches the free space of the watch directories.
+
+    When a filesystem drops below low_water_pct free:
+
+    * uploads on that filesystem are ordered oldest first, then largest first.
+    * if purging is enabled, files are deleted (oldest first) until it is back
+      above high_water_pct free, but only files whose hash a server has
+      confirmed, and that still match that hash.
+
+    Confirmations are kept in {state_dir}/confirmed.json, so they survive a restart.
+    """
+
+    def __init__(self, state_dir: str, low_water_pct: float = 10, high_water_pct: float = 20, purge: bool = False) -> None:
+        """
+        Initializes the governor, loading any saved confirmations.
+
+        Args:
+            state_dir (str): Directory to keep confirmed.json in
+            low_water_pct (float): Act when free space is below this percentage.
+            high_water_pct (float): Purge until free space is above this percentage.
+            purge (bool): Delete confirmed files when below low_water_pct.
+        """
+        self.m_lock = threading.Lock()
+        self.m_filename = os.path.join(state_dir, "confirmed.json")
+        self.m_low_water_pct = low_water_pct
+        self.m_high_water_pct = high_water_pct
+        self.m_purge = purge
+
+        self.m_confirmed = {}  # fullpath -> md5 confirmed by a server
+        if os.path.exists(self.m_filename):
+            try:
+                self.m_confirmed = json.load(open(self.m_filename, "r"))
+            except (OSError, json.decoder.JSONDecodeError) as e:
+                debug_print(f"Failed to read {self.m_filename}: {e}")
+
+    def configure(self, low_water_pct: float, high_water_pct: float, purge: bool):
+        self.m_low_water_pct = low_water_pct
+        self.m_high_water_pct = high_water_pct
+        self.m_purge = purge
+
+    def _save(self):
+        try:
+            os.makedirs(os.path.dirname(self.m_filename), exist_ok=True)
+            write_json_atomic(self.m_filename, self.m_confirmed)
+        except OSError as e:
+            debug_print(f"Failed to write {self.m_filename}: {e}")
+
+    def confirm(self, files: List[Tuple[str, str, str]]):
+        """Record that a server holds these files, with these hashes
+
+        Args:
+            files (List[Tuple[str, str, str]]): (dirroot, filename, md5)
+        """
+        with self.m_lock:
+            for dirroot, filename, md5 in files:
+                self.m_confirmed[os.path.join(dirroot, filename)] = md5
+            self._save()
+
+    def forget(self, fullpaths: List[str]):
+        """Drop the confirmations of files that no longer exist
+
+        Args:
+            fullpaths (List[str]): full paths
+        """
+        with self.m_lock:
+            changed = False
+            for fullpath in fullpaths:
+                changed |= self.m_confirmed.pop(fullpath, None) is not None
+            if changed:
+                self._save()
+
+    def is_verified(self, fullpath: str) -> bool:
+        """Is it safe to delete this file?
+
+        The file must have a confirmed hash, and a hash cache ({file}.md5)
+        that is newer than the file and equal to the confirmed hash.
+
+        Args:
+            fullpath (str): full path
+
+        Returns:
+            bool: True if a server holds an identical copy of this file.
+        """
+        with self.m_lock:
+            confirmed = self.m_confirmed.get(fullpath)
+        if not confirmed:
+            return False
+
+        cache_name = fullpath + ".md5"
+        try:
+            if os.path.getmtime(cache_name) <= os.path.getmtime(fullpath):
+                return False
+            return json.load(open(cache_name, "r")) == confirmed
+        except (OSError, json.decoder.JSONDecodeError):
+            return False
+
+    def free_pct(self, dirroot: str) -> float:
+        total, _, free = shutil.disk_usage(dirroot)
+        return (free / total) * 100
+
+    def pressure(self, watch: List[str]) -> Dict[int, str]:
+        """Find the filesystems that are below the low water mark
+
+        Args:
+            watch (List[str]): watch directories
+
+        Returns:
+            Dict[int, str]: st_dev -> a watch directory on that filesystem
+        """
+        rtn = {}
+        for dirroot in watch:
+            if not os.path.exists(dirroot):
+                continue
+            dev = os.stat(dirroot).st_dev
+            if dev in rtn:
+                continue
+            if self.free_pct(dirroot) < self.m_low_water_pct:
+                rtn[dev] = dirroot
+        return rtn
+
+    def prioritize(self, filelist: list, watch: List[str]) -> list:
+        """Order a send file list so files on full filesystems go first
+
+        Files on a filesystem under pressure go first, oldest then largest.
+        The rest keep their order.
+
+        Args:
+            filelist (list): List[Tuple[dirroot, relative_path, upload_id, offset_b, file_size]]
+            watch (List[str]): watch directories
+
+        Returns:
+            list: reordered file list
+        """
+        pressure = self.pressure(watch)
+        if len(pressure) == 0:
+            return filelist
+
+        def key(item):
+            idx, (dirroot, relative_path, _, _, file_size) = item
+            fullpath = os.path.join(dirroot, relative_path)
+            try:
+                stat = os.stat(fullpath)
+            except OSError:
+                return (1, 0, 0, idx)
+            if stat.st_dev not in pressure:
+                return (1, 0, 0, idx)
+            return (0, stat.st_mtime, -file_size, idx)
+
+        return [item for _, item in sorted(enumerate(filelist), key=key)]
+
+    def priority_entries(self, entries: List[dict], watch: List[str], limit: int = 100) -> List[list]:
+        """The catalog entries a server should upload first
+
+        Args:
+            entries (List[dict]): catalog entries
+            watch (List[str]): watch directories
+            limit (int): most entries to return
+
+        Returns:
+            List[list]: [dirroot, filename] of files on filesystems under pressure, oldest then largest first.
+        """
+        pressure = self.pressure(watch)
+        if len(pressure) == 0:
+            return []
+
+        candidates = []
+        for entry in entries:
+            fullpath = os.path.join(entry["dirroot"], entry["filename"])
+            try:
+                stat = os.stat(fullpath)
+            except OSError:
+                continue
+            if stat.st_dev in pressure and not self.is_verified(fullpath):
+                candidates.append((stat.st_mtime, -stat.st_size, entry["dirroot"], entry["filename"]))
+
+        return [[dirroot, filename] for _, _, dirroot, filename in sorted(candidates)[:limit]]
+
+    def purge_candidates(self, entries: List[dict], watch: List[str]) -> List[str]:
+        """Choose the files to delete to get back above the high water mark
+
+        Args:
+            entries (List[dict]): catalog entries
+            watch (List[str]): watch directories
+
+        Returns:
+            List[str]: full paths, oldest first. Empty if purging is disabled.
+        """
+        if not self.m_purge:
+            return []
+
+        pressure = self.pressure(watch)
+        if len(pressure) == 0:
+            return []
+
+        # bytes to free on each filesystem
+        needed = {}
+        for dev, dirroot in pressure.items():
+            total, _, free = shutil.disk_usage(dirroot)
+            needed[dev] = total * self.m_high_water_pct / 100 - free
+
+        candidates = []
+        for entry in entries:
+            if entry.get("live"):
+                continue
+            fullpath = os.path.join(entry["dirroot"], entry["filename"])
+            try:
+                stat = os.stat(fullpath)
+            except OSError:
+                continue
+            if stat.st_dev not in needed:
+                continue
+            candidates.append((stat.st_mtime, -stat.st_size, fullpath, stat.st_dev, stat.st_size))
+
+        rtn = []
+        for _, _, fullpath, dev, size in sorted(candidates):
+            if needed[dev] <= 0:
+                continue
+            if not self.is_verified(fullpath):
+                continue
+            rtn.append(fullpath)
+            needed[dev] -= size
+        return rtn
@@ -0,0 +1,238 @@
+# Back off scanning and uploading while the robot is busy
+
+import multiprocessing
+import os
+import psutil
+import threading
+
+from contextlib import contextmanager
+from multiprocessing import Pool
+
+from device.debug_print import debug_print
+
+NORMAL = "normal"
+REDUCED = "reduced"
+PAUSED = "paused"
+
+DEFAULTS = {
+    "enabled": True,
+    "cpu_pct": 70,        # cpu used by everything except our workers
+    "mem_pct": 85,
+    "iowait_pct": 20,
+    "temp_c": 80,
+    "nice": 10,
+    "ionice": "best_effort",  # idle | best_effort | none
+    "pause_after": 3,     # checks over target before pausing
+    "resume_pct": 90,     # resume when every measurement is below this percentage of its target
+    "interval_s": 2,
+}
+
+
+def lower_priority(nice: int, ionice: str):
+    """Pool initializer: lower the cpu and io priority of a worker
+
+    Args:
+        nice (int): nice value to add
+        ionice (str): "idle", "best_effort", or "none"
+    """
+    try:
+        process = psutil.Process()
+        if nice:
+            os.nice(nice)
+        if ionice == "idle" and hasattr(psutil, "IOPRIO_CLASS_IDLE"):
+            process.ionice(psutil.IOPRIO_CLASS_IDLE)
+        elif ionice == "best_effort" and hasattr(psutil, "IOPRIO_CLASS_BE"):
+            process.ionice(psutil.IOPRIO_CLASS_BE, 7)
+    except (OSError, psutil.Error) as e:
+        debug_print(f"Failed to lower priority: {e}")
+
+
+def _pool_workers() -> list:
+    """The multiprocessing.Pool workers started by this process"""
+    return [child for child in multiprocessing.active_children() if "PoolWorker" in child.name]
+
+
+class ResourceGovernor:
+    """
+    Watches the load of the robot and slows down or pauses our stages.
+
+    Every interval_s seconds it measures cpu (excluding our own workers),
+    memory, io wait and the hottest temperature sensor, and compares them to
+    the targets in the "throttle" config:
+
+    * normal: all below target. Stages run at full concurrency.
+    * reduced: something over target. Stages start half as many tasks.
+    * paused: over target for pause_after checks in a row, or too hot.
+      No new tasks are started until everything is back below resume_pct of
+      its targets.  Tasks that are running finish, so no worker, and no
+      upload, is ever stopped half way.
+
+    The limit is applied through limit(), which the DeviceScheduler asks
+    before it starts each task.  Workers also run at a lower nice and
+    ionice class, see lower_priority().
+    """
+
+    def __init__(self, config: dict = None) -> None:
+        """
+        Initializes the governor.
+
+        Args:
+            config (dict, optional): the "throttle" section of the config
+        """
+        self.m_lock = threading.Lock()
+        self.m_state = NORMAL
+        self.m_over_count = 0
+        self.m_processes = {}   # pid -> psutil.Process, for cpu_percent()
+        self.m_status = {}
+        self.configure(config)
+
+        psutil.cpu_percent(interval=None)
+        psutil.cpu_times_percent(interval=None)
+
+    def configure(self, config: dict):
+        with self.m_lock:
+            self.m_config = dict(DEFAULTS)
+            self.m_config.update(config or {})
+        if not self.m_config["enabled"]:
+            self.m_state = NORMAL
+
+    @property
+    def state(self) -> str:
+        return self.m_state
+
+    @property
+    def interval_s(self) -> float:
+        return float(self.m_config["interval_s"])
+
+    def priority(self) -> tuple:
+        """initargs for lower_priority()"""
+        if not self.m_config["enabled"]:
+            return (0, "none")
+        return (int(self.m_config["nice"]), self.m_config["ionice"])
+
+    @contextmanager
+    def pool(self, processes: int, maxtasksperchild: int = None):
+        """A multiprocessing.Pool whose workers run at lower priority
+
+        Use instead of "with Pool(processes) as pool".
+
+        Args:
+            processes (int): number of workers
+            maxtasksperchild (int, optional): replace each worker after this many tasks
+        """
+        with Pool(processes, initializer=lower_priority, initargs=self.priority(), maxtasksperchild=maxtasksperchild) as pool:
+            yield pool
+
+    def limit(self, max_threads: int) -> int:
+        """How many tasks may run at once
+
+        Args:
+            max_threads (int): the unthrottled limit
+
+        Returns:
+            int: max_threads, half of it, or 0 while paused
+        """
+        if self.m_state == PAUSED:
+            return 0
+        if self.m_state == REDUCED:
+            return max(1, max_threads // 2)
+        return max_threads
+
+    def _worker_cpu(self, workers: list) -> float:
+        """cpu percent (of the whole machine) used by our workers"""
+        pids = set()
+        total = 0.0
+        for worker in workers:
+            pids.add(worker.pid)
+            try:
+                process = self.m_processes.get(worker.pid)
+                if process is None:
+                    process = psutil.Process(worker.pid)
+                    self.m_processes[worker.pid] = process
+                    process.cpu_percent(interval=None)
+                    continue
+                total += process.cpu_percent(interval=None)
+            except psutil.Error:
+                continue
+
+        for pid in list(self.m_processes):
+            if pid not in pids:
+                del self.m_processes[pid]
+        return total / (psutil.cpu_count() or 1)
+
+    def sample(self) -> dict:
+        """Measure the load of the robot
+
+        Returns:
+            dict: cpu_pct (excluding our workers), mem_pct, iowait_pct, temp_c (None if there are no sensors)
+        """
+        workers = _pool_workers()
+        cpu_pct = psutil.cpu_percent(interval=None)
+        cpu_times = psutil.cpu_times_percent(interval=None)
+        temp_c = None
+        if hasattr(psutil, "sensors_temperatures"):
+            try:
+                temps = [t.current for sensors in psutil.sensors_temperatures().values() for t in sensors if t.current]
+                temp_c = max(temps) if temps else None
+            except (OSError, ValueError):
+                pass
+
+        return {
+            "cpu_pct": max(0.0, cpu_pct - self._worker_cpu(workers)),
+            "mem_pct": psutil.virtual_memory().percent,
+            "iowait_pct": getattr(cpu_times, "iowait", 0.0),
+            "temp_c": temp_c,
+            "workers": len(workers),
+        }
+
+    def check(self) -> dict:
+        """Take a sample and update the state
+
+        Returns:
+            dict: the sample, with the state, targets and reasons
+        """
+        config = self.m_config
+        sample = self.sample()
+
+        reasons = []
+        resume = True
+        for key in ("cpu_pct", "mem_pct", "iowait_pct", "temp_c"):
+            value = sample[key]
+            if value is None:
+                continue
+            if value > config[key]:
+                reasons.append(key)
+            if value > config[key] * config["resume_pct"] / 100:
+                resume = False
+
+        if not config["enabled"]:
+            state = NORMAL
+        elif len(reasons) > 0:
+            self.m_over_count += 1
+            if "temp_c" in reasons or self.m_over_count >= config["pause_after"]:
+                state = PAUSED
+            elif self.m_state == PAUSED:
+                state = PAUSED
+            else:
+                state = REDUCED
+        elif self.m_state == PAUSED and not resume:
+            # hysteresis, stay paused until well below target
+            state = PAUSED
+        else:
+            self.m_over_count = 0
+            state = NORMAL if resume or self.m_state == NORMAL else REDUCED
+
+        if state != self.m_state:
+            debug_print(f"Throttle {self.m_state} -> {state} {reasons}")
+            self.m_state = state
+
+        sample.update({
+            "state": state,
+            "reasons": reasons,
+            "targets": {key: config[key] for key in ("cpu_pct", "mem_pct", "iowait_pct", "temp_c")}
+        })
+        self.m_status = sample
+        return sample
+
+    def status(self) -> dict:
+        return self.m_status
@@ -3,6 +3,7 @@
 import exifread 
 import ffmpeg 
 import hashlib
+import json
 import mcap
 import mcap.exceptions
 import os
@@ -23,6 +24,7 @@ from rosbags.highlevel import AnyReader, AnyReaderError
 from typing import List, Tuple
 
 from device.debug_print import debug_print
+from device.imagemeta import format_time
 from device.SocketIOTQDM import MultiTargetSocketIOTQDM
     
 
@@ -367,14 +369,17 @@ def _getMetaDataJPEG(filename: str) -> dict:
             }
 
     with open(filename, "rb") as f:
-        tags = exifread.process_file(f)
+        # no maker notes or thumbnails, and stop at the tag we are after
+        tags = exifread.process_file(f, details=False, stop_tag="DateTimeOriginal")
     
     rtn = {}
     for tag in tags:
         if tag == "EXIF DateTimeOriginal":
-            timestamp_str = str(tags[tag])
-            rtn["start_time"] = timestamp_str
-            rtn["end_time"] = timestamp_str
+            # the same format as the header reader of the cheap tier
+            timestamp_str = format_time(str(tags[tag]))
+            if timestamp_str:
+                rtn["start_time"] = timestamp_str
+                rtn["end_time"] = timestamp_str
     return rtn
 
 def _getMetaDataMP4(filename: str) -> dict:
@@ -467,36 +472,19 @@ def _getMetaDataText(filename: str) -> dict:
         }
 
 
-def getMetaData(filename:str, local_tz:str) -> dict:
-    """Extract the metadata from a file
+def write_json_atomic(filename:str, data:any):
+    """Write json to a file, so that readers never see a partial file
 
-    Handles [mcap, bag, jpg, mp4, txt, ass, png, yaml]
+    Writes to a temporary file in the same directory, then renames it over the original. 
 
     Args:
-        filename (str): _description_
-        local_tz (str): _description_
-
-    Returns:
-        dict: A dictionary with 'start_time' and 'end_time' in the local timezone, 
-        and 'topics' with message counts per topic if applicable. Returns `None` if file reading fails.
+        filename (str): destination file
+        data (any): json serialisable data
     """
-    if filename.lower().endswith(".mcap"):
-        return _getMetaDataMCAP(filename, local_tz)
-    if filename.lower().endswith(".bag"):
-        return _getMetadataROS(filename, local_tz)
-    elif filename.lower().endswith(".jpg"):
-        return _getMetaDataJPEG(filename)
-    elif filename.lower().endswith(".mp4"):
-        return _getMetaDataMP4(filename)
-    elif filename.lower().endswith(".txt"):
-        return _getMetaDataText(filename)
-    elif filename.lower().endswith(".ass"):
-        return _getMetaDataText(filename)
-    elif filename.lower().endswith(".png"):
-        return _getMetaDataPNG(filename)
-    elif filename.lower().endswith(".yaml"):
-        return _getMetaDataText(filename)
-    return {}
+    tmp_name = f"{filename}.{os.getpid()}.tmp"
+    with open(tmp_name, "w") as fid:
+        json.dump(data, fid)
+    os.replace(tmp_name, filename)
 
 
 def get_ip_address_and_port(server_address:str) -> Tuple[str, str]:
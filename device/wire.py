@@ -0,0 +1,193 @@
+# Compact encodings for catalog transfer
+
+import msgpack
+import os
+import zlib
+
+from typing import List
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# Keys whose values repeat across entries, and are sent once in the string table.
+INTERNED_KEYS = ["dirroot", "site", "robot_name"]
+
+JSON = "json"
+
+
+def supported_encodings() -> List[str]:
+    """The encodings this device can produce, best first
+
+    * "json": the entries as they are. socketio serialises them as JSON.
+    * "msgpack": columnar msgpack with a string table.
+    * "msgpack+zstd": as above, compressed with zstd. Only if zstandard is installed.
+    * "msgpack+zlib": as above, compressed with zlib.
+
+    Returns:
+        List[str]: encoding names
+    """
+    encodings = []
+    if zstandard is not None:
+        encodings.append("msgpack+zstd")
+    encodings += ["msgpack+zlib", "msgpack", JSON]
+    return encodings
+
+
+def negotiate(offered: List[str]) -> str:
+    """Pick an encoding that both sides support
+
+    Args:
+        offered (List[str]): Encodings the server can decode, in its order of preference
+
+    Returns:
+        str: The first offered encoding this device supports, or "json"
+    """
+    supported = supported_encodings()
+    for encoding in offered or []:
+        if encoding in supported:
+            return encoding
+    return JSON
+
+
+class _StringTable:
+    def __init__(self) -> None:
+        self.m_index = {}
+        self.m_strings = []
+
+    def __call__(self, value: str) -> int:
+        idx = self.m_index.get(value)
+        if idx is None:
+            idx = len(self.m_strings)
+            self.m_index[value] = idx
+            self.m_strings.append(value)
+        return idx
+
+
+def _columns(entries: List[dict], strings: _StringTable) -> dict:
+    """Turn a list of entries into columns
+
+    * dirroot, site, robot_name are string table indexes.
+    * filename is [index of the directory, basename].
+    * topics is a flat list of [topic index, count, topic index, count, ...].
+    * every other key is stored as is.
+    * "missing" lists, per key, the rows that do not have that key.
+    * "raw" lists, per key, the rows of the keys above whose value is stored
+      as is, because it is not of the usual type (e.g. an int site, that
+      would otherwise read as a string table index).
+    """
+    keys = []
+    for entry in entries:
+        for key in entry:
+            if key not in keys:
+                keys.append(key)
+
+    columns = {}
+    missing = {}
+    raw = {}
+    for key in keys:
+        column = []
+        for row, entry in enumerate(entries):
+            if key not in entry:
+                missing.setdefault(key, []).append(row)
+                column.append(None)
+                continue
+
+            value = entry[key]
+            if key in INTERNED_KEYS and isinstance(value, str):
+                value = strings(value)
+            elif key == "filename" and isinstance(value, str):
+                dirname, basename = os.path.split(value)
+                value = [strings(dirname), basename]
+            elif key == "topics" and isinstance(value, dict):
+                flat = []
+                for topic, count in value.items():
+                    flat += [strings(topic), count]
+                value = flat
+            elif key in INTERNED_KEYS or key in ("filename", "topics"):
+                raw.setdefault(key, []).append(row)
+            column.append(value)
+        columns[key] = column
+
+    return {"rows": len(entries), "columns": columns, "missing": missing, "raw": raw}
+
+
+def _rows(table: dict, strings: List[str]) -> List[dict]:
+    """The inverse of _columns()"""
+    rows = table["rows"]
+    columns = table["columns"]
+    missing = {key: set(idx) for key, idx in table.get("missing", {}).items()}
+    raw = {key: set(idx) for key, idx in table.get("raw", {}).items()}
+
+    entries = [{} for _ in range(rows)]
+    for key, column in columns.items():
+        skip = missing.get(key, set())
+        as_is = raw.get(key, set())
+        for row, value in enumerate(column):
+            if row in skip:
+                continue
+            if row in as_is:
+                pass
+            elif key in INTERNED_KEYS and isinstance(value, int):
+                value = strings[value]
+            elif key == "filename" and isinstance(value, list):
+                value = os.path.join(strings[value[0]], value[1])
+            elif key == "topics" and isinstance(value, list):
+                value = {strings[value[i]]: value[i + 1] for i in range(0, len(value), 2)}
+            entries[row][key] = value
+    return entries
+
+
+def encode(updated: List[dict], removed: List[list], encoding: str) -> bytes:
+    """Encode a block of catalog changes
+
+    Args:
+        updated (List[dict]): added or modified entries
+        removed (List[list]): [dirroot, filename] of removed entries
+        encoding (str): One of supported_encodings(), except "json"
+
+    Returns:
+        bytes: The encoded block
+    """
+    strings = _StringTable()
+    msg = {
+        "v": 1,
+        "updated": _columns(updated, strings),
+        "removed": [[strings(dirroot), filename] for dirroot, filename in removed],
+    }
+    msg["strings"] = strings.m_strings
+    data = msgpack.packb(msg, use_bin_type=True)
+
+    if encoding == "msgpack+zstd":
+        data = zstandard.ZstdCompressor(level=3).compress(data)
+    elif encoding == "msgpack+zlib":
+        data = zlib.compress(data, 6)
+    elif encoding != "msgpack":
+        raise ValueError(f"Unknown encoding {encoding}")
+    return data
+
+
+def decode(data: bytes, encoding: str):
+    """Decode a block made by encode()
+
+    Args:
+        data (bytes): encoded block
+        encoding (str): encoding it was made with
+
+    Returns:
+        Tuple[List[dict], List[list]]: updated, removed
+    """
+    if encoding == "msgpack+zstd":
+        data = zstandard.ZstdDecompressor().decompress(data)
+    elif encoding == "msgpack+zlib":
+        data = zlib.decompress(data)
+    elif encoding != "msgpack":
+        raise ValueError(f"Unknown encoding {encoding}")
+
+    msg = msgpack.unpackb(data, raw=False)
+    strings = msg["strings"]
+    updated = _rows(msg["updated"], strings)
+    removed = [[strings[dirroot], filename] for dirroot, filename in msg["removed"]]
+    return updated, removed
@@ -1,5 +1,7 @@
 import os
 import json
+import tarfile
+import time
 import urllib
 import requests
 import xxhash
@@ -8,11 +10,13 @@ from datetime import datetime
 
 import device.reindexMCAP as reindexMCAP
 from device.debug_print import debug_print
-from device.utils import getDateFromFilename, getMetaData
+from device.extractors import LOCAL_FIELDS, PENDING, cheap_metadata, expensive_metadata
+from device.fastread import StreamReader
+from device.utils import getDateFromFilename
 
 
 class SendWorkerArg:
-    def __init__(self, message_queue, dirroot, relative_path, upload_id, offset_b, file_size, signal, server, send_offsets, split_size_gb, api_key_token, name, url, source, read_size_b) -> None:
+    def __init__(self, message_queue, dirroot, relative_path, upload_id, offset_b, file_size, signal, server, send_offsets, split_size_gb, api_key_token, name, url, source, read_size_b, live=False, live_quiet_s=30.0, direct_io=False) -> None:
         self.message_queue = message_queue
         self.dirroot = dirroot
         self.relative_path = relative_path
@@ -28,6 +32,9 @@ class SendWorkerArg:
         self.url = url
         self.source = source
         self.read_size_b = read_size_b
+        self.live = live
+        self.live_quiet_s = live_quiet_s
+        self.direct_io = direct_io
 
 
 def send_worker(args):
@@ -42,10 +49,9 @@ def send_worker(args):
         debug_print(f"{fullpath} not found")
         return fullpath, False
 
-    with open(fullpath, 'rb') as file:
+    with StreamReader(fullpath, args.read_size_b, args.offset_b, args.direct_io) as file:
         params = {}
         if args.offset_b > 0:
-            file.seek(args.offset_b)
             params["offset"] = args.offset_b
             args.file_size -= args.offset_b
 
@@ -68,6 +74,7 @@ def send_worker(args):
                 chunk = file.read(args.read_size_b)
                 if not chunk:
                     break
+                # the chunk is a view of the StreamReader buffer. requests sends it before asking for the next one
                 yield chunk
 
                 # Update the progress bars
@@ -104,8 +111,261 @@ def send_worker(args):
     return fullpath, True
 
 
+class BundleWorkerArg:
+    def __init__(self, message_queue, files, signal, server, api_key_token, name, url, source, read_size_b=1024*1024, direct_io=False) -> None:
+        self.message_queue = message_queue
+        self.files = files  # List[Tuple[dirroot, relative_path, upload_id, offset_b, file_size]]
+        self.signal = signal
+        self.server = server
+        self.api_key_token = api_key_token
+        self.name = name
+        self.url = url
+        self.source = source
+        self.read_size_b = read_size_b
+        self.direct_io = direct_io
+
+
+def _tar_member(name: str, size: int, mtime: float) -> bytes:
+    """The tar header of a member"""
+    info = tarfile.TarInfo(name=name)
+    info.size = size
+    info.mtime = int(mtime)
+    return info.tobuf(tarfile.PAX_FORMAT, tarfile.ENCODING, "surrogateescape")
+
+
+def bundle_worker(args):
+    """Send many small files as a single streamed tar archive
+
+    Each file is a tar member named by its upload_id, read through a
+    StreamReader like any other upload.  The last member, 
+    "bundle_manifest.json", lists for each file:  
+      upload_id, relative_path, offset (of the member data in the stream), size, md5 (xxh128)
+
+    A file that shrinks while it is read is padded to the size in its
+    header, and left out of the manifest, so the server does not acknowledge it.
+
+    The server replies with a json dict of upload_id -> "ok" | error. 
+
+    Args:
+        args (BundleWorkerArg): The files to send
+
+    Returns:
+        Tuple[str, list, list]: name of the bundle, the files that were not acknowledged, 
+        and the files that could not be opened (most likely removed)
+    """
+    assert( isinstance(args, BundleWorkerArg))
+
+    if args.signal.is_set():
+        return args.name, args.files, []
+
+    total_size = sum(file_size for _, _, _, _, file_size in args.files)
+    manifest = []
+    missing = []
+
+    def stream():
+        offset = 0
+        for item in args.files:
+            dirroot, relative_path, upload_id, _, _ = item
+            if args.signal.is_set():
+                break
+
+            fullpath = os.path.join(dirroot, relative_path)
+            try:
+                stat = os.stat(fullpath)
+                file = StreamReader(fullpath, args.read_size_b, 0, args.direct_io)
+            except OSError as e:
+                debug_print(f"Failed to read {fullpath}: {e}")
+                missing.append(item)
+                continue
+
+            header = _tar_member(upload_id, stat.st_size, stat.st_mtime)
+            yield header
+            offset += len(header)
+            start = offset
+
+            x = xxhash.xxh128()
+            with file:
+                for chunk in file.chunks(stat.st_size):
+                    x.update(chunk)
+                    offset += len(chunk)
+                    # a view of the StreamReader buffer, sent before the next chunk is read
+                    yield chunk
+
+            short = stat.st_size - (offset - start)
+            if short > 0:
+                debug_print(f"{fullpath} shrank while it was bundled, sending it on its own")
+                yield bytes(short)
+                offset += short
+            else:
+                manifest.append({
+                    "upload_id": upload_id,
+                    "relative_path": relative_path,
+                    "offset": start,
+                    "size": stat.st_size,
+                    "md5": x.hexdigest()
+                })
+
+            padding = -stat.st_size % tarfile.BLOCKSIZE
+            if padding:
+                yield bytes(padding)
+                offset += padding
+
+            args.message_queue.put({"main_pbar": stat.st_size})
+            args.message_queue.put({"child_pbar": args.name, "size": stat.st_size, "action": "update"})
+
+        data = json.dumps(manifest).encode("utf-8")
+        header = _tar_member("bundle_manifest.json", len(data), time.time())
+        offset += len(header) + len(data)
+        yield header + data + bytes(-len(data) % tarfile.BLOCKSIZE)
+        offset += -len(data) % tarfile.BLOCKSIZE
+
+        # the end of the archive: two zero blocks, and the last record filled up
+        end = 2 * tarfile.BLOCKSIZE
+        end += -(offset + end) % tarfile.RECORDSIZE
+        yield bytes(end)
+
+    headers = {
+        'Content-Type': 'application/x-tar',
+        "X-Api-Key": args.api_key_token
+        }
+
+    desc = f"Sending bundle of {len(args.files)} files"
+    args.message_queue.put({"child_pbar": args.name, "desc": desc, "size": total_size, "action": "start"})
+
+    acks = {}
+    try:
+        response = requests.post(args.url + f"/{args.source}", params={"count": len(args.files)}, data=stream(), headers=headers)
+        if response.status_code == 200:
+            acks = response.json()
+        else:
+            debug_print(f"Error! {response.status_code} {response.content.decode()}")
+    except (requests.exceptions.RequestException, ValueError) as e:
+        debug_print(f"Failed to send bundle {args.name}: {e}")
+
+    args.message_queue.put({"child_pbar": args.name, "action": "close"})
+
+    if missing:
+        debug_print(f"{len(missing)} files of bundle {args.name} could not be read")
+    failed = [item for item in args.files if acks.get(item[2]) != "ok" and item not in missing]
+    return args.name, failed, missing
+
+
+def tail_worker(args, is_open_for_write=None):
+    """Send a file that is still being recorded, as it grows
+
+    Sends what is already on disk, then polls the file and sends each newly
+    appended range of bytes.  Once the file has not grown for live_quiet_s
+    seconds, and is_open_for_write() says no process has it open, it is considered closed,
+    and a final request is sent with the hash and size of the whole file.  
+    The hash is cached in {file}.md5.  A file that shrinks or is replaced
+    while it is tailed is not finalized: the tail stops, and the file is
+    left to a new upload.
+
+    Only for servers that have the "live" capability, see Device._background_send_files().
+
+    Each range is a POST to {url}/{source}/{upload_id} with params
+      offset: where this range starts
+      cid: range number 
+      live: 1
+    The final request has no data, and params
+      offset: final size, final: 1, size: final size, md5: xxh128 of the whole file
+
+    Args:
+        args (SendWorkerArg): The file to send, with live set 
+        is_open_for_write (Callable[[str], bool], optional): StabilityDetector.is_open_for_write, 
+            which shares one cached /proc scan between tails. Without it, only live_quiet_s counts.
+
+    Returns:
+        Tuple[str, bool]: The full path, and True if the file was finalized
+    """
+    assert( isinstance(args, SendWorkerArg))
+
+    fullpath = os.path.join(args.dirroot, args.relative_path)
+    if args.signal.is_set() or not os.path.exists(fullpath):
+        return fullpath, False
+
+    headers = {
+        'Content-Type': 'application/octet-stream',
+        "X-Api-Key": args.api_key_token
+        }
+    url = args.url + f"/{args.source}/{args.upload_id}"
+    x = xxhash.xxh128()
+    inode = os.stat(fullpath).st_ino
+    desc = "Live " + os.path.basename(args.relative_path)
+    args.message_queue.put({"child_pbar": args.name, "desc": desc, "size": args.file_size, "action": "start"})
+
+    finalized = False
+    with StreamReader(fullpath, args.read_size_b, 0, args.direct_io) as file:
+        # the server already has everything before offset_b 
+        for chunk in file.chunks(args.offset_b):
+            x.update(chunk)
+        pos = file.pos
+
+        def read_range(end):
+            nonlocal pos
+            for chunk in file.chunks(end):
+                x.update(chunk)
+                pos = file.pos
+                args.message_queue.put({"main_pbar": len(chunk)})
+                args.message_queue.put({"child_pbar": args.name, "size": len(chunk), "action": "update"})
+                yield chunk
+
+        cid = 0
+        last_growth = time.time()
+        while not args.signal.is_set():
+            try:
+                stat = os.stat(fullpath)
+            except FileNotFoundError:
+                debug_print(f"{fullpath} was removed while it was tailed")
+                break
+            if stat.st_size < pos or stat.st_ino != inode:
+                # the server has bytes that are no longer in the file
+                debug_print(f"{fullpath} was truncated or replaced while it was tailed, leaving it to a new upload")
+                break
+            size = stat.st_size
+            if size > pos:
+                params = {"offset": pos, "cid": cid, "live": 1}
+                response = requests.post(url, params=params, data=read_range(size), headers=headers)
+                if response.status_code != 200:
+                    debug_print(f"Error! {response.status_code} {response.content.decode()}")
+                    break
+                cid += 1
+                last_growth = time.time()
+                continue
+
+            if time.time() - last_growth > args.live_quiet_s:
+                if is_open_for_write is not None and is_open_for_write(fullpath):
+                    # quiet, but the recorder still has it open 
+                    time.sleep(1)
+                    continue
+
+                md5 = x.hexdigest()
+                params = {"offset": pos, "final": 1, "size": pos, "md5": md5}
+                response = requests.post(url, params=params, data=b"", headers=headers)
+                if response.status_code != 200:
+                    debug_print(f"Error! {response.status_code} {response.content.decode()}")
+                    break
+
+                with open(fullpath + ".md5", "w") as fid:
+                    json.dump(md5, fid)
+                finalized = True
+                break
+
+            time.sleep(1)
+
+    args.message_queue.put({"child_pbar": args.name, "action": "close"})
+    return fullpath, finalized
+
+
+def transfer_worker(args):
+    """Run a send_worker or bundle_worker, depending on args.  Live files are sent by LiveTails"""
+    if isinstance(args, BundleWorkerArg):
+        return bundle_worker(args)
+    return send_worker(args)
+
+
 def hash_worker(args):
-        message_queue, entry, chunk_size = args
+        message_queue, entry, chunk_size, direct_io = args
         if entry is None:
             debug_print("empty entry")
 
@@ -129,11 +389,11 @@ def hash_worker(args):
         name = urllib.parse.quote(filename).replace("/", "_")
 
         try:
-            with open(filename, 'rb') as f:
+            with StreamReader(filename, chunk_size, 0, direct_io) as f:
                 desc = os.path.basename(filename)
                 message_queue.put({"child_pbar": name, "desc": desc, "size": size, "action": "start"})
 
-                while chunk := f.read(chunk_size):
+                for chunk in f.chunks():
                     x.update(chunk)
                     update = len(chunk)
                     message_queue.put({"main_pbar": update})
@@ -150,8 +410,18 @@ def hash_worker(args):
         # debug_print(f"exit {os.path.basename(filename)}")
         return entry
 
-def create_device_entry(fullpath, filename, dirroot, size, robot_name, local_tz):
-    metadata = getMetaData(fullpath, local_tz)
+def _finish_entry(entry):
+    """Drop the LOCAL_FIELDS of the extractors, and make the bag of a rosbag2 shard relative to the
+    watch dir, like the file name.  The name of a bag alone is not unique"""
+    for field in LOCAL_FIELDS:
+        entry.pop(field, None)
+    if os.path.isabs(entry.get("bag", "")):
+        entry["bag"] = os.path.relpath(entry["bag"], entry["dirroot"])
+
+
+def create_device_entry(fullpath, filename, dirroot, size, robot_name, local_tz, costs=None):
+    # only the cheap fields, the details stage fills in the rest
+    metadata, pending = cheap_metadata(fullpath, local_tz, costs)
     if metadata is None:
         return None
 
@@ -173,11 +443,26 @@ def create_device_entry(fullpath, filename, dirroot, size, robot_name, local_tz)
         "md5": None
     }
     device_entry.update(metadata)
+    _finish_entry(device_entry)
+    if pending:
+        device_entry[PENDING] = True
     return device_entry
 
 
+def _write_metadata(metadata_filename, device_entry):
+    try:
+        with open(metadata_filename, "w") as fid:
+            json.dump(device_entry, fid, indent=True)
+        os.chmod(metadata_filename, 0o777)
+
+    except PermissionError as e:
+        debug_print(f"Failed to write [{metadata_filename}]. Permission Denied")
+    except Exception as e:
+        debug_print(f"Error writing [{metadata_filename}]: {e}")
+
+
 def metadata_worker(args):
-    message_queue, dirroot, filename, fullpath, robot_name, local_tz, updates = args
+    message_queue, dirroot, filename, fullpath, robot_name, local_tz, updates, costs = args
 
     if not os.path.exists(fullpath):
         message_queue.put({"main_pbar": 1})
@@ -196,13 +481,13 @@ def metadata_worker(args):
                 device_entry["dirroot"] = dirroot
             device_entry["robot_name"] = robot_name
         except json.decoder.JSONDecodeError:
-            device_entry = create_device_entry(fullpath, filename, dirroot, size, robot_name, local_tz)
+            device_entry = create_device_entry(fullpath, filename, dirroot, size, robot_name, local_tz, costs)
             if device_entry is None:
                 message_queue.put({"main_pbar": size})
                 return None
     else:
 
-        device_entry = create_device_entry(fullpath, filename, dirroot, size, robot_name, local_tz)
+        device_entry = create_device_entry(fullpath, filename, dirroot, size, robot_name, local_tz, costs)
         if device_entry is None:
             message_queue.put({"main_pbar": size})
             return
@@ -210,21 +495,41 @@ def metadata_worker(args):
     if filename in updates:
         device_entry.update( updates[filename])
 
-    try:
-        with open(metadata_filename, "w") as fid:
-            json.dump(device_entry, fid, indent=True)
-        os.chmod(metadata_filename, 0o777)
-
-    except PermissionError as e:
-        debug_print(f"Failed to write [{metadata_filename}]. Permission Denied")
-    except Exception as e:
-        debug_print(f"Error writing [{metadata_filename}]: {e}")
+    _write_metadata(metadata_filename, device_entry)
 
     message_queue.put({"main_pbar": size})
 
     return device_entry
 
 
+def details_worker(args):
+    """Fill in the expensive metadata fields of an entry
+
+    Args:
+        args: (device entry with PENDING set, local_tz)
+
+    Returns:
+        Tuple[Tuple[str, str], dict, list]: (dirroot, filename), the completed entry or None if the file can not be read, 
+        and the cost of the extraction (see ExtractorStats)
+    """
+    entry, local_tz = args
+    key = (entry["dirroot"], entry["filename"])
+    fullpath = os.path.join(entry["dirroot"], entry["filename"])
+
+    costs = []
+    metadata = expensive_metadata(fullpath, local_tz, costs)
+    if metadata is None:
+        debug_print(f"Failed to read the metadata of {fullpath}")
+        return key, None, costs
+
+    entry = dict(entry)
+    entry.update(metadata)
+    _finish_entry(entry)
+    entry.pop(PENDING, None)
+    _write_metadata(fullpath + ".metadata", entry)
+    return key, entry, costs
+
+
 def reindex_worker(args):
     message_queue, filename = args
     size = os.path.getsize(filename)
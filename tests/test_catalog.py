@@ -0,0 +1,149 @@
+import os
+import tempfile
+import unittest
+
+from device.catalog import Catalog, entry_key
+from device.merkle import EMPTY_DIGEST, MerkleTree, key_hash
+
+
+def entry(filename: str, size: int = 1, dirroot: str = "/media/data") -> dict:
+    return {"dirroot": dirroot, "filename": filename, "size": size, "site": "default", "robot_name": "robot"}
+
+
+class ChangesSinceTest(unittest.TestCase):
+
+    def test_delta(self):
+        catalog = Catalog()
+        catalog.update([entry("a"), entry("b")])
+        seq = catalog.seq
+
+        catalog.update([entry("a", size=2), entry("b")])
+        catalog.remove([("/media/data", "b")])
+        changes = catalog.changes_since(seq, catalog.epoch)
+        self.assertFalse(changes["full"])
+        self.assertEqual(changes["since"], seq)
+        self.assertEqual(changes["seq"], catalog.seq)
+        self.assertEqual(changes["updated"], [entry("a", size=2)])
+        self.assertEqual(changes["removed"], [["/media/data", "b"]])
+
+    def test_no_changes(self):
+        catalog = Catalog()
+        catalog.update([entry("a")])
+        self.assertEqual(catalog.update([entry("a")]), 0)
+        changes = catalog.changes_since(catalog.seq, catalog.epoch)
+        self.assertFalse(changes["full"])
+        self.assertEqual((changes["updated"], changes["removed"]), ([], []))
+
+    def test_full_for_another_epoch(self):
+        catalog = Catalog()
+        catalog.update([entry("a")])
+        for since, epoch in [(0, "other"), (0, None), (catalog.seq + 1, catalog.epoch)]:
+            with self.subTest(since=since, epoch=epoch):
+                changes = catalog.changes_since(since, epoch)
+                self.assertTrue(changes["full"])
+                self.assertEqual(changes["updated"], [entry("a")])
+
+    def test_full_after_forgotten_removals(self):
+        catalog = Catalog(max_tombstones=2)
+        catalog.update([entry(name) for name in "abcd"])
+        seq = catalog.seq
+        catalog.remove([("/media/data", "a")])
+        self.assertFalse(catalog.changes_since(seq, catalog.epoch)["full"])
+
+        catalog.remove([("/media/data", "b"), ("/media/data", "c")])
+        changes = catalog.changes_since(seq, catalog.epoch)
+        self.assertTrue(changes["full"])
+        self.assertEqual(changes["updated"], [entry("d")])
+
+        # the removals that are still remembered
+        changes = catalog.changes_since(seq + 1, catalog.epoch)
+        self.assertFalse(changes["full"])
+        self.assertEqual(sorted(changes["removed"]), [["/media/data", "b"], ["/media/data", "c"]])
+
+    def test_re_added_entry_is_not_removed(self):
+        catalog = Catalog()
+        catalog.update([entry("a")])
+        seq = catalog.seq
+        catalog.remove([("/media/data", "a")])
+        catalog.update([entry("a")])
+        changes = catalog.changes_since(seq, catalog.epoch)
+        self.assertEqual((changes["updated"], changes["removed"]), ([entry("a")], []))
+
+    def test_replace(self):
+        catalog = Catalog()
+        catalog.update([entry("a"), entry("b")])
+        seq = catalog.seq
+        catalog.replace([entry("b"), entry("c")])
+        changes = catalog.changes_since(seq, catalog.epoch)
+        self.assertEqual(changes["updated"], [entry("c")])
+        self.assertEqual(changes["removed"], [["/media/data", "a"]])
+
+    def test_save_and_load(self):
+        catalog = Catalog()
+        catalog.update([entry("a"), entry("b")])
+        with tempfile.TemporaryDirectory() as dirname:
+            filename = os.path.join(dirname, "catalog.json")
+            self.assertTrue(catalog.save(filename, keep=lambda e: e["filename"] != "b"))
+            loaded = Catalog()
+            self.assertEqual(loaded.load(filename), 1)
+        self.assertEqual(loaded.entries(), [entry("a")])
+        self.assertNotEqual(loaded.epoch, catalog.epoch)
+
+
+class DigestTest(unittest.TestCase):
+
+    def test_same_entries_same_digest(self):
+        first = Catalog()
+        second = Catalog()
+        self.assertEqual(first.digest(), EMPTY_DIGEST)
+        first.update([entry("a"), entry("b"), entry("c")])
+        second.update([entry("c"), entry("a")])
+        second.update([entry("b")])
+        self.assertEqual(first.digest(), second.digest())
+
+        second.update([entry("b", size=2)])
+        self.assertNotEqual(first.digest(), second.digest())
+        second.update([entry("b")])
+        self.assertEqual(first.digest(), second.digest())
+
+        first.remove([("/media/data", "a"), ("/media/data", "b"), ("/media/data", "c")])
+        self.assertEqual(first.digest(), EMPTY_DIGEST)
+
+    def test_descend_to_the_changed_bucket(self):
+        first = Catalog(merkle_depth=2)
+        second = Catalog(merkle_depth=2)
+        entries = [entry(f"file_{i}") for i in range(50)]
+        first.update(entries)
+        second.update(entries[:-1] + [dict(entries[-1], size=2)])
+
+        prefix = ""
+        for _ in range(2):
+            mine = first.digest_nodes([prefix])["nodes"][0]["children"]
+            theirs = second.digest_nodes([prefix])["nodes"][0]["children"]
+            different = [digit for digit in mine if mine[digit] != theirs[digit]]
+            self.assertEqual(len(different), 1)
+            prefix += different[0]
+
+        self.assertEqual(prefix, key_hash(entry_key(entries[-1]))[:2])
+        leaf = second.digest_nodes([prefix], with_entries=True)["nodes"][0]
+        self.assertIn(dict(entries[-1], size=2), leaf["updated"])
+
+    def test_invalid_prefixes(self):
+        catalog = Catalog(merkle_depth=2)
+        nodes = catalog.digest_nodes(["", "0", "abc", "xy", None, 3])
+        self.assertEqual([node["prefix"] for node in nodes["nodes"]], ["", "0", ""])
+        self.assertEqual(nodes["invalid"], ["abc", "xy", 3])
+
+    def test_tree_node(self):
+        tree = MerkleTree(depth=1)
+        key = ("/media/data", "a")
+        tree.set(key, entry("a"))
+        leaf = key_hash(key)[:1]
+        self.assertEqual([row[:2] for row in tree.node(leaf)["entries"]], [list(key)])
+        self.assertEqual(tree.node("")["children"][leaf], tree.digest(leaf))
+        tree.discard(key)
+        self.assertEqual(tree.digest(), EMPTY_DIGEST)
+
+
+if __name__ == "__main__":
+    unittest.main()
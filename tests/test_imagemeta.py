@@ -0,0 +1,121 @@
+import os
+import struct
+import tempfile
+import unittest
+import zlib
+
+from device.imagemeta import ImageFormatError, format_time, jpeg_datetime, png_datetime
+
+
+def tiff(entries0, exif_entries=None, order="<") -> bytes:
+    """A TIFF structured EXIF block. entries are (tag, ascii value), an Exif IFD is added for exif_entries"""
+    mark = b"II" if order == "<" else b"MM"
+    ifds = [list(entries0)]
+    if exif_entries is not None:
+        ifds.append(list(exif_entries))
+
+    # header, then each IFD, then the values
+    header = mark + struct.pack(order + "HI", 42, 8)
+    sizes = [2 + 12 * (len(entries) + (1 if i == 0 and exif_entries is not None else 0)) + 4 for i, entries in enumerate(ifds)]
+    offsets = [8]
+    for size in sizes[:-1]:
+        offsets.append(offsets[-1] + size)
+    values_offset = offsets[-1] + sizes[-1]
+
+    values = b""
+    blocks = []
+    for i, entries in enumerate(ifds):
+        packed = []
+        if i == 0 and exif_entries is not None:
+            packed.append(struct.pack(order + "HHII", 0x8769, 4, 1, offsets[1]))
+        for tag, text in entries:
+            raw = text.encode() + b"\0"
+            packed.append(struct.pack(order + "HHII", tag, 2, len(raw), values_offset + len(values)))
+            values += raw
+        blocks.append(struct.pack(order + "H", len(packed)) + b"".join(packed) + struct.pack(order + "I", 0))
+    return header + b"".join(blocks) + values
+
+
+def jpeg(exif: bytes = None) -> bytes:
+    data = b"\xff\xd8"
+    data += b"\xff\xe0" + struct.pack(">H", 16) + b"JFIF\0" + bytes(9)
+    if exif is not None:
+        segment = b"Exif\0\0" + exif
+        data += b"\xff\xe1" + struct.pack(">H", 2 + len(segment)) + segment
+    data += b"\xff\xda" + struct.pack(">H", 2) + b"pixels" + b"\xff\xd9"
+    return data
+
+
+def chunk(kind: bytes, data: bytes) -> bytes:
+    return struct.pack(">I4s", len(data), kind) + data + struct.pack(">I", zlib.crc32(kind + data))
+
+
+def png(*chunks: bytes) -> bytes:
+    ihdr = chunk(b"IHDR", struct.pack(">IIBBBBB", 1, 1, 8, 0, 0, 0, 0))
+    return b"\x89PNG\r\n\x1a\n" + ihdr + b"".join(chunks) + chunk(b"IDAT", b"") + chunk(b"IEND", b"")
+
+
+class FormatTimeTest(unittest.TestCase):
+
+    def test_exif_and_iso(self):
+        self.assertEqual(format_time("2024:05:06 07:08:09"), "2024-05-06 07:08:09")
+        self.assertEqual(format_time("2024-05-06T07:08:09Z"), "2024-05-06 07:08:09")
+
+    def test_not_a_time(self):
+        self.assertIsNone(format_time("0000:00:00 00:00:00"))
+        self.assertIsNone(format_time("yesterday"))
+
+
+class HeaderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.m_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.m_dir.cleanup()
+
+    def _write(self, name: str, data: bytes) -> str:
+        filename = os.path.join(self.m_dir.name, name)
+        with open(filename, "wb") as fid:
+            fid.write(data)
+        return filename
+
+    def test_jpeg_original_time(self):
+        exif = tiff([(0x0132, "2020:01:01 00:00:00")], [(0x9003, "2024:05:06 07:08:09")])
+        self.assertEqual(jpeg_datetime(self._write("a.jpg", jpeg(exif))), "2024-05-06 07:08:09")
+
+    def test_jpeg_big_endian_datetime(self):
+        exif = tiff([(0x0132, "2020:01:02 03:04:05")], order=">")
+        self.assertEqual(jpeg_datetime(self._write("a.jpg", jpeg(exif))), "2020-01-02 03:04:05")
+
+    def test_jpeg_without_exif(self):
+        self.assertIsNone(jpeg_datetime(self._write("a.jpg", jpeg())))
+
+    def test_not_a_jpeg(self):
+        with self.assertRaises(ImageFormatError):
+            jpeg_datetime(self._write("a.jpg", b"GIF89a"))
+
+    def test_png_exif_first(self):
+        data = png(chunk(b"tIME", struct.pack(">HBBBBB", 2021, 2, 3, 4, 5, 6)),
+                   chunk(b"eXIf", tiff([(0x0132, "2024:05:06 07:08:09")])))
+        self.assertEqual(png_datetime(self._write("a.png", data)), "2024-05-06 07:08:09")
+
+    def test_png_text_over_time_chunk(self):
+        data = png(chunk(b"tIME", struct.pack(">HBBBBB", 2021, 2, 3, 4, 5, 6)),
+                   chunk(b"zTXt", b"Creation Time\0\0" + zlib.compress(b"2022-03-04T05:06:07")))
+        self.assertEqual(png_datetime(self._write("a.png", data)), "2022-03-04 05:06:07")
+
+    def test_png_time_chunk(self):
+        data = png(chunk(b"tIME", struct.pack(">HBBBBB", 2021, 2, 3, 4, 5, 6)))
+        self.assertEqual(png_datetime(self._write("a.png", data)), "2021-02-03 04:05:06")
+
+    def test_png_without_time(self):
+        self.assertIsNone(png_datetime(self._write("a.png", png())))
+
+    def test_not_a_png(self):
+        with self.assertRaises(ImageFormatError):
+            png_datetime(self._write("a.png", b"\xff\xd8\xff"))
+
+
+if __name__ == "__main__":
+    unittest.main()
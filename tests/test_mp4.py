@@ -0,0 +1,81 @@
+import os
+import struct
+import tempfile
+import unittest
+
+from datetime import datetime, timezone
+
+from device.mp4 import Mp4FormatError, read_movie
+
+
+def box(kind: bytes, payload: bytes = b"") -> bytes:
+    return struct.pack(">I4s", 8 + len(payload), kind) + payload
+
+
+def mvhd(creation: int, timescale: int = 1000, duration: int = 5000, version: int = 0) -> bytes:
+    if version == 1:
+        return box(b"mvhd", bytes([1, 0, 0, 0]) + struct.pack(">QQIQ", creation, creation, timescale, duration))
+    return box(b"mvhd", bytes(4) + struct.pack(">IIII", creation, creation, timescale, duration))
+
+
+def day_tag(text: str) -> bytes:
+    value = text.encode()
+    return box(b"udta", box(b"\xa9day", struct.pack(">HH", len(value), 0) + value))
+
+
+def movie(*moov_children: bytes) -> bytes:
+    return box(b"ftyp", b"isom\0\0\0\0") + box(b"mdat", bytes(16)) + box(b"moov", b"".join(moov_children))
+
+
+class ReadMovieTest(unittest.TestCase):
+
+    def setUp(self):
+        self.m_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.m_dir.cleanup()
+
+    def _write(self, data: bytes) -> str:
+        filename = os.path.join(self.m_dir.name, "movie.mp4")
+        with open(filename, "wb") as fid:
+            fid.write(data)
+        return filename
+
+    def test_creation_time_and_duration(self):
+        # 2024-01-01 00:00:00 UTC
+        creation = int((datetime(2024, 1, 1, tzinfo=timezone.utc) - datetime(1904, 1, 1, tzinfo=timezone.utc)).total_seconds())
+        creation_time, duration = read_movie(self._write(movie(mvhd(creation))))
+        self.assertEqual(creation_time, datetime(2024, 1, 1, tzinfo=timezone.utc))
+        self.assertEqual(duration, 5.0)
+
+    def test_date_tag_without_creation_time(self):
+        creation_time, _ = read_movie(self._write(movie(mvhd(0), day_tag("2023-06-30T12:34:56"))))
+        self.assertEqual(creation_time, datetime(2023, 6, 30, 12, 34, 56, tzinfo=timezone.utc))
+
+    def test_zero_date_tag_is_no_time(self):
+        creation_time, duration = read_movie(self._write(movie(mvhd(0), day_tag("0000-00-00 00:00:00"))))
+        self.assertIsNone(creation_time)
+        self.assertEqual(duration, 5.0)
+
+    def test_creation_time_out_of_range(self):
+        creation_time, _ = read_movie(self._write(movie(mvhd(2**63, version=1), day_tag("2023-06-30 12:34:56"))))
+        self.assertEqual(creation_time, datetime(2023, 6, 30, 12, 34, 56, tzinfo=timezone.utc))
+
+        creation_time, _ = read_movie(self._write(movie(mvhd(2**63, version=1))))
+        self.assertIsNone(creation_time)
+
+    def test_no_moov(self):
+        with self.assertRaises(Mp4FormatError):
+            read_movie(self._write(box(b"ftyp", b"isom\0\0\0\0") + box(b"mdat", bytes(16))))
+
+    def test_not_an_mp4(self):
+        with self.assertRaises(Mp4FormatError):
+            read_movie(self._write(b"not a movie at all"))
+
+    def test_no_duration(self):
+        with self.assertRaises(Mp4FormatError):
+            read_movie(self._write(movie(mvhd(0, duration=0))))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,95 @@
+import os
+import struct
+import tempfile
+import unittest
+
+from device.rosbag1 import MAGIC, BagFormatError, getMetaDataROS1, read_index
+
+
+def record(fields: dict, data: bytes = b"") -> bytes:
+    header = b""
+    for name, value in fields.items():
+        field = name.encode() + b"=" + value
+        header += struct.pack("<I", len(field)) + field
+    return struct.pack("<I", len(header)) + header + struct.pack("<I", len(data)) + data
+
+
+def time_ns(secs: int, nsecs: int = 0) -> bytes:
+    return struct.pack("<II", secs, nsecs)
+
+
+def bag(connections: dict, chunks: list, indexed: bool = True) -> bytes:
+    """A ROS1 v2.0 bag with an index, but no messages. read_index() never reads the chunks
+
+    Args:
+        connections (dict): conn id -> topic
+        chunks (list): (start secs, end secs, {conn id: count})
+    """
+    index = b""
+    for conn, topic in connections.items():
+        index += record({"op": b"\x07", "conn": struct.pack("<I", conn), "topic": topic.encode()}, b"type=std_msgs/String")
+    for start, end, counts in chunks:
+        data = b"".join(struct.pack("<II", conn, count) for conn, count in counts.items())
+        index += record({"op": b"\x06", "ver": struct.pack("<I", 1), "chunk_pos": struct.pack("<Q", 0),
+                         "start_time": time_ns(start), "end_time": time_ns(end), "count": struct.pack("<I", len(counts))}, data)
+
+    # the bag header record is padded to 4096 bytes
+    index_pos = len(MAGIC) + 4096 if indexed else 0
+    fields = {"op": b"\x03", "index_pos": struct.pack("<Q", index_pos),
+              "conn_count": struct.pack("<I", len(connections)), "chunk_count": struct.pack("<I", len(chunks))}
+    header = record(fields)
+    header = record(fields, b" " * (4096 - len(header)))
+    return MAGIC + header + index
+
+
+class RosBag1Test(unittest.TestCase):
+
+    def setUp(self):
+        self.m_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.m_dir.cleanup()
+
+    def _write(self, data: bytes) -> str:
+        filename = os.path.join(self.m_dir.name, "test.bag")
+        with open(filename, "wb") as fid:
+            fid.write(data)
+        return filename
+
+    def test_read_index(self):
+        filename = self._write(bag({0: "/imu", 1: "/camera", 2: "/imu"},
+                                   [(100, 110, {0: 5, 1: 2}), (90, 120, {0: 1, 2: 3})]))
+        start_ns, end_ns, topics = read_index(filename)
+        self.assertEqual(start_ns, 90 * 1_000_000_000)
+        self.assertEqual(end_ns, 120 * 1_000_000_000)
+        self.assertEqual(topics, {"/camera": 2, "/imu": 9})
+
+    def test_metadata(self):
+        filename = self._write(bag({0: "/imu"}, [(1700000000, 1700000060, {0: 7})]))
+        self.assertEqual(getMetaDataROS1(filename, "UTC"), {
+            "start_time": "2023-11-14 22:13:20",
+            "end_time": "2023-11-14 22:14:20",
+            "topics": {"/imu": 7},
+        })
+
+    def test_not_indexed(self):
+        filename = self._write(bag({0: "/imu"}, [(1, 2, {0: 1})], indexed=False))
+        with self.assertRaises(BagFormatError):
+            read_index(filename)
+        self.assertIsNone(getMetaDataROS1(filename, "UTC"))
+
+    def test_no_chunks(self):
+        with self.assertRaises(BagFormatError):
+            read_index(self._write(bag({0: "/imu"}, [])))
+
+    def test_not_a_bag(self):
+        with self.assertRaises(BagFormatError):
+            read_index(self._write(b"#ROSBAG V1.2\n"))
+
+    def test_truncated_index(self):
+        data = bag({0: "/imu"}, [(1, 2, {0: 1})])
+        self.assertIsNone(getMetaDataROS1(self._write(data[:-10]), "UTC"))
+
+
+if __name__ == "__main__":
+    unittest.main()
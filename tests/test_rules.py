@@ -0,0 +1,94 @@
+import os
+import tempfile
+import time
+import unittest
+
+from device.rules import FileRules
+
+
+class IncludeTest(unittest.TestCase):
+
+    def test_include_suffix_wins_over_exclude_suffix(self):
+        rules = FileRules({"include_suffix": [".mcap", ".bag"], "exclude_suffix": [".mcap"]})
+        self.assertTrue(rules.include("run/a.mcap"))
+        self.assertTrue(rules.include("run/a.bag"))
+        self.assertFalse(rules.include("run/a.txt"))
+
+    def test_empty_include_suffix_includes_nothing(self):
+        rules = FileRules({"include_suffix": [], "exclude_suffix": [".txt"]})
+        self.assertFalse(rules.include("a.mcap"))
+        self.assertFalse(rules.include("a.txt"))
+
+    def test_exclude_suffix_without_include_suffix(self):
+        rules = FileRules({"exclude_suffix": [".txt"]})
+        self.assertTrue(rules.include("a.mcap"))
+        self.assertFalse(rules.include("a.txt"))
+
+    def test_hidden_files(self):
+        rules = FileRules({})
+        self.assertFalse(rules.include("run/.a.mcap"))
+        self.assertFalse(rules.include("run/_a.mcap"))
+        self.assertTrue(rules.include(".run/a.mcap"))
+
+    def test_globs(self):
+        rules = FileRules({"rules": {"include_glob": ["*.mcap", "keep/*"], "exclude_glob": ["*_tmp.mcap"]}})
+        self.assertTrue(rules.include("run/a.mcap"))
+        self.assertTrue(rules.include("keep/a.txt"))
+        self.assertFalse(rules.include("run/a.txt"))
+        self.assertFalse(rules.include("run/a_tmp.mcap"))
+
+    def test_regexes(self):
+        rules = FileRules({"rules": {"include_regex": [r"^2024/"], "exclude_regex": [r"debug"]}})
+        self.assertTrue(rules.include("2024/a.mcap"))
+        self.assertFalse(rules.include("2023/a.mcap"))
+        self.assertFalse(rules.include("2024/debug/a.mcap"))
+
+    def test_suffix_before_globs(self):
+        rules = FileRules({"include_suffix": [".mcap"], "rules": {"include_glob": ["*.txt"]}})
+        self.assertFalse(rules.include("a.mcap"))
+        self.assertFalse(rules.include("a.txt"))
+
+
+class KeepTest(unittest.TestCase):
+
+    def test_size_and_age(self):
+        rules = FileRules({"rules": {"min_size_b": 10, "max_size_b": 100, "max_age_days": 1}})
+        now = time.time()
+        self.assertTrue(rules.keep(50, now))
+        self.assertFalse(rules.keep(5, now))
+        self.assertFalse(rules.keep(500, now))
+        self.assertFalse(rules.keep(50, now - 2 * 24 * 3600))
+
+
+class WalkTest(unittest.TestCase):
+
+    def setUp(self):
+        self.m_dir = tempfile.TemporaryDirectory()
+        self.m_root = self.m_dir.name
+        for relpath in ["a.mcap", "tmp/b.mcap", "run/c.mcap", "run/d.txt", "run/cache/e.mcap"]:
+            path = os.path.join(self.m_root, relpath)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w") as fid:
+                fid.write("x")
+
+    def tearDown(self):
+        self.m_dir.cleanup()
+
+    def _walk(self, rules: FileRules, start: str = None):
+        return sorted(relpath for _, _, relpath in rules.walk(self.m_root, start or self.m_root))
+
+    def test_exclude_dirs(self):
+        rules = FileRules({"include_suffix": [".mcap"], "rules": {"exclude_dirs": ["tmp"]}})
+        self.assertEqual(self._walk(rules), ["a.mcap", "run/c.mcap", "run/cache/e.mcap"])
+
+    def test_storageignore(self):
+        with open(os.path.join(self.m_root, "run", ".storageignore"), "w") as fid:
+            fid.write("# not these\ncache/\n*.txt\n")
+        rules = FileRules({})
+        self.assertEqual(self._walk(rules), ["a.mcap", "run/c.mcap", "tmp/b.mcap"])
+        self.assertEqual(self._walk(rules, os.path.join(self.m_root, "run", "cache")), [])
+        self.assertEqual(self._walk(rules, os.path.join(self.m_root, "run", "d.txt")), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
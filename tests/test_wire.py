@@ -0,0 +1,82 @@
+import unittest
+
+from device import wire
+
+
+ENTRIES = [
+    {
+        "dirroot": "/media/data",
+        "filename": "2024/run_1/a.mcap",
+        "size": 1234,
+        "start_time": "2024-05-06 07:08:09",
+        "end_time": "2024-05-06 07:18:09",
+        "site": "default",
+        "robot_name": "robot",
+        "md5": None,
+        "topics": {"/camera": 10, "/imu": 200},
+    },
+    {
+        "dirroot": "/media/data",
+        "filename": "2024/run_1/b.txt",
+        "size": 0,
+        "site": "default",
+        "robot_name": "robot",
+        "md5": "0123456789abcdef",
+    },
+    {
+        "dirroot": "/media/other",
+        "filename": "c.bag",
+        "size": 5,
+        "site": "lab",
+        "robot_name": "robot",
+        "live": True,
+    },
+]
+
+REMOVED = [["/media/data", "2024/run_0/old.mcap"], ["/media/other", "gone.bag"]]
+
+
+def binary_encodings():
+    return [encoding for encoding in wire.supported_encodings() if encoding != wire.JSON]
+
+
+class WireTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        for encoding in binary_encodings():
+            with self.subTest(encoding=encoding):
+                updated, removed = wire.decode(wire.encode(ENTRIES, REMOVED, encoding), encoding)
+                self.assertEqual(updated, ENTRIES)
+                self.assertEqual(removed, REMOVED)
+
+    def test_empty(self):
+        for encoding in binary_encodings():
+            with self.subTest(encoding=encoding):
+                self.assertEqual(wire.decode(wire.encode([], [], encoding), encoding), ([], []))
+
+    def test_interned_keys_that_are_not_strings(self):
+        # an int could be mistaken for a string table index, and a list for a [directory, basename]
+        entries = [
+            {"dirroot": "/media/data", "filename": "a", "site": "default", "robot_name": "robot"},
+            {"dirroot": "/media/data", "filename": ["x", "y"], "site": 0, "robot_name": None, "topics": ["t"]},
+            {"dirroot": "/media/data", "filename": "b", "site": 1, "robot_name": 2},
+        ]
+        for encoding in binary_encodings():
+            with self.subTest(encoding=encoding):
+                updated, _ = wire.decode(wire.encode(entries, [], encoding), encoding)
+                self.assertEqual(updated, entries)
+
+    def test_unknown_encoding(self):
+        with self.assertRaises(ValueError):
+            wire.encode(ENTRIES, [], "msgpack+lzma")
+        with self.assertRaises(ValueError):
+            wire.decode(b"", "msgpack+lzma")
+
+    def test_negotiate(self):
+        self.assertEqual(wire.negotiate(["msgpack+lzma", "msgpack", "json"]), "msgpack")
+        self.assertEqual(wire.negotiate(["msgpack+lzma"]), wire.JSON)
+        self.assertEqual(wire.negotiate(None), wire.JSON)
+
+
+if __name__ == "__main__":
+    unittest.main()